@@ -1,11 +1,25 @@
 """
-Module to convert data to markdown using LlamaParse.
+Module to convert data to markdown using LlamaParse, or offline with local text extraction.
 """
 
+import argparse
+import asyncio
+import hashlib
+import json
 import os
-from llama_parse import LlamaParse
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
 from dotenv import load_dotenv
 
+from utils import find_pdf_docx
+
+MANIFEST_NAME = ".manifest.json"
+# mkstemp creates files readable by the owner only; outputs get the usual permissions instead
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
 def load_environment():
     """
     Load environment variables from a .env file.
@@ -15,47 +29,379 @@ def load_environment():
 def initialize_parser():
     """
     Initialize and return a LlamaParse parser with the specified configuration.
-    
+
     Returns:
         LlamaParse: An instance of LlamaParse configured with environment variables.
     """
+    from llama_parse import LlamaParse
+
     return LlamaParse(
-        api_key=os.getenv("LLAMAINDEX_PARSE_API_KEY"), 
-        result_type="markdown", 
-        num_workers=4, 
+        api_key=os.getenv("LLAMAINDEX_PARSE_API_KEY"),
+        result_type="markdown",
+        num_workers=4,
         verbose=True,
-        language="en",  
+        language="en",
     )
 
+def atomic_write(path: str, text: str):
+    """
+    Write a text file so readers never see it half written.
+
+    The text goes to a temporary file in the same folder, which then replaces the target.
+
+    Args:
+        path (str): The file to write.
+        text (str): The content.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, 0o666 & ~_UMASK)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def file_hash(path: str) -> str:
+    """
+    Return the SHA-256 hex digest of a file's content.
+
+    Args:
+        path (str): The file.
+
+    Returns:
+        str: The digest.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def output_stem(data_path: str) -> str:
+    """
+    Return the name a file's pages are saved under: its name up to the first dot.
+
+    Args:
+        data_path (str): The converted file.
+
+    Returns:
+        str: The stem.
+    """
+    return data_path.split("/")[-1].split(".")[0]
+
+def output_stems(sources: list) -> dict:
+    """
+    Pick the name each file's pages are saved under, so no two files of a folder share one.
+
+    A file keeps its usual stem unless another file of its folder has the same one, e.g.
+    foo.pdf and foo.docx; those use their whole name with dots as underscores (foo_pdf,
+    foo_docx) instead.
+
+    Args:
+        sources (list): The file paths.
+
+    Returns:
+        dict: The stem of each path.
+
+    Raises:
+        ValueError: If two files of one folder still get the same stem.
+    """
+    claims = {}
+    for data_path in sources:
+        claims.setdefault((os.path.dirname(data_path), output_stem(data_path)), []).append(data_path)
+    stems, taken = {}, {}
+    for (folder, usual), paths in claims.items():
+        for data_path in paths:
+            stem = usual if len(paths) == 1 else os.path.basename(data_path).replace(".", "_")
+            other = taken.setdefault((folder, stem), data_path)
+            if other != data_path:
+                raise ValueError(f"{other} and {data_path} would both be saved as {stem}_<page>")
+            stems[data_path] = stem
+    return stems
+
+def save_pages(pages: list, data_path: str, md_file_path: str, file_name: str = None) -> list:
+    """
+    Save each converted page as `<file name>_<page>` in the output folder.
+
+    Args:
+        pages (list): The text of each page.
+        data_path (str): The converted file.
+        md_file_path (str): The output folder.
+        file_name (str, optional): The name to save under; `output_stem(data_path)` by default.
+
+    Returns:
+        list: The paths written.
+    """
+    file_name = file_name or output_stem(data_path)
+    paths = []
+    for i, text in enumerate(pages):
+        path = f"{md_file_path}/{file_name}_{i}"
+        atomic_write(path, text)
+        paths.append(path)
+    return paths
+
+def local_load_pages(data_path: str) -> list:
+    """
+    Extract the text of a .docx or .pdf file without calling any service.
+
+    Word files are read with docx2txt, as one page; PDFs with llama-index's PDFReader, one
+    page per PDF page.
+
+    Args:
+        data_path (str): The file.
+
+    Returns:
+        list: The text of each page.
+    """
+    if data_path.lower().endswith(".docx"):
+        import docx2txt
+
+        return [docx2txt.process(data_path)]
+    from pathlib import Path
+    from llama_index.readers.file import PDFReader
+
+    return [document.text for document in PDFReader().load_data(file=Path(data_path))]
+
+def llamaparse_load_pages(data_path: str) -> list:
+    """
+    Convert a file to markdown with LlamaParse.
+
+    Args:
+        data_path (str): The file.
+
+    Returns:
+        list: The markdown of each page.
+    """
+    load_environment()
+    return [document.text for document in initialize_parser().load_data(data_path)]
+
+BACKENDS = {
+    "local": local_load_pages,
+    "llamaparse": llamaparse_load_pages,
+}
+
+def convert_file(data_path: str, md_file_path: str, backend: str, file_name: str = None) -> dict:
+    """
+    Convert one file and save its pages; runs in a pool worker.
+
+    Args:
+        data_path (str): The file.
+        md_file_path (str): The output folder.
+        backend (str): A BACKENDS key.
+        file_name (str, optional): The name to save the pages under.
+
+    Returns:
+        dict: The pages written, the input size and the seconds taken.
+    """
+    started = time.perf_counter()
+    os.makedirs(md_file_path, exist_ok=True)
+    outputs = save_pages(BACKENDS[backend](data_path), data_path, md_file_path, file_name)
+    return {
+        "outputs": outputs,
+        "bytes": os.path.getsize(data_path),
+        "seconds": time.perf_counter() - started,
+    }
+
+def find_sources(source_dir: str) -> list:
+    """
+    List the PDF and Word files under a folder and all its subfolders.
+
+    Args:
+        source_dir (str): The folder.
+
+    Returns:
+        list: The file paths.
+    """
+    sources = []
+    for folder, _, _ in sorted(os.walk(source_dir)):
+        sources.extend(find_pdf_docx(folder))
+    return sources
+
+def load_manifest(md_dir: str) -> dict:
+    """
+    Read the record of what was converted, by source path relative to the source folder.
+
+    Args:
+        md_dir (str): The output folder.
+
+    Returns:
+        dict: Per source, its sha256, the backend and the output paths; empty before the first run.
+    """
+    try:
+        with open(os.path.join(md_dir, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def prune_manifest(manifest: dict, names: set, md_dir: str) -> int:
+    """
+    Forget the sources that are gone from the source folder and delete their pages.
+
+    Pages also listed by a source that is still there are kept. Output subfolders left empty
+    are removed too; this runs before any file is converted, so no worker is writing to them.
+
+    Args:
+        manifest (dict): The manifest; updated in place.
+        names (set): The source paths found this run, relative to the source folder.
+        md_dir (str): The output folder.
+
+    Returns:
+        int: The number of sources removed.
+    """
+    gone = [name for name in manifest if name not in names]
+    kept = {output for name, entry in manifest.items() if name in names for output in entry["outputs"]}
+    folders = set()
+    for name in gone:
+        outputs = set(manifest.pop(name)["outputs"]) - kept
+        for output in outputs:
+            path = os.path.join(md_dir, output)
+            if os.path.exists(path):
+                os.remove(path)
+            folders.add(os.path.dirname(path))
+        print(f"{name}: source removed, {len(outputs)} pages deleted")
+    # deepest first, so a folder emptied of its subfolders goes too
+    for folder in sorted(folders, key=len, reverse=True):
+        while (os.path.normpath(folder) != os.path.normpath(md_dir) and os.path.isdir(folder)
+               and not os.listdir(folder)):
+            os.rmdir(folder)
+            folder = os.path.dirname(folder)
+    return len(gone)
+
+def convert_folder(source_dir: str, md_dir: str, backend: str = "local", workers: int = None, force: bool = False) -> dict:
+    """
+    Convert every PDF and Word file under a folder to markdown, on a bounded pool of workers.
+
+    The output mirrors the source subfolders. A file whose content and backend match the
+    manifest, and whose pages are all still there, is skipped; the manifest is saved after
+    every file, so an interrupted run picks up where it stopped. Pages a file no longer has
+    are removed, and so are the pages of files deleted from the source folder, along with their
+    manifest entries. Files of one folder that would share an output name are told apart by their
+    extension; see `output_stems`. Each file's throughput is printed as it finishes.
+
+    The local backend parses in a process pool, since text extraction is CPU bound; LlamaParse
+    waits on the network, so it runs in a thread pool.
+
+    Args:
+        source_dir (str): The folder of files to convert, e.g. sample_files.
+        md_dir (str): The output folder, e.g. sample_files_md.
+        backend (str): "local" (offline) or "llamaparse".
+        workers (int, optional): The pool size; the CPU count by default.
+        force (bool): Convert every file, even unchanged ones.
+
+    Returns:
+        dict: The number of files converted, skipped, failed and removed, and the run's throughput.
+    """
+    started = time.perf_counter()
+    os.makedirs(md_dir, exist_ok=True)
+    manifest = load_manifest(md_dir)
+    sources = find_sources(source_dir)
+    stems = output_stems(sources)
+    removed = prune_manifest(manifest, {os.path.relpath(data_path, source_dir) for data_path in sources}, md_dir)
+    if removed:
+        atomic_write(os.path.join(md_dir, MANIFEST_NAME), json.dumps(manifest, indent=2, sort_keys=True))
+    pending = {}
+    skipped = 0
+    for data_path in sources:
+        name = os.path.relpath(data_path, source_dir)
+        digest = file_hash(data_path)
+        entry = manifest.get(name)
+        if (not force and entry and entry["sha256"] == digest and entry["backend"] == backend
+                and all(os.path.basename(output).rsplit("_", 1)[0] == stems[data_path]
+                        and os.path.exists(os.path.join(md_dir, output)) for output in entry["outputs"])):
+            skipped += 1
+            continue
+        pending[name] = (data_path, digest)
+
+    pool_class = ProcessPoolExecutor if backend == "local" else ThreadPoolExecutor
+    converted, failed, total_bytes = 0, 0, 0
+    with pool_class(max_workers=workers or os.cpu_count() or 1) as pool:
+        futures = {
+            pool.submit(convert_file, data_path, os.path.join(md_dir, os.path.dirname(name)), backend,
+                        stems[data_path]): name
+            for name, (data_path, _) in pending.items()
+        }
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"{name}: failed: {e!r}")
+                continue
+            outputs = [os.path.relpath(path, md_dir) for path in result["outputs"]]
+            # a manifest written before names were told apart may list another file's pages
+            owned = {output for other, entry in manifest.items() if other != name for output in entry["outputs"]}
+            for stale in set(manifest.get(name, {}).get("outputs", [])) - set(outputs) - owned:
+                if os.path.exists(os.path.join(md_dir, stale)):
+                    os.remove(os.path.join(md_dir, stale))
+            manifest[name] = {"sha256": pending[name][1], "backend": backend, "outputs": outputs}
+            atomic_write(os.path.join(md_dir, MANIFEST_NAME), json.dumps(manifest, indent=2, sort_keys=True))
+            converted += 1
+            total_bytes += result["bytes"]
+            seconds = max(result["seconds"], 1e-9)
+            print(f"{name}: {len(outputs)} pages, {result['bytes'] / 1e6:.2f} MB in {seconds:.2f}s "
+                  f"({result['bytes'] / 1e6 / seconds:.2f} MB/s, {len(outputs) / seconds:.1f} pages/s)")
+
+    elapsed = time.perf_counter() - started
+    summary = {
+        "converted": converted,
+        "skipped": skipped,
+        "failed": failed,
+        "removed": removed,
+        "seconds": elapsed,
+        "mb_per_second": total_bytes / 1e6 / elapsed if elapsed else 0.0,
+    }
+    print(json.dumps(summary))
+    return summary
+
 class Parser:
     def __init__(self):
         load_environment()
         self.parser = initialize_parser()
-    
+
     async def convert_and_save_to_md(self, data_path: str, md_file_path: str):
         """
         Convert data to markdown format and save to specified file path.
-        
+
         Args:
             data_path (str): The path to the data to be converted.
             md_file_path (str): The path where the markdown files will be saved.
         """
-        document = self.parser.load_data(data_path)
-        for i in range(len(document)):
-            file_name = data_path.split("/")[-1].split(".")[0]
-            with open(f"{md_file_path}/{file_name}_{i}", "w") as f:
-                f.write(document[i].text)
-    
+        document = await self.parser.aload_data(data_path)
+        # file writes are blocking; keep them off the event loop
+        await asyncio.to_thread(save_pages, [page.text for page in document], data_path, md_file_path)
+
     async def convert_to_md(self, data_path: str):
         """
         Convert data to markdown format using the LlamaParse parser.
-        
+
         Args:
             data_path (str): The path to the data to be converted.
-        
+
         Returns:
             The parsed documents in markdown format.
         """
-        document = self.parser.load_data(data_path)
+        document = await self.parser.aload_data(data_path)
         return document
-        
\ No newline at end of file
+
+def main():
+    """
+    Convert sample_files to sample_files_md, skipping files converted before.
+    """
+    parser = argparse.ArgumentParser(description="Convert the PDF and Word files of a folder to markdown.")
+    parser.add_argument("source_dir", nargs="?", default="sample_files")
+    parser.add_argument("md_dir", nargs="?", default="sample_files_md")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="local",
+                        help="local runs offline with docx2txt and PDFReader; llamaparse calls LlamaParse.")
+    parser.add_argument("--workers", type=int, help="Pool size; the CPU count by default.")
+    parser.add_argument("--force", action="store_true", help="Convert unchanged files too.")
+    args = parser.parse_args()
+    convert_folder(args.source_dir, args.md_dir, args.backend, args.workers, args.force)
+
+if __name__ == "__main__":
+    main()
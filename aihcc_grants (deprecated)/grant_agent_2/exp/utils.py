@@ -2,9 +2,19 @@ import os
 import glob
 
 def find_pdf_docx(folder_path):
-    os.chdir(folder_path)
-    pdf_files = glob.glob("*.pdf")
-    docx_files = glob.glob("*.docx")
-    all_files = pdf_files + docx_files
-    all_files = [f"{folder_path.rstrip('/')}/{file}" for file in all_files]
-    return all_files
\ No newline at end of file
+    """
+    List the PDF and Word files directly inside a folder.
+
+    Globs against the folder path instead of changing the working directory, so it is safe
+    to call from several threads at once.
+
+    Args:
+        folder_path (str): The folder to search.
+
+    Returns:
+        list: The paths of the PDF files, then the .docx files, each sorted by name.
+    """
+    folder = glob.escape(folder_path.rstrip('/'))
+    pdf_files = sorted(glob.glob(os.path.join(folder, "*.pdf")))
+    docx_files = sorted(glob.glob(os.path.join(folder, "*.docx")))
+    return [f"{folder_path.rstrip('/')}/{os.path.basename(file)}" for file in pdf_files + docx_files]
@@ -0,0 +1,181 @@
+from collections import defaultdict
+
+import numpy as np
+
+
+class CSRIndex:
+    """
+    Compressed sparse row adjacency: row `i` holds `indices[indptr[i]:indptr[i + 1]]`.
+
+    An optional `values` array runs parallel to `indices`.
+    """
+
+    def __init__(self, indptr, indices, values=None):
+        self.indptr = indptr
+        self.indices = indices
+        self.values = values
+
+    @classmethod
+    def from_pairs(cls, rows, cols, n_rows, values=None):
+        """
+        Build the index from (row, column) pairs, keeping the given order within each row.
+
+        Args:
+            rows (array-like): The row of each pair.
+            cols (array-like): The column of each pair.
+            n_rows (int): The number of rows.
+            values (array-like, optional): A value per pair.
+
+        Returns:
+            CSRIndex: The index.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        order = np.argsort(rows, kind="stable")
+        indptr = np.zeros(n_rows + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=n_rows), out=indptr[1:])
+        indices = np.asarray(cols, dtype=np.int32)[order]
+        if values is not None:
+            values = np.asarray(values, dtype=np.int32)[order]
+        return cls(indptr, indices, values)
+
+    def row(self, i):
+        """
+        Return the columns of one row.
+
+        Args:
+            i (int): The row.
+
+        Returns:
+            ndarray: A view of the row's column indices.
+        """
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+
+    def row_values(self, i):
+        """
+        Return the values of one row.
+
+        Args:
+            i (int): The row.
+
+        Returns:
+            ndarray: A view of the row's values.
+        """
+        return self.values[self.indptr[i]:self.indptr[i + 1]]
+
+    @property
+    def nbytes(self):
+        return self.indptr.nbytes + self.indices.nbytes + (
+            self.values.nbytes if self.values is not None else 0)
+
+
+def _ranking_value(relationship, ranking_attribute):
+    if relationship.attributes and ranking_attribute in relationship.attributes:
+        return int(relationship.attributes[ranking_attribute])
+    if ranking_attribute == "weight":
+        return relationship.weight or 0.0
+    return 0
+
+
+class LocalAdjacency:
+    """
+    Entity adjacency for local search, built once per engine.
+
+    `entity_relationships` maps each entity title to the relationships touching it. Rather than
+    relationship positions it stores ordinals into `ranked_relationships`, the relationships
+    sorted by `ranking_attribute` (descending, ties in artifact order), so the union of a few
+    rows, sorted, is already in the order graphrag's stable sort would produce.
+
+    `entity_text_units` maps each entity id to the positions in `text_units` of the units it
+    appears in, in `entity.text_unit_ids` order. Its values are the number of the entity's
+    relationships associated with each unit, as graphrag's `count_relationships` computes it.
+    """
+
+    def __init__(self, entities, relationships, text_units, ranking_attribute="rank"):
+        """
+        Args:
+            entities (list): Entity instances.
+            relationships (list): Relationship instances, in artifact order.
+            text_units (list): TextUnit instances.
+            ranking_attribute (str): The relationship attribute ranked on.
+        """
+        self.ranking_attribute = ranking_attribute
+        self.entity_rows = {}
+        for entity in entities:
+            self.entity_rows.setdefault(entity.title, len(self.entity_rows))
+
+        ranks = [_ranking_value(relationship, ranking_attribute) for relationship in relationships]
+        ranked = sorted(range(len(relationships)), key=lambda i: -ranks[i])
+        self.ranked_relationships = [relationships[i] for i in ranked]
+
+        rows, ordinals = [], []
+        for ordinal, relationship in enumerate(self.ranked_relationships):
+            for title in {relationship.source, relationship.target}:
+                if title in self.entity_rows:
+                    rows.append(self.entity_rows[title])
+                    ordinals.append(ordinal)
+        self.entity_relationships = CSRIndex.from_pairs(rows, ordinals, len(self.entity_rows))
+
+        self.text_units = list(text_units)
+        unit_positions = {unit.id: position for position, unit in enumerate(self.text_units)}
+
+        # count, in one pass, the relationships of each entity associated with each text unit:
+        # through the unit's relationship_ids, or the relationships' text_unit_ids when absent
+        unit_counts = defaultdict(int)
+        relationships_by_id = {relationship.id: relationship for relationship in relationships}
+        for unit in self.text_units:
+            for rel_id in unit.relationship_ids or []:
+                relationship = relationships_by_id.get(rel_id)
+                if relationship is not None:
+                    for title in {relationship.source, relationship.target}:
+                        unit_counts[title, unit.id] += 1
+        for relationship in relationships:
+            for text_id in set(relationship.text_unit_ids or []):
+                position = unit_positions.get(text_id)
+                if position is not None and self.text_units[position].relationship_ids is None:
+                    for title in {relationship.source, relationship.target}:
+                        unit_counts[title, text_id] += 1
+
+        self.entity_ids = {entity.id: row for row, entity in enumerate(entities)}
+        rows, positions, counts = [], [], []
+        for row, entity in enumerate(entities):
+            for text_id in dict.fromkeys(entity.text_unit_ids or []):
+                if text_id in unit_positions:
+                    rows.append(row)
+                    positions.append(unit_positions[text_id])
+                    counts.append(unit_counts.get((entity.title, text_id), 0))
+        self.entity_text_units = CSRIndex.from_pairs(rows, positions, len(entities), values=counts)
+
+    def relationships_of(self, entities):
+        """
+        Return every relationship touching any of `entities`, in ranked order.
+
+        Args:
+            entities (list): Entity instances.
+
+        Returns:
+            list: The relationships, each once.
+        """
+        rows = [self.entity_rows[entity.title] for entity in entities if entity.title in self.entity_rows]
+        if not rows:
+            return []
+        ordinals = np.unique(np.concatenate([self.entity_relationships.row(row) for row in rows]))
+        return [self.ranked_relationships[ordinal] for ordinal in ordinals.tolist()]
+
+    def text_units_of(self, entity):
+        """
+        Return the text units an entity appears in, with its relationship count in each.
+
+        Args:
+            entity (Entity): The entity.
+
+        Returns:
+            tuple: Arrays of text unit positions and relationship counts.
+        """
+        row = self.entity_ids.get(entity.id)
+        if row is None:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32)
+        return self.entity_text_units.row(row), self.entity_text_units.row_values(row)
+
+    @property
+    def nbytes(self):
+        return self.entity_relationships.nbytes + self.entity_text_units.nbytes
@@ -1,31 +1,174 @@
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
+from typing import Literal
+
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from pydantic import BaseModel
-from global_search import ask_query_global
-from local_search import ask_query_local
+from embedding_cache import get_embedding_cache
+from engine_registry import EngineNotReadyError, registry
+from index_runs import POLL_SECONDS
+from llm_clients import get_client_pool
+from global_search import aask_query_global
+from local_search import aask_query_local
+from map_cache import get_map_cache
+import metrics
+from rate_governor import INTERACTIVE, get_rate_governor
+import report_prefilter
+from response_cache import get_response_cache
+from semantic_cache import get_semantic_cache
+from streaming import stream_search
 import uvicorn
 
-app = FastAPI()
+logger = logging.getLogger(__name__)
+
+# Searches each engine runs at once; further requests wait their turn, cache hits never do
+SEARCH_CONCURRENCY = {
+    "local": int(os.getenv("GRAPHRAG_LOCAL_SEARCH_CONCURRENCY", "64")),
+    "global": int(os.getenv("GRAPHRAG_GLOBAL_SEARCH_CONCURRENCY", "16")),
+}
+search_limits = {name: asyncio.Semaphore(limit) for name, limit in SEARCH_CONCURRENCY.items()}
+# Watch for new index runs in this process; serve.py turns this off and watches in its supervisor
+WATCH_INDEX = POLL_SECONDS > 0
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Build the engines in the background so the port is bound straight away
+    registry.start()
+    if WATCH_INDEX:
+        registry.watch()
+    yield
+
+app = FastAPI(lifespan=lifespan)
 
 class QueryRequest(BaseModel):
     query: str
+    # Set to False to skip answers reused from similar, but not identical, earlier queries
+    semantic_cache: bool = True
+    # Set to True to get the seconds spent in each stage of the search in the response
+    timings: bool = False
 
-@app.post("/global_search")
-def global_search(request: QueryRequest):
+class AdmissionRequest(BaseModel):
+    # The estimated tokens of the LLM call, see rate_governor.estimate_tokens
+    tokens: int
+    priority: Literal["interactive", "batch"] = INTERACTIVE
+
+@app.get("/health")
+def health():
+    return {"status": "ok"}
+
+@app.get("/ready")
+def ready():
+    status_code = 200 if registry.is_ready() else 503
+    return JSONResponse(status_code=status_code, content=registry.status())
+
+@app.get("/ready/{engine}")
+def engine_ready(engine: str):
+    engines = registry.status()
+    if engine not in engines:
+        raise HTTPException(status_code=404, detail=f"Unknown engine: {engine}")
+    status_code = 200 if registry.is_ready(engine) else 503
+    return JSONResponse(status_code=status_code, content=engines[engine])
+
+@app.get("/cache/stats")
+def cache_stats():
+    return {
+        "query_embeddings": get_embedding_cache().snapshot(),
+        "responses": get_response_cache().snapshot(),
+        "semantic_responses": get_semantic_cache().snapshot(),
+        "map_responses": get_map_cache().snapshot(),
+        "report_prefilter": report_prefilter.snapshot(),
+    }
+
+@app.get("/llm/stats")
+def llm_stats():
+    return {**get_rate_governor().snapshot(), "clients": get_client_pool().snapshot()}
+
+@app.post("/llm/admission")
+async def llm_admission(request: AdmissionRequest):
+    # The chat bot's LLM calls queue here, so they share this process's budgets and priorities
+    await get_rate_governor().aacquire(request.tokens, request.priority)
+    return {"admitted": True}
+
+@app.get("/metrics")
+def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+SEARCHES = {"global": aask_query_global, "local": aask_query_local}
+# The fields of a search result returned to clients; context_data stays on the server
+RESPONSE_FIELDS = (
+    "response", "llm_calls", "prompt_tokens", "cached", "coalesced",
+    # global search only: map calls answered from the map cache, and skipped by the report prefilter
+    "map_calls_saved", "map_prompt_tokens_saved", "reports_selected", "map_calls_skipped",
+)
+# The counters of a search result worth a place in its log line, when present
+LOGGED_COUNTERS = ("map_calls_saved", "map_prompt_tokens_saved", "reports_selected", "map_calls_skipped")
+
+
+async def traced_search(engine, request, trace):
+    """Run a search inside its request trace, recording failed requests in the request metrics."""
     try:
-        res = ask_query_global(request.query)
-        print(res)
-        return {"response": res['response']}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        return await SEARCHES[engine](
+            request.query, use_semantic_cache=request.semantic_cache, limit=search_limits[engine])
+    except Exception:
+        metrics.observe_request(trace, None, outcome="error")
+        raise
+
+
+def observe_search(engine, trace, res):
+    """Record an answered request in the request metrics, once its response is ready to send."""
+    outcome = metrics.observe_request(trace, res)
+    counters = "".join(f", {name}={res[name]}" for name in LOGGED_COUNTERS if name in res)
+    logger.info("%s search answered (%s) in %.3fs: %s LLM calls, %s prompt tokens%s", engine, outcome,
+                trace.timings()["total_seconds"], res.get("llm_calls"), res.get("prompt_tokens"), counters)
+
+
+async def search_response(engine, request):
+    with metrics.trace_request(engine) as trace:
+        try:
+            res = await traced_search(engine, request, trace)
+        except EngineNotReadyError as e:
+            raise HTTPException(status_code=503, detail=str(e))
+        except Exception as e:
+            logger.exception("%s search failed", engine)
+            raise HTTPException(status_code=500, detail=str(e))
+        body = {field: res[field] for field in RESPONSE_FIELDS if field in res}
+        with metrics.stage("serialization"):
+            content = JSONResponse(content=body).body
+        if request.timings:
+            # the body is already bytes, so the timings, serialization included, are spliced in
+            timings = JSONResponse(content=trace.timings()).body
+            content = content[:-1] + (b"," if body else b"") + b'"timings":' + timings + b"}"
+        observe_search(engine, trace, res)
+        return Response(content=content, media_type="application/json")
+
+
+def stream_response(engine, request):
+    async def search():
+        with metrics.trace_request(engine) as trace:
+            res = await traced_search(engine, request, trace)
+            observe_search(engine, trace, res)
+            return {**res, "timings": trace.timings()} if request.timings else res
+    return StreamingResponse(stream_search(search), media_type="text/event-stream")
+
+@app.post("/global_search")
+async def global_search(request: QueryRequest):
+    return await search_response("global", request)
 
 @app.post("/local_search")
-def local_search(request: QueryRequest):
-    try:
-        res = ask_query_local(request.query)
-        print(res)
-        return {"response": res['response']}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+async def local_search(request: QueryRequest):
+    return await search_response("local", request)
+
+@app.post("/global_search/stream")
+async def global_search_stream(request: QueryRequest):
+    return stream_response("global", request)
+
+@app.post("/local_search/stream")
+async def local_search_stream(request: QueryRequest):
+    return stream_response("local", request)
 
 if __name__ == "__main__":
     import uvicorn
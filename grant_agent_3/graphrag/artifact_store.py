@@ -0,0 +1,146 @@
+import os
+import threading
+
+import pyarrow.parquet as pq
+
+from file_utils import file_digest
+
+
+class ArtifactStore:
+    """
+    Read-once cache of the `create_final_*` parquet artifacts of one index run.
+
+    Each table is decoded into Arrow at most once per process and only for the
+    columns some engine has asked for, so the engines of a run share one read of
+    the files. The store only lives while the engines are being built: they keep
+    DataFrames and model objects of their own, and the registry releases the
+    store once the last engine of the run is built.
+    """
+
+    def __init__(self, input_dir):
+        self.input_dir = input_dir
+        self._lock = threading.Lock()
+        self._table_locks = {}
+        self._tables = {}
+        self._fingerprints = {}
+
+    def _table_lock(self, name):
+        with self._lock:
+            return self._table_locks.setdefault(name, threading.Lock())
+
+    def path(self, name):
+        """
+        Return the parquet path of an artifact table.
+
+        Args:
+            name (str): The table name, e.g. "create_final_nodes".
+
+        Returns:
+            str: The path to the parquet file.
+        """
+        return os.path.join(self.input_dir, f"{name}.parquet")
+
+    def fingerprint(self, name):
+        """
+        Return the content hash of an artifact table's parquet file.
+
+        Args:
+            name (str): The table name.
+
+        Returns:
+            str: The SHA-256 hex digest of the file.
+        """
+        with self._table_lock(name):
+            if name not in self._fingerprints:
+                self._fingerprints[name] = file_digest(self.path(name))
+            return self._fingerprints[name]
+
+    def table(self, name, columns):
+        """
+        Return a zero-copy Arrow view of the requested columns of a table.
+
+        Columns not decoded yet are read from disk and added to the shared table;
+        columns another engine already loaded are reused as is.
+
+        Args:
+            name (str): The table name.
+            columns (list): The columns the caller needs.
+
+        Returns:
+            pyarrow.Table: The selected columns, sharing buffers with the store.
+        """
+        with self._table_lock(name):
+            loaded = self._tables.get(name)
+            have = set(loaded.column_names) if loaded is not None else set()
+            missing = [column for column in columns if column not in have]
+            if missing:
+                new_columns = pq.read_table(self.path(name), columns=missing)
+                if loaded is None:
+                    loaded = new_columns
+                else:
+                    for field, column in zip(new_columns.schema, new_columns.columns):
+                        loaded = loaded.append_column(field, column)
+                self._tables[name] = loaded
+        return loaded.select(columns)
+
+    def frame(self, name, columns):
+        """
+        Return the requested columns of a table as a pandas DataFrame.
+
+        Numeric columns may share the Arrow buffers, but string and list columns are
+        copied into Python objects, so every call pays for its own conversion. The
+        DataFrame is meant to be short-lived: the engines turn it into model objects
+        and drop it.
+
+        Args:
+            name (str): The table name.
+            columns (list): The columns the caller needs.
+
+        Returns:
+            DataFrame: The selected columns.
+        """
+        return self.table(name, columns).to_pandas(split_blocks=True)
+
+    def nbytes(self):
+        """
+        Return the number of bytes held by the decoded tables.
+
+        Returns:
+            int: The total size of the Arrow buffers.
+        """
+        with self._lock:
+            return sum(table.nbytes for table in self._tables.values())
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(input_dir):
+    """
+    Return the process-wide artifact store for an index run directory.
+
+    Args:
+        input_dir (str): The directory containing the parquet artifacts.
+
+    Returns:
+        ArtifactStore: The shared store for that directory.
+    """
+    key = os.path.abspath(input_dir)
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = ArtifactStore(key)
+        return _stores[key]
+
+
+def release_store(input_dir):
+    """
+    Forget the artifact store of an index run so its tables can be freed.
+
+    Engines that still reference its tables keep them alive until they are dropped.
+
+    Args:
+        input_dir (str): The directory containing the parquet artifacts.
+    """
+    with _stores_lock:
+        _stores.pop(os.path.abspath(input_dir), None)
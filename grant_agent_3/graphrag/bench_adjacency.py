@@ -0,0 +1,153 @@
+import argparse
+import json
+import random
+import statistics
+import time
+
+from graphrag.model import Entity, Relationship, TextUnit
+from graphrag.query.structured_search.local_search.mixed_context import LocalSearchMixedContext
+
+from context_builders import IndexedLocalContext
+from numpy_vector_store import NumpyVectorStore
+
+ENTITIES = 100_000
+RELATIONSHIPS = 400_000
+TEXT_UNITS = 50_000
+QUERIES = 5
+MAPPED_ENTITIES = 10
+LOCAL_TOKENS = 4_800  # max_tokens (12k) times the local share (1 - 0.5 - 0.1)
+TEXT_UNIT_TOKENS = 6_000
+
+
+class WhitespaceEncoder:
+    """Stand-in token encoder so the benchmark measures context building, not BPE."""
+
+    def encode(self, text):
+        return text.split()
+
+
+def synthetic_graph(n_entities, n_relationships, n_text_units, rng):
+    """
+    Generate entities, relationships and text units with a skewed degree distribution.
+
+    Args:
+        n_entities (int): The number of entities.
+        n_relationships (int): The number of relationships.
+        n_text_units (int): The number of text units.
+        rng (random.Random): The random generator.
+
+    Returns:
+        tuple: Lists of Entity, Relationship and TextUnit.
+    """
+    titles = [f"ENTITY {i}" for i in range(n_entities)]
+    unit_ids = [f"unit-{i}" for i in range(n_text_units)]
+    degree = [0] * n_entities
+    unit_relationships = {unit_id: [] for unit_id in unit_ids}
+    entity_units = [set() for _ in range(n_entities)]
+    relationships = []
+    for i in range(n_relationships):
+        # Skewed endpoints give a few hub entities, as in real extractions
+        source = int(n_entities * rng.random() ** 3)
+        target = rng.randrange(n_entities)
+        if source == target:
+            target = (target + 1) % n_entities
+        units = rng.sample(unit_ids, 2)
+        for unit_id in units:
+            unit_relationships[unit_id].append(f"rel-{i}")
+            entity_units[source].add(unit_id)
+            entity_units[target].add(unit_id)
+        degree[source] += 1
+        degree[target] += 1
+        relationships.append(Relationship(
+            id=f"rel-{i}", short_id=str(i), source=titles[source], target=titles[target],
+            weight=rng.random(), description=f"{titles[source]} relates to {titles[target]}",
+            text_unit_ids=units))
+    for relationship in relationships:
+        source = int(relationship.source.split()[1])
+        target = int(relationship.target.split()[1])
+        relationship.attributes = {"rank": degree[source] + degree[target]}
+    entities = [
+        Entity(
+            id=f"entity-{i}", short_id=str(i), title=titles[i], rank=degree[i],
+            description=f"Description of {titles[i]}", text_unit_ids=sorted(entity_units[i]))
+        for i in range(n_entities)
+    ]
+    text_units = [
+        TextUnit(id=unit_id, short_id=str(i), text=f"Text of {unit_id} " * 20,
+                 relationship_ids=unit_relationships[unit_id])
+        for i, unit_id in enumerate(unit_ids)
+    ]
+    return entities, relationships, text_units
+
+
+def time_builder(builder, queries):
+    """
+    Time local and text unit context building for each query.
+
+    Args:
+        builder (LocalSearchMixedContext): The context builder.
+        queries (list): Lists of selected entities.
+
+    Returns:
+        tuple: The contexts built and the latencies in milliseconds.
+    """
+    contexts, latencies = [], []
+    for selected in queries:
+        started = time.perf_counter()
+        local_context, _ = builder._build_local_context(
+            selected_entities=selected, max_tokens=LOCAL_TOKENS, include_entity_rank=True,
+            include_relationship_weight=True, top_k_relationships=10)
+        text_unit_context, _ = builder._build_text_unit_context(
+            selected_entities=selected, max_tokens=TEXT_UNIT_TOKENS)
+        latencies.append((time.perf_counter() - started) * 1000)
+        contexts.append((local_context, text_unit_context))
+    return contexts, latencies
+
+
+def main():
+    """Compare the stock and the adjacency-indexed local context builders on a synthetic graph."""
+    parser = argparse.ArgumentParser(description="Benchmark CSR adjacency for local search context building.")
+    parser.add_argument("--entities", type=int, default=ENTITIES)
+    parser.add_argument("--relationships", type=int, default=RELATIONSHIPS)
+    parser.add_argument("--text-units", type=int, default=TEXT_UNITS)
+    parser.add_argument("--queries", type=int, default=QUERIES)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    entities, relationships, text_units = synthetic_graph(
+        args.entities, args.relationships, args.text_units, rng)
+    # Bias the mapped entities towards hubs, which is where the full scans hurt most
+    queries = [
+        [entities[int(len(entities) * rng.random() ** 2)] for _ in range(MAPPED_ENTITIES)]
+        for _ in range(args.queries)
+    ]
+    queries = [list({entity.id: entity for entity in selected}.values()) for selected in queries]
+    kwargs = dict(
+        entities=entities, relationships=relationships, text_units=text_units,
+        entity_text_embeddings=NumpyVectorStore(collection_name="bench"),
+        text_embedder=None, token_encoder=WhitespaceEncoder())
+
+    stock = LocalSearchMixedContext(**kwargs)
+    started = time.perf_counter()
+    indexed = IndexedLocalContext(**kwargs)
+    index_seconds = time.perf_counter() - started
+
+    # graphrag annotates relationships in place on first use; warm up so both builders see the same state
+    time_builder(stock, queries)
+    stock_contexts, stock_ms = time_builder(stock, queries)
+    indexed_contexts, indexed_ms = time_builder(indexed, queries)
+
+    print(json.dumps({
+        "entities": args.entities,
+        "relationships": args.relationships,
+        "text_units": args.text_units,
+        "index_build_s": index_seconds,
+        "index_mb": indexed.adjacency.nbytes / 1e6,
+        "stock_ms_p50": statistics.median(stock_ms),
+        "indexed_ms_p50": statistics.median(indexed_ms),
+        "identical_context": stock_contexts == indexed_contexts,
+    }))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+import argparse
+import asyncio
+import json
+
+import httpx
+
+import api
+import global_search
+import local_search
+from bench_context import StandInEmbedding, StandInLLM
+from embedding_cache import CachedTextEmbedding, EmbeddingCache
+from engine_registry import registry
+from loadtest import load, make_queries
+
+CONCURRENCY = 64
+REQUESTS = 512
+LATENCY_SECONDS = 0.5
+
+
+@api.app.post("/bench/sync_search/{engine}")
+def sync_search(engine: str, request: api.QueryRequest):
+    """
+    The pre-async handler: a blocking search, with its own event loop, on the threadpool.
+
+    graphrag's GlobalSearch shares one asyncio.Semaphore (32 map calls) across those loops,
+    so past 32 concurrent global searches this handler fails with "bound to a different
+    event loop" errors or hangs.
+    """
+    ask = local_search.ask_query_local if engine == "local" else global_search.ask_query_global
+    return {"response": ask(request.query, wait=False, use_semantic_cache=request.semantic_cache)["response"]}
+
+
+async def run(engine, handlers, concurrency, requests):
+    paths = {"sync_handler": f"/bench/sync_search/{engine}", "async_handler": f"/{engine}_search"}
+    transport = httpx.ASGITransport(app=api.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        return {
+            handler: await load(
+                client, paths[handler], concurrency, make_queries(paths[handler], requests),
+                body={"semantic_cache": False})
+            for handler in handlers
+        }
+
+
+def main():
+    """Load-test the sync and async search handlers in-process against stand-in models."""
+    parser = argparse.ArgumentParser(description="Benchmark the search API handlers against a stand-in LLM.")
+    parser.add_argument("--engine", choices=["local", "global"], default="local")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--requests", type=int, default=REQUESTS)
+    parser.add_argument("--latency", type=float, default=LATENCY_SECONDS, help="Stand-in LLM latency in seconds.")
+    parser.add_argument("--handlers", nargs="+", choices=["sync_handler", "async_handler"],
+                        default=["sync_handler", "async_handler"])
+    args = parser.parse_args()
+
+    embedding_cache = EmbeddingCache(disk_path=None)
+    local_search.setup_llm = lambda *_, **__: StandInLLM(args.latency)
+    local_search.setup_text_embedder = lambda: CachedTextEmbedding(
+        StandInEmbedding(), model="stand-in", cache=embedding_cache)
+    global_search.initialize_llm = lambda *_: StandInLLM(args.latency)
+    # Let the async handlers run every request at once, so only the handler style limits throughput
+    api.search_limits[args.engine] = asyncio.Semaphore(args.concurrency)
+
+    with registry.lease(args.engine):
+        pass
+    print(json.dumps({
+        "engine": args.engine,
+        "concurrency": args.concurrency,
+        "requests": args.requests,
+        "llm_latency_s": args.latency,
+        **asyncio.run(run(args.engine, args.handlers, args.concurrency, args.requests)),
+    }))
+
+
+if __name__ == "__main__":
+    main()
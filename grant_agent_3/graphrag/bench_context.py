@@ -0,0 +1,233 @@
+import argparse
+import asyncio
+import gc
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+# The engines read their model settings at import; the stand-ins below never use them
+for name in ("GRAPHRAG_API_KEY", "GRAPHRAG_LLM_MODEL", "GRAPHRAG_EMBEDDING_MODEL"):
+    os.environ.setdefault(name, "stand-in")
+
+from graphrag.query.llm.base import BaseLLM, BaseTextEmbedding
+from graphrag.query.structured_search.global_search.community_context import GlobalCommunityContext
+
+import global_search
+import local_search
+from artifact_store import get_store, release_store
+from caching import CACHE_DIR
+from index_runs import is_complete_run
+from keyword_index import EntityKeywordIndex, HybridEntityStore
+import stub_openai
+from stub_openai import WORDS, stand_in_embedding
+from synthetic_index import DIMENSIONS, generate
+from token_counts import release_counting_encoder
+
+SIZES = [1_000, 10_000, 100_000, 1_000_000]
+QUERIES = 20
+DATA_DIR = os.path.join(CACHE_DIR, "synthetic")
+
+# Every column either engine decodes, so loading is timed apart from engine construction
+TABLE_COLUMNS = {
+    local_search.ENTITY_TABLE: local_search.ENTITY_COLUMNS,
+    local_search.ENTITY_EMBEDDING_TABLE: local_search.ENTITY_EMBEDDING_COLUMNS,
+    local_search.RELATIONSHIP_TABLE: local_search.RELATIONSHIP_COLUMNS,
+    local_search.COMMUNITY_REPORT_TABLE: local_search.COMMUNITY_REPORT_COLUMNS,
+    local_search.TEXT_UNIT_TABLE: local_search.TEXT_UNIT_COLUMNS,
+}
+
+
+class StandInLLM(BaseLLM):
+    """In-process stand-in for the chat model: answers after a fixed latency, without network calls."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.model = "stand-in"
+
+    def _answer(self, kwargs):
+        if kwargs.get("response_format"):
+            return '{"points": [{"description": "A stand-in point.", "score": 50}]}'
+        return "A stand-in answer."
+
+    def generate(self, messages, streaming=True, callbacks=None, **kwargs):
+        time.sleep(self.latency)
+        return self._answer(kwargs)
+
+    async def agenerate(self, messages, streaming=True, callbacks=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        return self._answer(kwargs)
+
+
+class StandInEmbedding(BaseTextEmbedding):
+    """In-process stand-in for the embedding model, returning `stand_in_embedding` vectors."""
+
+    def __init__(self, dimensions=stub_openai.DIMENSIONS):
+        self.dimensions = dimensions
+
+    def embed(self, text, **kwargs):
+        return stand_in_embedding(text, self.dimensions).tolist()
+
+    async def aembed(self, text, **kwargs):
+        return self.embed(text)
+
+
+def git_commit():
+    """Return the short hash of the checked-out commit, or None outside a git checkout."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def make_queries(count):
+    """Return `count` deterministic queries drawn from the stand-in vocabulary."""
+    return [f"Which {WORDS[i % len(WORDS)]} grants support {WORDS[(i * 7 + 3) % len(WORDS)]}?" for i in range(count)]
+
+
+def make_named_queries(count, n_entities):
+    """Return `count` deterministic queries naming a synthetic entity by its title."""
+    return [f"What does ENTITY {i * 7919 % n_entities} fund?" for i in range(count)]
+
+
+def timed(function, *args, **kwargs):
+    started = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+def latency_ms(function, queries):
+    """
+    Time one call per query.
+
+    Args:
+        function (callable): Called with a query.
+        queries (list): The queries.
+
+    Returns:
+        dict: Median, p95 and mean latency in milliseconds.
+    """
+    latencies = sorted(timed(function, query)[1] * 1000 for query in queries)
+    return {
+        "p50_ms": statistics.median(latencies),
+        "p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+        "mean_ms": statistics.fmean(latencies),
+    }
+
+
+def bench_size(input_dir, queries, named_queries):
+    """
+    Time artifact loading, engine construction and per-query context building for one run.
+
+    Args:
+        input_dir (str): The artifacts directory.
+        queries (list): The queries.
+        named_queries (list): Queries naming an entity, for the keyword fast path.
+
+    Returns:
+        dict: The timings.
+    """
+    store = get_store(input_dir)
+    _, load_seconds = timed(lambda: [store.frame(table, columns) for table, columns in TABLE_COLUMNS.items()])
+    local_engine, local_seconds = timed(local_search.setup_search_engine, input_dir)
+    global_engine, global_seconds = timed(global_search.main, input_dir)
+
+    local_builder = local_engine.context_builder
+    global_builder = global_engine.context_builder
+    global_params = global_engine.context_builder_params
+    # What every global query pays without prebatching: batching all the reports again
+    stock_builder = GlobalCommunityContext(
+        community_reports=global_builder.community_reports,
+        entities=global_builder.entities,
+        token_encoder=global_builder.token_encoder,
+    )
+    batches, _ = global_builder.build_context(**global_params)
+    keyword_index, keyword_seconds = timed(EntityKeywordIndex, local_builder.entities.values(),
+                                           local_builder.text_units.values())
+    vector_store = local_builder.entity_text_embeddings
+    hybrid_store = HybridEntityStore(vector_store, keyword_index, mode="hybrid")
+    embed = local_builder.text_embedder.embed
+    k = 2 * local_search.LOCAL_CONTEXT_PARAMS["top_k_mapped_entities"]
+
+    def local_context(store):
+        def build(query):
+            local_builder.entity_text_embeddings = store
+            try:
+                return local_builder.build_context(query=query, **local_search.LOCAL_CONTEXT_PARAMS)
+            finally:
+                local_builder.entity_text_embeddings = vector_store
+        return build
+
+    result = {
+        "artifact_load_s": load_seconds,
+        "artifact_mb": store.nbytes() / 1e6,
+        "local_engine_s": local_seconds,
+        "global_engine_s": global_seconds,
+        "local_context": latency_ms(local_context(vector_store), queries),
+        "keyword_index_s": keyword_seconds,
+        "keyword_index_mb": keyword_index.nbytes / 1e6,
+        "vector_lookup": latency_ms(lambda query: vector_store.similarity_search_by_text(query, embed, k), queries),
+        "keyword_lookup": latency_ms(lambda query: keyword_index.scores(query), queries),
+        "hybrid_lookup": latency_ms(lambda query: hybrid_store.similarity_search_by_text(query, embed, k), queries),
+        "named_lookup": latency_ms(
+            lambda query: hybrid_store.similarity_search_by_text(query, embed, k), named_queries),
+        "hybrid_local_context": latency_ms(local_context(hybrid_store), queries),
+        "global_context": latency_ms(lambda query: global_builder.build_context(**global_params), queries),
+        "global_batching": latency_ms(lambda query: stock_builder.build_context(**global_params), queries[:3]),
+        "global_batches": len(batches),
+    }
+    release_store(input_dir)
+    release_counting_encoder(input_dir)
+    return result
+
+
+def main():
+    """Benchmark context building on synthetic index runs of growing size, without an LLM."""
+    parser = argparse.ArgumentParser(description="Benchmark artifact loading, engine construction and context "
+                                                 "building on synthetic graphs, with the LLM stubbed out.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="Entity counts.")
+    parser.add_argument("--queries", type=int, default=QUERIES)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--dimensions", type=int, default=DIMENSIONS)
+    parser.add_argument("--data-dir", default=DATA_DIR, help="Where the generated runs are kept for reuse.")
+    parser.add_argument("--vector-store", choices=["numpy", "lancedb"], default="numpy")
+    parser.add_argument("--output", help="Append the results, one JSON line per size, to this file.")
+    args = parser.parse_args()
+
+    local_search.VECTOR_STORE = args.vector_store
+    local_search.setup_llm = lambda *_, **__: StandInLLM(0)
+    local_search.setup_text_embedder = lambda: StandInEmbedding(args.dimensions)
+    global_search.initialize_llm = lambda *_: StandInLLM(0)
+    queries = make_queries(args.queries)
+    commit = git_commit()
+
+    for size in args.sizes:
+        input_dir = os.path.join(args.data_dir, f"{size}-seed{args.seed}-d{args.dimensions}")
+        generate_seconds = None
+        if not is_complete_run(input_dir):
+            _, generate_seconds = timed(generate, input_dir, size, args.seed, args.dimensions)
+        result = {
+            "commit": commit,
+            "python": sys.version.split()[0],
+            "entities": size,
+            "seed": args.seed,
+            "vector_store": args.vector_store,
+            "generate_s": generate_seconds,
+            **bench_size(input_dir, queries, make_named_queries(args.queries, size)),
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        }
+        line = json.dumps(result)
+        print(line, flush=True)
+        if args.output:
+            with open(args.output, "a") as f:
+                f.write(line + "\n")
+        gc.collect()
+
+
+if __name__ == "__main__":
+    main()
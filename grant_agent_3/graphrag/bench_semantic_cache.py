@@ -0,0 +1,114 @@
+import argparse
+import json
+import statistics
+import time
+
+import numpy as np
+
+from semantic_cache import SemanticCache
+
+ENTRIES = 50_000
+DIMENSIONS = 1536
+TEMPLATES = [50, 1]
+LOOKUPS = 500
+# Cosine similarity between two queries of one template, and between a query and its rewording
+TEMPLATE_SIMILARITY = 0.9
+PARAPHRASE_SIMILARITY = 0.97
+SCOPE = ("local", "bench", "fingerprint")
+
+
+def unit(vectors):
+    return vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)
+
+
+def template_queries(count, templates, dimensions, rng):
+    """
+    Generate query embeddings built from a few templates, like the canned queries of gui.py.
+
+    Args:
+        count (int): The number of queries.
+        templates (int): The number of templates they are spread over.
+        dimensions (int): The vector size.
+        rng (numpy.random.Generator): The random generator.
+
+    Returns:
+        ndarray: A float32 array of shape (count, dimensions); two queries of one template are
+            at about TEMPLATE_SIMILARITY.
+    """
+    centres = unit(rng.standard_normal((templates, dimensions), dtype=np.float32))
+    spread = np.sqrt(1 / TEMPLATE_SIMILARITY - 1)
+    variants = unit(rng.standard_normal((count, dimensions), dtype=np.float32))
+    return unit(centres[rng.integers(templates, size=count)] + spread * variants)
+
+
+def paraphrase(vector, rng):
+    """Return a rewording of a query, at about PARAPHRASE_SIMILARITY from it."""
+    noise = unit(rng.standard_normal(vector.shape[0], dtype=np.float32))
+    return unit(vector + np.sqrt(1 / PARAPHRASE_SIMILARITY ** 2 - 1) * noise)
+
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+    return {
+        "p50_ms": statistics.median(latencies),
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1],
+    }
+
+
+def bench(queries, lookups, max_candidates, rng):
+    """
+    Fill a cache with `queries`, one and a half times over, then look up rewordings of cached ones.
+
+    Args:
+        queries (ndarray): The query embeddings; the last `max_entries` of them stay cached.
+        lookups (int): The number of lookups.
+        max_candidates (int): The cache's candidate cap.
+        rng (numpy.random.Generator): The random generator.
+
+    Returns:
+        dict: Insert and lookup latency, and the share of rewordings served from the cache.
+    """
+    max_entries = len(queries) * 2 // 3
+    cache = SemanticCache(max_entries=max_entries, max_candidates=max_candidates)
+    inserts = []
+    for index, query in enumerate(queries):
+        started = time.perf_counter()
+        cache.put(SCOPE, query, {"response": str(index)})
+        inserts.append((time.perf_counter() - started) * 1000)
+
+    cached = rng.integers(len(queries) - max_entries, len(queries), size=lookups)
+    latencies, hits = [], 0
+    for index in cached:
+        query = paraphrase(queries[index], rng)
+        started = time.perf_counter()
+        response, _ = cache.get(SCOPE, query)
+        latencies.append((time.perf_counter() - started) * 1000)
+        hits += response is not None
+    return {
+        "max_candidates": max_candidates,
+        "lookup": percentiles(latencies),
+        "insert": percentiles(inserts[max_entries:]),
+        "hit_rate": hits / lookups,
+    }
+
+
+def main():
+    """Run the benchmark for every template count and print one JSON line per cap."""
+    parser = argparse.ArgumentParser(description="Time semantic cache lookups of template queries.")
+    parser.add_argument("--entries", type=int, default=ENTRIES)
+    parser.add_argument("--dimensions", type=int, default=DIMENSIONS)
+    parser.add_argument("--templates", type=int, nargs="+", default=TEMPLATES)
+    parser.add_argument("--lookups", type=int, default=LOOKUPS)
+    parser.add_argument("--max-candidates", type=int, nargs="+", default=[SemanticCache().max_candidates])
+    args = parser.parse_args()
+
+    for templates in args.templates:
+        rng = np.random.default_rng(0)
+        queries = template_queries(args.entries * 3 // 2, templates, args.dimensions, rng)
+        for max_candidates in args.max_candidates:
+            result = bench(queries, args.lookups, max_candidates, np.random.default_rng(1))
+            print(json.dumps({"entries": args.entries, "templates": templates, **result}))
+
+
+if __name__ == "__main__":
+    main()
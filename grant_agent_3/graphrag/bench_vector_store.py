@@ -0,0 +1,146 @@
+import argparse
+import json
+import shutil
+import statistics
+import tempfile
+import time
+
+import numpy as np
+from graphrag.vector_stores.base import VectorStoreDocument
+
+from numpy_vector_store import NumpyVectorStore
+
+SIZES = [1_000, 10_000, 100_000]
+DIMENSIONS = 1536
+QUERIES = 50
+TOP_K = 20  # top_k_mapped_entities (10) times the oversample scaler (2)
+
+
+def random_unit_vectors(count, dimensions, rng):
+    """
+    Generate random unit vectors standing in for entity description embeddings.
+
+    Args:
+        count (int): The number of vectors.
+        dimensions (int): The vector size.
+        rng (numpy.random.Generator): The random generator.
+
+    Returns:
+        ndarray: A float32 array of shape (count, dimensions).
+    """
+    vectors = rng.standard_normal((count, dimensions), dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def time_queries(search, queries):
+    """
+    Time one search call per query.
+
+    Args:
+        search (callable): Called with a query vector.
+        queries (ndarray): The query vectors.
+
+    Returns:
+        dict: Median and p95 latency in milliseconds.
+    """
+    latencies = []
+    for query in queries:
+        started = time.perf_counter()
+        search(query)
+        latencies.append((time.perf_counter() - started) * 1000)
+    latencies.sort()
+    return {
+        "p50_ms": statistics.median(latencies),
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1],
+    }
+
+
+def bench_numpy(ids, vectors, queries, k):
+    """
+    Benchmark NumpyVectorStore build, single-query and batched-query latency.
+
+    Args:
+        ids (list): The document ids.
+        vectors (ndarray): The document vectors.
+        queries (ndarray): The query vectors.
+        k (int): The number of results per query.
+
+    Returns:
+        dict: The timings.
+    """
+    started = time.perf_counter()
+    store = NumpyVectorStore(collection_name="bench")
+    store.load_vectors(ids=ids, vectors=vectors)
+    build_seconds = time.perf_counter() - started
+
+    result = time_queries(lambda q: store.similarity_search_by_vector(q, k=k), queries)
+    started = time.perf_counter()
+    store.similarity_search_by_vectors(queries, k=k)
+    result["batched_ms_per_query"] = (time.perf_counter() - started) * 1000 / len(queries)
+    result["build_s"] = build_seconds
+    return result
+
+
+def bench_lancedb(ids, vectors, queries, k):
+    """
+    Benchmark LanceDBVectorStore ingestion and query latency in a temporary directory.
+
+    Args:
+        ids (list): The document ids.
+        vectors (ndarray): The document vectors.
+        queries (ndarray): The query vectors.
+        k (int): The number of results per query.
+
+    Returns:
+        dict: The timings, or None if lancedb is not installed.
+    """
+    try:
+        from graphrag.vector_stores.lancedb import LanceDBVectorStore
+    except ImportError:
+        return None
+    db_uri = tempfile.mkdtemp(prefix="bench-lancedb-")
+    try:
+        started = time.perf_counter()
+        store = LanceDBVectorStore(collection_name="bench")
+        store.connect(db_uri=db_uri)
+        store.load_documents([
+            VectorStoreDocument(id=doc_id, text="", vector=vector.tolist())
+            for doc_id, vector in zip(ids, vectors)
+        ])
+        build_seconds = time.perf_counter() - started
+        result = time_queries(
+            lambda q: store.similarity_search_by_vector(q.tolist(), k=k), queries)
+        result["build_s"] = build_seconds
+        return result
+    finally:
+        shutil.rmtree(db_uri, ignore_errors=True)
+
+
+def main():
+    """Run the benchmark for every requested corpus size and print one JSON line per size."""
+    parser = argparse.ArgumentParser(description="Compare NumPy and LanceDB entity vector lookup.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--dimensions", type=int, default=DIMENSIONS)
+    parser.add_argument("--queries", type=int, default=QUERIES)
+    parser.add_argument("--k", type=int, default=TOP_K)
+    parser.add_argument("--skip-lancedb", action="store_true")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    queries = random_unit_vectors(args.queries, args.dimensions, rng)
+    for size in args.sizes:
+        vectors = random_unit_vectors(size, args.dimensions, rng)
+        ids = [f"entity-{i}" for i in range(size)]
+        result = {
+            "entities": size,
+            "dimensions": args.dimensions,
+            "k": args.k,
+            "numpy": bench_numpy(ids, vectors, queries, args.k),
+        }
+        if not args.skip_lancedb:
+            result["lancedb"] = bench_lancedb(ids, vectors, queries, args.k)
+        print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
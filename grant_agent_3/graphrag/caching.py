@@ -0,0 +1,245 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_DIR = os.getenv(
+    "GRAPHRAG_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache"))
+
+
+class LRUCache:
+    """
+    Thread-safe in-memory LRU cache bounded by entry count and, optionally, by total size.
+
+    Values are kept as-is; callers are expected to store immutable values.
+    """
+
+    def __init__(self, max_entries, max_bytes=None, sizeof=len):
+        """
+        Args:
+            max_entries (int): The maximum number of entries.
+            max_bytes (int, optional): The maximum total size of the values.
+            sizeof (callable): Returns the size of a value; only used with `max_bytes`.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.nbytes = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Return the cached value for `key` and mark it most recently used.
+
+        Args:
+            key (hashable): The cache key.
+            default (object): Returned when the key is missing.
+
+        Returns:
+            object: The cached value or `default`.
+        """
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key, value):
+        """
+        Store `value` under `key`, evicting the least recently used entries past the bound.
+
+        Args:
+            key (hashable): The cache key.
+            value (object): The value to cache.
+        """
+        with self._lock:
+            if self.max_bytes is not None:
+                if key in self._data:
+                    self.nbytes -= self.sizeof(self._data[key])
+                self.nbytes += self.sizeof(value)
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while self._data and (len(self._data) > self.max_entries or (
+                    self.max_bytes is not None and self.nbytes > self.max_bytes)):
+                _, evicted = self._data.popitem(last=False)
+                if self.max_bytes is not None:
+                    self.nbytes -= self.sizeof(evicted)
+
+    def pop(self, key, default=None):
+        """
+        Remove `key` and return its value.
+
+        Args:
+            key (hashable): The cache key.
+            default (object): Returned when the key is missing.
+
+        Returns:
+            object: The removed value or `default`.
+        """
+        with self._lock:
+            if key not in self._data:
+                return default
+            value = self._data.pop(key)
+            if self.max_bytes is not None:
+                self.nbytes -= self.sizeof(value)
+            return value
+
+    def discard_where(self, predicate):
+        """
+        Remove every entry whose key satisfies `predicate`.
+
+        Args:
+            predicate (callable): Called with each key.
+
+        Returns:
+            int: The number of entries removed.
+        """
+        with self._lock:
+            keys = [key for key in self._data if predicate(key)]
+            for key in keys:
+                value = self._data.pop(key)
+                if self.max_bytes is not None:
+                    self.nbytes -= self.sizeof(value)
+            return len(keys)
+
+    def clear(self):
+        """Remove every entry."""
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+
+class DiskCache:
+    """
+    Size-bounded key/value store in a SQLite file, shared safely between threads and processes.
+
+    Entries are evicted least-recently-used first once `max_entries` is exceeded, and
+    optionally expire after a per-entry deadline. A process forked from the one that opened
+    the cache opens its own connection on first use, since SQLite connections must not be
+    shared across a fork.
+    """
+
+    def __init__(self, path, max_entries):
+        self.path = path
+        self.max_entries = max_entries
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._connect()
+
+    def _connect(self):
+        self._pid = os.getpid()
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL, accessed REAL NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+        self._conn.commit()
+
+    def _connection(self):
+        """Return the connection of this process. Requires the lock."""
+        if self._pid != os.getpid():
+            self._connect()
+        return self._conn
+
+    def get(self, key, with_expires=False):
+        """
+        Return the stored bytes for `key`, or None if missing or expired.
+
+        Args:
+            key (str): The cache key.
+            with_expires (bool): Also return the entry's expiry time.
+
+        Returns:
+            bytes: The stored value, or None. With `with_expires`, a (value, expires) tuple
+                instead, where expires is a Unix time or None for entries without a TTL.
+        """
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute(
+                "SELECT value, expires FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, expires = row
+            if expires is not None and expires < now:
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                conn.commit()
+                return None
+            conn.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+            conn.commit()
+            return (value, expires) if with_expires else value
+
+    def put(self, key, value, ttl=None):
+        """
+        Store bytes under `key`, then evict the least recently used entries past the bound.
+
+        Args:
+            key (str): The cache key.
+            value (bytes): The value to store.
+            ttl (float, optional): Seconds until the entry expires.
+        """
+        now = time.time()
+        expires = now + ttl if ttl else None
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, expires, accessed) VALUES (?, ?, ?, ?)",
+                (key, sqlite3.Binary(value), expires, now))
+            conn.execute(
+                "DELETE FROM entries WHERE key IN ("
+                " SELECT key FROM entries ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,))
+            conn.commit()
+
+    def delete_where_key_like(self, pattern):
+        """
+        Delete every entry whose key matches a SQL LIKE pattern.
+
+        Args:
+            pattern (str): The LIKE pattern, e.g. "local:%".
+        """
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM entries WHERE key LIKE ?", (pattern,))
+            conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._connection().execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+
+class CacheStats:
+    """Thread-safe hit/miss counters for one cache."""
+
+    def __init__(self, *counters):
+        self._lock = threading.Lock()
+        self._counts = {name: 0 for name in counters}
+
+    def incr(self, name, amount=1):
+        """
+        Add `amount` to the counter called `name`.
+
+        Args:
+            name (str): The counter name.
+            amount (int): The increment.
+        """
+        with self._lock:
+            self._counts[name] = self._counts.get(name, 0) + amount
+
+    def snapshot(self):
+        """
+        Return a copy of all counters.
+
+        Returns:
+            dict: Counter name to value.
+        """
+        with self._lock:
+            return dict(self._counts)
@@ -0,0 +1,474 @@
+import asyncio
+import contextvars
+import functools
+import hashlib
+import json
+import os
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import pandas as pd
+from graphrag.query.context_builder.local_context import (
+    build_covariates_context,
+    build_entity_context,
+)
+from graphrag.query.context_builder.source_context import build_text_unit_context
+from graphrag.query.input.retrieval.relationships import sort_relationships_by_ranking_attribute
+from graphrag.query.llm.text_utils import num_tokens
+from graphrag.query.structured_search.global_search.community_context import GlobalCommunityContext
+from graphrag.query.structured_search.local_search.mixed_context import LocalSearchMixedContext
+
+from adjacency import LocalAdjacency
+from metrics import stage
+
+
+def select_relationships(selected_entities, relationships, top_k_relationships=10,
+                         relationship_ranking_attribute="rank"):
+    """
+    Select and order relationships exactly like graphrag's local context `_filter_relationships`.
+
+    graphrag counts the links of every out-of-network entity by rescanning all out-of-network
+    relationships per entity, which is quadratic in the degree of hub entities. Here the links
+    are counted in one pass. Like graphrag, the count is stored in each out-of-network
+    relationship's "links" attribute.
+
+    Args:
+        selected_entities (list): The entities added to the context so far.
+        relationships (list): The relationships touching them, in ranked order.
+        top_k_relationships (int): Out-of-network relationships allowed per selected entity.
+        relationship_ranking_attribute (str): The relationship attribute to rank on.
+
+    Returns:
+        list: In-network relationships followed by the best out-of-network relationships.
+    """
+    names = {entity.title for entity in selected_entities}
+    in_network = [rel for rel in relationships if rel.source in names and rel.target in names]
+    if len(in_network) > 1:
+        in_network = sort_relationships_by_ranking_attribute(
+            in_network, selected_entities, relationship_ranking_attribute)
+    out_network = sort_relationships_by_ranking_attribute(
+        [rel for rel in relationships if rel.source in names and rel.target not in names]
+        + [rel for rel in relationships if rel.target in names and rel.source not in names],
+        selected_entities, relationship_ranking_attribute)
+    if len(out_network) <= 1:
+        return in_network + out_network
+
+    # prioritize out-of-network entities linked to several selected entities
+    partners = defaultdict(set)
+    for rel in out_network:
+        if rel.source not in names:
+            partners[rel.source].add(rel.target)
+        if rel.target not in names:
+            partners[rel.target].add(rel.source)
+    for rel in out_network:
+        if rel.attributes is None:
+            rel.attributes = {}
+        rel.attributes["links"] = len(partners[rel.source] if rel.source in partners else partners[rel.target])
+
+    if relationship_ranking_attribute == "weight":
+        out_network.sort(key=lambda rel: (rel.attributes["links"], rel.weight), reverse=True)
+    else:
+        out_network.sort(
+            key=lambda rel: (rel.attributes["links"], rel.attributes[relationship_ranking_attribute]),
+            reverse=True)
+    return in_network + out_network[:top_k_relationships * len(selected_entities)]
+
+
+def build_relationship_table(
+    selected_relationships,
+    token_encoder=None,
+    include_relationship_weight=False,
+    max_tokens=8000,
+    column_delimiter="|",
+    context_name="Relationships",
+):
+    """
+    Render selected relationships as a context table, as graphrag's `build_relationship_context` does.
+
+    Args:
+        selected_relationships (list): The relationships, in context order.
+        token_encoder (object): The token encoder.
+        include_relationship_weight (bool): Add a weight column.
+        max_tokens (int): The token budget of the table.
+        column_delimiter (str): The column delimiter.
+        context_name (str): The table name.
+
+    Returns:
+        tuple: The table text and a DataFrame of its records.
+    """
+    if len(selected_relationships) == 0:
+        return "", pd.DataFrame()
+
+    current_context_text = f"-----{context_name}-----" + "\n"
+    header = ["id", "source", "target", "description"]
+    if include_relationship_weight:
+        header.append("weight")
+    attribute_cols = (
+        list(selected_relationships[0].attributes.keys())
+        if selected_relationships[0].attributes
+        else []
+    )
+    attribute_cols = [col for col in attribute_cols if col not in header]
+    header.extend(attribute_cols)
+
+    current_context_text += column_delimiter.join(header) + "\n"
+    current_tokens = num_tokens(current_context_text, token_encoder)
+
+    all_context_records = [header]
+    for rel in selected_relationships:
+        new_context = [
+            rel.short_id if rel.short_id else "",
+            rel.source,
+            rel.target,
+            rel.description if rel.description else "",
+        ]
+        if include_relationship_weight:
+            new_context.append(str(rel.weight if rel.weight else ""))
+        for field in attribute_cols:
+            field_value = (
+                str(rel.attributes.get(field))
+                if rel.attributes and rel.attributes.get(field)
+                else ""
+            )
+            new_context.append(field_value)
+        new_context_text = column_delimiter.join(new_context) + "\n"
+        new_tokens = num_tokens(new_context_text, token_encoder)
+        if current_tokens + new_tokens > max_tokens:
+            break
+        current_context_text += new_context_text
+        all_context_records.append(new_context)
+        current_tokens += new_tokens
+
+    if len(all_context_records) > 1:
+        record_df = pd.DataFrame(all_context_records[1:], columns=all_context_records[0])
+    else:
+        record_df = pd.DataFrame()
+    return current_context_text, record_df
+
+
+# Context builds are CPU-bound Python holding the GIL; more threads than one only convoy on it
+CONTEXT_BUILD_THREADS = int(os.getenv("GRAPHRAG_CONTEXT_BUILD_THREADS", "1"))
+_context_build_executor = ThreadPoolExecutor(CONTEXT_BUILD_THREADS, thread_name_prefix="context_build")
+
+# The context the current search built in a worker thread, with its builder; see OffLoopSearchMixin
+_prebuilt_context = contextvars.ContextVar("prebuilt_context", default=None)
+
+
+def prebuilt_context(context_builder):
+    """
+    Return the context an OffLoopSearchMixin engine built for the current search, if any.
+
+    Args:
+        context_builder (object): The context builder asked to build the context.
+
+    Returns:
+        tuple: The (context text, context data) the builder returned in the worker thread, or None.
+    """
+    prebuilt = _prebuilt_context.get()
+    if prebuilt is not None and prebuilt[0] is context_builder:
+        return prebuilt[1]
+    return None
+
+
+class OffLoopSearchMixin:
+    """
+    Search engine mixin that builds the query context in a worker thread.
+
+    graphrag's asearch calls the synchronous build_context on the event loop, so the CPU work
+    of one query's context stalls every other request the process is serving. Here asearch
+    builds the context on the context build threads first, in a copy of the caller's context,
+    and then runs the stock asearch, whose own build_context call is answered with that result. The context builder must return
+    `prebuilt_context(self)` when it is set; the builders in this module do.
+    """
+
+    def _context_kwargs(self, query, conversation_history, kwargs):
+        """Return the keyword arguments the stock asearch passes to build_context."""
+        raise NotImplementedError
+
+    async def asearch(self, query, conversation_history=None, **kwargs):
+        """Build the context off the event loop, then search as the stock engine does."""
+        build = functools.partial(
+            contextvars.copy_context().run,
+            self.context_builder.build_context,
+            **self._context_kwargs(query, conversation_history, kwargs),
+        )
+        context = await asyncio.get_running_loop().run_in_executor(_context_build_executor, build)
+        token = _prebuilt_context.set((self.context_builder, context))
+        try:
+            return await super().asearch(query, conversation_history, **kwargs)
+        finally:
+            _prebuilt_context.reset(token)
+
+
+class IndexedLocalContext(LocalSearchMixedContext):
+    """
+    LocalSearchMixedContext that expands the mapped entities through CSR adjacency indexes.
+
+    The stock builder filters the full relationship list once per mapped entity and ranks
+    out-of-network relationships in quadratic time. Here the relationships touching the
+    mapped entities, and the text units they appear in, are read from slices of a
+    LocalAdjacency built with the engine, so each step costs O(degree). Selection, order and
+    rendering follow the stock builder, so the context is the same.
+    """
+
+    def __init__(self, *args, relationship_ranking_attribute="rank", **kwargs):
+        """
+        Args:
+            relationship_ranking_attribute (str): The ranking attribute the adjacency is sorted by.
+
+        All other arguments are passed to LocalSearchMixedContext.
+        """
+        super().__init__(*args, **kwargs)
+        self.adjacency = LocalAdjacency(
+            entities=list(self.entities.values()),
+            relationships=list(self.relationships.values()),
+            text_units=list(self.text_units.values()),
+            ranking_attribute=relationship_ranking_attribute,
+        )
+
+    def build_context(self, *args, **kwargs):
+        """Build the context as LocalSearchMixedContext does, timed as the context_build stage."""
+        prebuilt = prebuilt_context(self)
+        if prebuilt is not None:
+            return prebuilt
+        with stage("context_build"):
+            return super().build_context(*args, **kwargs)
+
+    def _build_local_context(
+        self,
+        selected_entities,
+        max_tokens=8000,
+        include_entity_rank=False,
+        rank_description="relationship count",
+        include_relationship_weight=False,
+        top_k_relationships=10,
+        relationship_ranking_attribute="rank",
+        return_candidate_context=False,
+        column_delimiter="|",
+    ):
+        """Build the entity/relationship/covariate tables, reading relationships from the adjacency index."""
+        if return_candidate_context or relationship_ranking_attribute != self.adjacency.ranking_attribute:
+            return super()._build_local_context(
+                selected_entities=selected_entities,
+                max_tokens=max_tokens,
+                include_entity_rank=include_entity_rank,
+                rank_description=rank_description,
+                include_relationship_weight=include_relationship_weight,
+                top_k_relationships=top_k_relationships,
+                relationship_ranking_attribute=relationship_ranking_attribute,
+                return_candidate_context=return_candidate_context,
+                column_delimiter=column_delimiter,
+            )
+
+        entity_context, entity_context_data = build_entity_context(
+            selected_entities=selected_entities,
+            token_encoder=self.token_encoder,
+            max_tokens=max_tokens,
+            column_delimiter=column_delimiter,
+            include_entity_rank=include_entity_rank,
+            rank_description=rank_description,
+            context_name="Entities",
+        )
+        entity_tokens = num_tokens(entity_context, self.token_encoder)
+
+        # gradually add entities and associated metadata to the context until we reach limit
+        added_entities = []
+        final_context = []
+        final_context_data = {}
+        for entity in selected_entities:
+            current_context = []
+            current_context_data = {}
+            added_entities.append(entity)
+
+            selected_relationships = select_relationships(
+                selected_entities=added_entities,
+                relationships=self.adjacency.relationships_of(added_entities),
+                top_k_relationships=top_k_relationships,
+                relationship_ranking_attribute=relationship_ranking_attribute,
+            )
+            relationship_context, relationship_context_data = build_relationship_table(
+                selected_relationships=selected_relationships,
+                token_encoder=self.token_encoder,
+                max_tokens=max_tokens,
+                column_delimiter=column_delimiter,
+                include_relationship_weight=include_relationship_weight,
+                context_name="Relationships",
+            )
+            current_context.append(relationship_context)
+            current_context_data["relationships"] = relationship_context_data
+            total_tokens = entity_tokens + num_tokens(relationship_context, self.token_encoder)
+
+            for covariate in self.covariates:
+                covariate_context, covariate_context_data = build_covariates_context(
+                    selected_entities=added_entities,
+                    covariates=self.covariates[covariate],
+                    token_encoder=self.token_encoder,
+                    max_tokens=max_tokens,
+                    column_delimiter=column_delimiter,
+                    context_name=covariate,
+                )
+                total_tokens += num_tokens(covariate_context, self.token_encoder)
+                current_context.append(covariate_context)
+                current_context_data[covariate.lower()] = covariate_context_data
+
+            if total_tokens > max_tokens:
+                break
+
+            final_context = current_context
+            final_context_data = current_context_data
+
+        final_context_text = entity_context + "\n\n" + "\n\n".join(final_context)
+        final_context_data["entities"] = entity_context_data
+        for key in final_context_data:
+            final_context_data[key]["in_context"] = True
+        return final_context_text, final_context_data
+
+    def _build_text_unit_context(
+        self,
+        selected_entities,
+        max_tokens=8000,
+        return_candidate_context=False,
+        column_delimiter="|",
+        context_name="Sources",
+    ):
+        """Rank the text units of the mapped entities from the adjacency index and pack them."""
+        if return_candidate_context:
+            return super()._build_text_unit_context(
+                selected_entities=selected_entities,
+                max_tokens=max_tokens,
+                return_candidate_context=return_candidate_context,
+                column_delimiter=column_delimiter,
+                context_name=context_name,
+            )
+        if len(selected_entities) == 0 or len(self.text_units) == 0:
+            return ("", {context_name.lower(): pd.DataFrame()})
+
+        # rank first by the order of the entity that matched the unit, then by the number of
+        # that entity's relationships the unit has; the first matching entity wins
+        ranking = {}
+        for index, entity in enumerate(selected_entities):
+            positions, counts = self.adjacency.text_units_of(entity)
+            for position, count in zip(positions.tolist(), counts.tolist()):
+                if position not in ranking:
+                    ranking[position] = (index, -count)
+        selected_text_units = [
+            self.adjacency.text_units[position] for position in sorted(ranking, key=ranking.get)]
+
+        context_text, context_data = build_text_unit_context(
+            text_units=selected_text_units,
+            token_encoder=self.token_encoder,
+            max_tokens=max_tokens,
+            shuffle_data=False,
+            context_name=context_name,
+            column_delimiter=column_delimiter,
+        )
+        return str(context_text), context_data
+
+
+# The community reports the global context of the current query is restricted to, if any
+_report_subset = contextvars.ContextVar("report_subset", default=None)
+
+
+@contextmanager
+def restrict_reports(reports):
+    """
+    Restrict PrebatchedGlobalContext to some community reports for the current query.
+
+    Args:
+        reports (list): The CommunityReport instances to batch, in artifact order.
+    """
+    token = _report_subset.set(reports)
+    try:
+        yield
+    finally:
+        _report_subset.reset(token)
+
+
+def batch_id(context_text):
+    """
+    Return the stable id of a report batch.
+
+    Args:
+        context_text (str): The batch as sent to the map prompt.
+
+    Returns:
+        str: The sha256 hex digest of the batch text.
+    """
+    return hashlib.sha256(context_text.encode("utf-8")).hexdigest()
+
+
+class TimedGlobalContext(GlobalCommunityContext):
+    """GlobalCommunityContext that batches the reports on every query, timed as the context_build stage."""
+
+    def build_context(self, *args, **kwargs):
+        """Build the context as GlobalCommunityContext does."""
+        prebuilt = prebuilt_context(self)
+        if prebuilt is not None:
+            return prebuilt
+        with stage("context_build"):
+            return super().build_context(*args, **kwargs)
+
+
+class PrebatchedGlobalContext(GlobalCommunityContext):
+    """
+    GlobalCommunityContext that batches the community reports once per set of build parameters.
+
+    The stock builder shuffles, renders, counts and batches every report on each query. With a
+    fixed `random_state` that work always yields the same batches for the same reports, so
+    here it runs on the first build only (at engine build) and later queries reuse its output.
+    The engine, and with it this builder, is rebuilt when the index run changes. Queries with
+    conversation history are built the stock way, since the history is part of every batch.
+    Inside `restrict_reports` only the given reports are batched, for that query alone.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._batches = {}
+        self._lock = threading.Lock()
+
+    def _build_batches(self, params):
+        key = json.dumps(params, sort_keys=True, default=str)
+        with self._lock:
+            if key not in self._batches:
+                context_chunks, context_data = super().build_context(**params)
+                self._batches[key] = (context_chunks, [batch_id(chunk) for chunk in context_chunks], context_data)
+            return self._batches[key]
+
+    def batches(self, **params):
+        """
+        Return the report batches for a set of build parameters, with their ids.
+
+        Args:
+            **params: The keyword arguments of `build_context`, without conversation history.
+
+        Returns:
+            list: (batch id, batch text) pairs, in map order.
+        """
+        context_chunks, batch_ids, _ = self._build_batches(params)
+        return list(zip(batch_ids, context_chunks))
+
+    def build_context(self, conversation_history=None, **params):
+        """Return the prebuilt report batches, building them on first use."""
+        prebuilt = prebuilt_context(self)
+        if prebuilt is not None:
+            return prebuilt
+        with stage("context_build"):
+            return self._build_context(conversation_history, params)
+
+    def _build_context(self, conversation_history, params):
+        reports = _report_subset.get()
+        if reports is not None:
+            # the full build computes the community weights, normalized over every report
+            self._build_batches(params)
+            return GlobalCommunityContext(
+                community_reports=reports,
+                entities=self.entities,
+                token_encoder=self.token_encoder,
+                random_state=self.random_state,
+            ).build_context(conversation_history=conversation_history, **params)
+        if conversation_history and conversation_history.turns:
+            return super().build_context(conversation_history=conversation_history, **params)
+        context_chunks, _, context_data = self._build_batches(params)
+        return list(context_chunks), {name: data.copy() for name, data in context_data.items()}
@@ -0,0 +1,293 @@
+import hashlib
+import os
+import re
+import threading
+import unicodedata
+
+import numpy as np
+from graphrag.query.llm.base import BaseTextEmbedding
+from graphrag.query.llm.oai.typing import OpenaiApiType
+
+from caching import CACHE_DIR, CacheStats, DiskCache, LRUCache
+from llm_clients import PooledOpenAIEmbedding
+from metrics import stage
+
+MEMORY_ENTRIES = int(os.getenv("GRAPHRAG_EMBEDDING_CACHE_MEMORY_ENTRIES", "10000"))
+DISK_ENTRIES = int(os.getenv("GRAPHRAG_EMBEDDING_CACHE_DISK_ENTRIES", "200000"))
+DISK_PATH = os.getenv(
+    "GRAPHRAG_EMBEDDING_CACHE_PATH", os.path.join(CACHE_DIR, "query_embeddings.sqlite"))
+# Documents, such as community reports, are cached apart so they never evict query embeddings
+DOCUMENT_DISK_PATH = os.getenv(
+    "GRAPHRAG_DOCUMENT_EMBEDDING_CACHE_PATH", os.path.join(CACHE_DIR, "document_embeddings.sqlite"))
+# Texts sent to the embeddings API per request by embed_documents
+BATCH_SIZE = int(os.getenv("GRAPHRAG_EMBEDDING_BATCH_SIZE", "256"))
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text):
+    """
+    Normalize text so trivially different spellings of the same query share a cache key.
+
+    Applies Unicode NFKC normalization and collapses runs of whitespace.
+
+    Args:
+        text (str): The raw text.
+
+    Returns:
+        str: The normalized text.
+    """
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", text)).strip()
+
+
+class EmbeddingCache:
+    """
+    Two-tier cache of text embeddings: an in-memory LRU in front of an on-disk store.
+
+    Keys combine the embedding model name with the normalized text, so switching
+    models never serves a stale vector.
+    """
+
+    def __init__(self, memory_entries=MEMORY_ENTRIES, disk_path=DISK_PATH, disk_entries=DISK_ENTRIES):
+        self.memory = LRUCache(memory_entries)
+        self.disk = DiskCache(disk_path, disk_entries) if disk_path else None
+        self.stats = CacheStats("memory_hits", "disk_hits", "misses")
+
+    @staticmethod
+    def key(model, text):
+        """
+        Build the cache key for a model and text.
+
+        Args:
+            model (str): The embedding model name.
+            text (str): The text to embed.
+
+        Returns:
+            str: The cache key.
+        """
+        return hashlib.sha256(f"{model}\0{normalize_text(text)}".encode()).hexdigest()
+
+    def get(self, model, text):
+        """
+        Look up a cached embedding.
+
+        Args:
+            model (str): The embedding model name.
+            text (str): The text that was embedded.
+
+        Returns:
+            list: The embedding, or None on a miss.
+        """
+        key = self.key(model, text)
+        vector = self.memory.get(key)
+        if vector is not None:
+            self.stats.incr("memory_hits")
+            return vector.tolist()
+        if self.disk is not None:
+            blob = self.disk.get(key)
+            if blob is not None:
+                vector = np.frombuffer(blob, dtype=np.float32)
+                self.memory.put(key, vector)
+                self.stats.incr("disk_hits")
+                return vector.tolist()
+        self.stats.incr("misses")
+        return None
+
+    def put(self, model, text, embedding):
+        """
+        Store an embedding in both tiers.
+
+        Args:
+            model (str): The embedding model name.
+            text (str): The text that was embedded.
+            embedding (list): The embedding vector.
+        """
+        if not embedding:
+            return
+        key = self.key(model, text)
+        vector = np.asarray(embedding, dtype=np.float32)
+        self.memory.put(key, vector)
+        if self.disk is not None:
+            self.disk.put(key, vector.tobytes())
+
+    def snapshot(self):
+        """
+        Report hit/miss counters and tier sizes.
+
+        Returns:
+            dict: The cache statistics.
+        """
+        counts = self.stats.snapshot()
+        lookups = sum(counts.values())
+        return {
+            **counts,
+            "hit_rate": (lookups - counts["misses"]) / lookups if lookups else 0.0,
+            "memory_entries": len(self.memory),
+        }
+
+
+class CachedTextEmbedding(BaseTextEmbedding):
+    """Text embedder that answers repeated texts from an EmbeddingCache instead of calling the API."""
+
+    def __init__(self, embedder, model, cache=None):
+        """
+        Args:
+            embedder (BaseTextEmbedding): The embedder used on cache misses.
+            model (str): The embedding model name, part of every cache key.
+            cache (EmbeddingCache, optional): The cache. Defaults to the process-wide cache.
+        """
+        self.embedder = embedder
+        self.model = model
+        self.cache = cache or get_embedding_cache()
+
+    def embed(self, text, **kwargs):
+        """
+        Embed text, serving repeats from the cache.
+
+        Args:
+            text (str): The text to embed.
+
+        Returns:
+            list: The embedding vector.
+        """
+        with stage("query_embedding"):
+            embedding = self.cache.get(self.model, text)
+            if embedding is None:
+                embedding = self.embedder.embed(text, **kwargs)
+                self.cache.put(self.model, text, embedding)
+        return embedding
+
+    async def aembed(self, text, **kwargs):
+        """
+        Embed text asynchronously, serving repeats from the cache.
+
+        Args:
+            text (str): The text to embed.
+
+        Returns:
+            list: The embedding vector.
+        """
+        with stage("query_embedding"):
+            embedding = self.cache.get(self.model, text)
+            if embedding is None:
+                embedding = await self.embedder.aembed(text, **kwargs)
+                self.cache.put(self.model, text, embedding)
+        return embedding
+
+    def embed_documents(self, texts, batch_size=BATCH_SIZE, **kwargs):
+        """
+        Embed many texts, serving repeats from the cache and sending the rest in batches.
+
+        Embedders with an `embed_batch` method get up to `batch_size` texts per call; others
+        are called once per text.
+
+        Args:
+            texts (list): The texts to embed.
+            batch_size (int): The texts per embedding request.
+
+        Returns:
+            list: One embedding vector per text.
+        """
+        embeddings = [self.cache.get(self.model, text) for text in texts]
+        missing = [index for index, embedding in enumerate(embeddings) if embedding is None]
+        embed_batch = getattr(self.embedder, "embed_batch", None)
+        for start in range(0, len(missing), batch_size):
+            batch = missing[start:start + batch_size]
+            batch_texts = [texts[index] for index in batch]
+            if embed_batch is not None:
+                vectors = embed_batch(batch_texts, **kwargs)
+            else:
+                vectors = [self.embedder.embed(text, **kwargs) for text in batch_texts]
+            for index, text, embedding in zip(batch, batch_texts, vectors):
+                self.cache.put(self.model, text, embedding)
+                embeddings[index] = embedding
+        return embeddings
+
+
+_cache = None
+_cache_lock = threading.Lock()
+_document_cache = None
+
+
+def get_embedding_cache():
+    """
+    Return the process-wide query embedding cache, creating it on first use.
+
+    Returns:
+        EmbeddingCache: The shared cache.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = EmbeddingCache()
+        return _cache
+
+
+def get_document_embedding_cache():
+    """
+    Return the process-wide document embedding cache, creating it on first use.
+
+    It has no memory tier: documents are embedded when an engine is built, which keeps the
+    vectors itself, and only unchanged documents of a later run are looked up again.
+
+    Returns:
+        EmbeddingCache: The shared cache, in GRAPHRAG_DOCUMENT_EMBEDDING_CACHE_PATH.
+    """
+    global _document_cache
+    with _cache_lock:
+        if _document_cache is None:
+            _document_cache = EmbeddingCache(memory_entries=0, disk_path=DOCUMENT_DISK_PATH)
+        return _document_cache
+
+
+_query_embedder = None
+_query_embedder_lock = threading.Lock()
+
+
+def get_query_embedder():
+    """
+    Return the process-wide embedder for incoming queries, creating it on first use.
+
+    It embeds with GRAPHRAG_EMBEDDING_MODEL through the shared query embedding cache, so a
+    query embedded here is not sent to the API again by local search.
+
+    Returns:
+        CachedTextEmbedding: The shared query embedder.
+    """
+    global _query_embedder
+    cache = get_embedding_cache()
+    with _query_embedder_lock:
+        if _query_embedder is None:
+            model = os.environ["GRAPHRAG_EMBEDDING_MODEL"]
+            embedder = PooledOpenAIEmbedding(
+                api_key=os.environ["GRAPHRAG_API_KEY"],
+                api_base=None,
+                api_type=OpenaiApiType.OpenAI,
+                model=model,
+                deployment_name=model,
+                max_retries=20,
+            )
+            _query_embedder = CachedTextEmbedding(embedder, model=model, cache=cache)
+        return _query_embedder
+
+
+_document_embedder = None
+
+
+def get_document_embedder():
+    """
+    Return the process-wide embedder for documents, creating it on first use.
+
+    It uses the query embedder's model and clients, but the document embedding cache, and is
+    meant for `embed_documents`.
+
+    Returns:
+        CachedTextEmbedding: The shared document embedder.
+    """
+    global _document_embedder
+    query_embedder = get_query_embedder()
+    cache = get_document_embedding_cache()
+    with _query_embedder_lock:
+        if _document_embedder is None:
+            _document_embedder = CachedTextEmbedding(query_embedder.embedder, model=query_embedder.model, cache=cache)
+        return _document_embedder
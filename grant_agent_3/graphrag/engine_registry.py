@@ -0,0 +1,460 @@
+import itertools
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from artifact_store import release_store
+from index_runs import IndexWatcher, discover_latest_run
+from token_counts import release_counting_encoder
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+LOADING = "loading"
+RETRYING = "retrying"
+READY = "ready"
+FAILED = "failed"
+
+# A failed engine build is tried again, waiting twice as long each time, up to this many attempts
+BUILD_ATTEMPTS = int(os.getenv("GRAPHRAG_ENGINE_BUILD_ATTEMPTS", "5"))
+BUILD_RETRY_SECONDS = float(os.getenv("GRAPHRAG_ENGINE_BUILD_RETRY_SECONDS", "10"))
+BUILD_RETRY_MAX_SECONDS = float(os.getenv("GRAPHRAG_ENGINE_BUILD_RETRY_MAX_SECONDS", "300"))
+
+
+class EngineNotReadyError(RuntimeError):
+    """Raised when a search engine is requested before it has finished loading."""
+
+
+class _EngineVersion:
+    """One built engine for one index run, with the number of queries currently using it."""
+
+    def __init__(self, name, run, seq):
+        self.name = name
+        self.run = run
+        self.seq = seq
+        self.engine = None
+        self.leases = 0
+        self.retired = False
+
+
+class EngineRegistry:
+    """
+    Process-wide registry of search engines.
+
+    Engines are registered with a factory taking the artifacts directory of an index
+    run. Every engine of a run is built on its own background thread, so a slow engine
+    never holds up the others or the HTTP server. When a newer run is loaded its engines
+    are built alongside the live ones and swapped in atomically; queries already running
+    keep their engine until they finish, and a retired engine is dropped, together with
+    its artifacts, once its last query has drained.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._seq = itertools.count(1)
+        self._factories = {}
+        self._live = {}
+        self._loading = {}
+        self._errors = {}
+        self._retries = {}
+        self._load_seconds = {}
+        self._ready_events = {}
+        self._versions_alive = {}
+        self._builds_pending = {}
+        self._draining = set()
+        self._started = False
+        self._watcher = None
+        self._swap_listeners = []
+        self._builders = []
+
+    def register(self, name, factory):
+        """
+        Register a factory that builds the engine called `name`.
+
+        Args:
+            name (str): The engine name, e.g. "local" or "global".
+            factory (callable): Called with an artifacts directory, returns the engine.
+        """
+        with self._lock:
+            self._factories[name] = factory
+            self._ready_events.setdefault(name, threading.Event())
+
+    def on_swap(self, listener):
+        """
+        Call `listener(name, old_run, new_run)` whenever a newer engine replaces a live one.
+
+        Args:
+            listener (callable): The callback, run on the thread that built the new engine.
+        """
+        with self._lock:
+            self._swap_listeners.append(listener)
+
+    def start(self, run=None):
+        """
+        Start building every registered engine for `run` (the newest completed run by default).
+
+        Does nothing if the registry was already started.
+
+        Args:
+            run (IndexRun, optional): The index run to serve.
+        """
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        run = run or discover_latest_run()
+        if run is None:
+            logger.error("No completed index run found; search engines cannot load")
+            with self._lock:
+                for name in self._factories:
+                    self._errors[name] = "No completed index run found"
+                    self._ready_events[name].set()
+            return
+        self.load(run)
+
+    def watch(self, output_dir=None, poll_seconds=None):
+        """
+        Watch the index output directory and hot swap to every newly completed run.
+
+        Args:
+            output_dir (str, optional): The GraphRAG output directory.
+            poll_seconds (float, optional): Seconds between scans.
+        """
+        kwargs = {}
+        if output_dir:
+            kwargs["output_dir"] = output_dir
+        if poll_seconds:
+            kwargs["poll_seconds"] = poll_seconds
+        with self._lock:
+            if self._watcher is not None:
+                return
+            self._watcher = IndexWatcher(self.load, **kwargs)
+            current = next((version.run for version in self._live.values()), None)
+            current = current or next((version.run for version in self._loading.values()), None)
+        self._watcher.start(current)
+
+    def load(self, run):
+        """
+        Build every registered engine for `run` in the background and swap each in once built.
+
+        Args:
+            run (IndexRun): The index run to load.
+        """
+        with self._lock:
+            self._started = True
+            for name in self._factories:
+                version = _EngineVersion(name, run, next(self._seq))
+                self._loading[name] = version
+                # a build of an older run still waiting to be retried is abandoned for this one
+                self._retries.pop(name, None)
+                self._versions_alive[run] = self._versions_alive.get(run, 0) + 1
+                self._builds_pending[run] = self._builds_pending.get(run, 0) + 1
+                builder = threading.Thread(
+                    target=self._build, args=(version,),
+                    name=f"engine-{name}-{run.run_id}", daemon=True)
+                self._builders.append(builder)
+                builder.start()
+
+    def wait_for_loads(self, timeout=None):
+        """
+        Block until every engine build started so far has finished, swap listeners included.
+
+        Once it returns no registry thread is running, so the process can be forked safely.
+
+        Args:
+            timeout (float, optional): Maximum number of seconds to wait.
+
+        Returns:
+            bool: True if every engine is ready.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            with self._lock:
+                self._builders = [thread for thread in self._builders if thread.is_alive()]
+                builders = list(self._builders)
+            if not builders:
+                break
+            remaining = deadline - time.monotonic() if deadline is not None else None
+            if remaining is not None and remaining <= 0:
+                break
+            builders[0].join(remaining)
+        return self.is_ready()
+
+    def _build(self, version):
+        """
+        Build one engine version, then free the run's decoded artifacts if it was the last to build.
+
+        The engines turn the artifacts into DataFrames and model objects of their own, so the
+        Arrow tables the store shares between them are only needed while a build is running.
+
+        Args:
+            version (_EngineVersion): The version to build.
+        """
+        try:
+            self._build_version(version)
+        finally:
+            with self._lock:
+                remaining = self._builds_pending.get(version.run, 0) - 1
+                if remaining > 0:
+                    self._builds_pending[version.run] = remaining
+                else:
+                    self._builds_pending.pop(version.run, None)
+            if remaining <= 0:
+                release_store(version.run.input_dir)
+
+    def _build_version(self, version):
+        """
+        Build one engine version and make it live unless a newer one already is.
+
+        A failed build is retried after a backoff, up to BUILD_ATTEMPTS attempts, unless a
+        newer run started loading meanwhile. Queries fail fast while it waits.
+
+        Args:
+            version (_EngineVersion): The version to build.
+        """
+        name = version.name
+        for attempt in itertools.count(1):
+            started = time.perf_counter()
+            logger.info("Building %s search engine for index run %s (attempt %s of %s)",
+                        name, version.run.run_id, attempt, BUILD_ATTEMPTS)
+            try:
+                engine = self._factories[name](version.run.input_dir)
+                break
+            except Exception as e:
+                logger.exception("Failed to build %s search engine for index run %s",
+                                 name, version.run.run_id)
+                delay = min(BUILD_RETRY_SECONDS * 2 ** (attempt - 1), BUILD_RETRY_MAX_SECONDS)
+                with self._lock:
+                    self._errors[name] = f"{version.run.run_id}: {e}"
+                    retry = attempt < BUILD_ATTEMPTS and self._loading.get(name) is version
+                    if retry:
+                        self._retries[name] = {"attempts": attempt, "retry_at": time.time() + delay}
+                    else:
+                        self._give_up(version)
+                    self._ready_events[name].set()
+            if not retry:
+                return
+            time.sleep(delay)
+            with self._lock:
+                if self._loading.get(name) is not version:
+                    # a newer run is loading; its build replaces this one
+                    self._drop(version)
+                    return
+
+        elapsed = time.perf_counter() - started
+        swapped = None
+        with self._lock:
+            version.engine = engine
+            if self._loading.get(name) is version:
+                del self._loading[name]
+                self._retries.pop(name, None)
+            old = self._live.get(name)
+            if old is not None and old.seq > version.seq:
+                # A newer run finished first; this one is already stale
+                version.retired = True
+                self._drop(version)
+            else:
+                self._live[name] = version
+                self._errors.pop(name, None)
+                self._load_seconds[name] = elapsed
+                if old is not None:
+                    self._retire(old)
+                    swapped = old.run
+            self._ready_events[name].set()
+            listeners = list(self._swap_listeners)
+        logger.info("%s search engine for index run %s ready in %.1fs",
+                    name, version.run.run_id, elapsed)
+        if swapped is not None:
+            for listener in listeners:
+                try:
+                    listener(name, swapped, version.run)
+                except Exception:
+                    logger.exception("Swap listener failed for %s search engine", name)
+
+    def _give_up(self, version):
+        """Stop building a version that failed for good. Requires the lock."""
+        if self._loading.get(version.name) is version:
+            del self._loading[version.name]
+            self._retries.pop(version.name, None)
+        self._drop(version)
+
+    def _retire(self, version):
+        """Mark a version as replaced and drop it now if no query is using it. Requires the lock."""
+        version.retired = True
+        if version.leases == 0:
+            self._drop(version)
+        else:
+            self._draining.add(version)
+
+    def _drop(self, version):
+        """Release an engine version and, with the last engine of its run, the run's artifacts. Requires the lock."""
+        self._draining.discard(version)
+        version.engine = None
+        remaining = self._versions_alive.get(version.run, 0) - 1
+        if remaining > 0:
+            self._versions_alive[version.run] = remaining
+            return
+        self._versions_alive.pop(version.run, None)
+        release_store(version.run.input_dir)
+        release_counting_encoder(version.run.input_dir)
+        logger.info("Released index run %s", version.run.run_id)
+
+    @contextmanager
+    def lease(self, name, wait=True, timeout=None):
+        """
+        Borrow the live engine called `name` for the duration of one query.
+
+        The engine is guaranteed to stay usable until the block exits, even if a newer
+        index run is swapped in meanwhile.
+
+        Args:
+            name (str): The engine name.
+            wait (bool): Block until the engine has finished loading.
+            timeout (float, optional): Maximum number of seconds to wait.
+
+        Yields:
+            object: The search engine.
+
+        Raises:
+            KeyError: If no engine is registered under `name`.
+            EngineNotReadyError: If the engine is still loading or failed to load.
+        """
+        with self.lease_version(name, wait=wait, timeout=timeout) as version:
+            yield version.engine
+
+    @contextmanager
+    def lease_version(self, name, wait=True, timeout=None):
+        """
+        Like `lease`, but yield the engine version so callers also know which index run it serves.
+
+        Args:
+            name (str): The engine name.
+            wait (bool): Block until the engine has finished loading.
+            timeout (float, optional): Maximum number of seconds to wait.
+
+        Yields:
+            _EngineVersion: The leased version; `.engine` is the search engine and `.run` its IndexRun.
+
+        Raises:
+            KeyError: If no engine is registered under `name`.
+            EngineNotReadyError: If the engine is still loading or failed to load.
+        """
+        if name not in self._factories:
+            raise KeyError(f"No search engine registered as '{name}'")
+        self.start()
+        if wait:
+            self._ready_events[name].wait(timeout)
+        with self._lock:
+            version = self._live.get(name)
+            if version is None:
+                if name in self._errors and name not in self._loading:
+                    raise EngineNotReadyError(
+                        f"The {name} search engine failed to load: {self._errors[name]}")
+                if name in self._retries:
+                    raise EngineNotReadyError(
+                        f"The {name} search engine failed to load and will be retried: {self._errors[name]}")
+                raise EngineNotReadyError(f"The {name} search engine is still loading")
+            version.leases += 1
+        try:
+            yield version
+        finally:
+            self._release(version)
+
+    @contextmanager
+    def extend_lease(self, version):
+        """
+        Take one more lease on an engine version the caller already holds.
+
+        Work handed off to a task that may outlive the caller's own lease, such as a search
+        shared between concurrent requests, keeps the engine usable this way.
+
+        Args:
+            version (_EngineVersion): A version leased with `lease_version`.
+
+        Yields:
+            _EngineVersion: The same version.
+        """
+        with self._lock:
+            version.leases += 1
+        try:
+            yield version
+        finally:
+            self._release(version)
+
+    def _release(self, version):
+        with self._lock:
+            version.leases -= 1
+            if version.retired and version.leases == 0:
+                self._drop(version)
+
+    def current_run(self, name):
+        """
+        Return the index run the live engine called `name` was built from.
+
+        Args:
+            name (str): The engine name.
+
+        Returns:
+            IndexRun: The live run, or None if the engine is not ready.
+        """
+        with self._lock:
+            version = self._live.get(name)
+            return version.run if version else None
+
+    def is_ready(self, name=None):
+        """
+        Check whether one engine, or every registered engine, is ready.
+
+        Args:
+            name (str, optional): The engine name. Checks all engines when omitted.
+
+        Returns:
+            bool: True if the engine(s) are ready to serve queries.
+        """
+        with self._lock:
+            names = [name] if name else list(self._factories)
+            return bool(names) and all(n in self._live for n in names)
+
+    def _status_of(self, name):
+        if name in self._live:
+            return READY
+        if name in self._loading:
+            return RETRYING if name in self._retries else LOADING
+        if name in self._errors:
+            return FAILED
+        return PENDING
+
+    def status(self):
+        """
+        Describe the load state of every registered engine.
+
+        Returns:
+            dict: A mapping of engine name to its status, index run, load time, in-flight queries and
+                last error, and for a failed build waiting to be retried, the attempts so far and the
+                seconds until the next one.
+        """
+        with self._lock:
+            report = {}
+            now = time.time()
+            for name in self._factories:
+                live = self._live.get(name)
+                loading = self._loading.get(name)
+                retry = self._retries.get(name)
+                report[name] = {
+                    "status": self._status_of(name),
+                    "run_id": live.run.run_id if live else None,
+                    "loading_run_id": loading.run.run_id if loading else None,
+                    "in_flight": live.leases if live else 0,
+                    "draining": sum(
+                        version.leases for version in self._draining if version.name == name),
+                    "load_seconds": self._load_seconds.get(name),
+                    "error": self._errors.get(name),
+                    "build_attempts": retry["attempts"] if retry else None,
+                    "next_retry_seconds": max(retry["retry_at"] - now, 0.0) if retry else None,
+                }
+            return report
+
+
+registry = EngineRegistry()
@@ -1,12 +1,29 @@
+import logging
 import os
+
 import pandas as pd
-import tiktoken
 from dotenv import load_dotenv
 from graphrag.query.indexer_adapters import read_indexer_entities, read_indexer_reports
-from graphrag.query.llm.oai.chat_openai import ChatOpenAI
 from graphrag.query.llm.oai.typing import OpenaiApiType
-from graphrag.query.structured_search.global_search.community_context import GlobalCommunityContext
-from graphrag.query.structured_search.global_search.search import GlobalSearch
+
+from artifact_store import get_store
+from context_builders import PrebatchedGlobalContext, TimedGlobalContext
+from embedding_cache import get_document_embedder, get_query_embedder
+from engine_registry import registry
+from report_prefilter import ENABLED as REPORT_PREFILTER_ENABLED, PrefilteredGlobalSearch, ReportPrefilter
+from rate_governor import GovernedChatOpenAI
+from response_cache import acached_search, cached_search
+from streaming import StreamingCallback
+from token_counts import get_counting_encoder, report_rows
+
+logger = logging.getLogger(__name__)
+
+# Global search never reads entity embeddings, so that column is not decoded
+ENTITY_COLUMNS = ["level", "title", "degree", "community"]
+ENTITY_EMBEDDING_COLUMNS = ["id", "name", "type", "description", "human_readable_id", "text_unit_ids"]
+COMMUNITY_REPORT_COLUMNS = ["community", "level", "title", "summary", "full_content", "rank"]
+# Batch the community reports once per engine instead of once per query
+PREBATCH_REPORTS = os.getenv("GRAPHRAG_GLOBAL_PREBATCH", "1") == "1"
 
 
 def load_environment_variables():
@@ -29,9 +46,10 @@ def initialize_llm(api_key, model):
         model (str): The name of the LLM model to use.
 
     Returns:
-        ChatOpenAI: An instance of ChatOpenAI configured with the specified parameters.
+        GovernedChatOpenAI: A ChatOpenAI configured with the specified parameters, whose calls go
+            through the process-wide rate governor.
     """
-    return ChatOpenAI(
+    return GovernedChatOpenAI(
         api_key=api_key,
         model=model,
         api_type=OpenaiApiType.OpenAI,
@@ -41,7 +59,7 @@ def initialize_llm(api_key, model):
 
 def load_data(input_dir, entity_table, community_report_table, entity_embedding_table):
     """
-    Load data from parquet files.
+    Load data from the shared artifact store.
 
     Args:
         input_dir (str): The directory containing the input parquet files.
@@ -52,11 +70,10 @@ def load_data(input_dir, entity_table, community_report_table, entity_embedding_
     Returns:
         tuple: A tuple containing DataFrames for entities, reports, and entity embeddings.
     """
-    entity_df = pd.read_parquet(f"{input_dir}/{entity_table}.parquet")
-    report_df = pd.read_parquet(
-        f"{input_dir}/{community_report_table}.parquet")
-    entity_embedding_df = pd.read_parquet(
-        f"{input_dir}/{entity_embedding_table}.parquet")
+    store = get_store(input_dir)
+    entity_df = store.frame(entity_table, ENTITY_COLUMNS)
+    report_df = store.frame(community_report_table, COMMUNITY_REPORT_COLUMNS)
+    entity_embedding_df = store.frame(entity_embedding_table, ENTITY_EMBEDDING_COLUMNS)
     return entity_df, report_df, entity_embedding_df
 
 
@@ -70,16 +87,18 @@ def initialize_context_builder(reports, entities, token_encoder):
         token_encoder (object): The token encoder to use.
 
     Returns:
-        GlobalCommunityContext: An instance of GlobalCommunityContext configured with the specified parameters.
+        GlobalCommunityContext: A TimedGlobalContext configured with the specified parameters,
+            a PrebatchedGlobalContext when GRAPHRAG_GLOBAL_PREBATCH is on.
     """
-    return GlobalCommunityContext(
+    context_builder_class = PrebatchedGlobalContext if PREBATCH_REPORTS else TimedGlobalContext
+    return context_builder_class(
         community_reports=reports,
         entities=entities,
         token_encoder=token_encoder,
     )
 
 
-def initialize_search_engine(llm, context_builder, token_encoder):
+def initialize_search_engine(llm, context_builder, token_encoder, report_prefilter=None):
     """
     Initialize the global search engine.
 
@@ -87,9 +106,11 @@ def initialize_search_engine(llm, context_builder, token_encoder):
         llm (ChatOpenAI): The language model to use for the search engine.
         context_builder (GlobalCommunityContext): The context builder for the search engine.
         token_encoder (object): The token encoder to use.
+        report_prefilter (ReportPrefilter, optional): Selects the reports batched for each query.
 
     Returns:
-        GlobalSearch: An instance of GlobalSearch configured with the specified parameters.
+        PrefilteredGlobalSearch: A GlobalSearch that answers repeated map calls from the map cache
+            and, given a prefilter, only maps the reports relevant to the query.
     """
     context_builder_params = {
         "use_community_summary": False,
@@ -115,7 +136,7 @@ def initialize_search_engine(llm, context_builder, token_encoder):
         "temperature": 0.0,
     }
 
-    return GlobalSearch(
+    return PrefilteredGlobalSearch(
         llm=llm,
         context_builder=context_builder,
         token_encoder=token_encoder,
@@ -127,21 +148,25 @@ def initialize_search_engine(llm, context_builder, token_encoder):
         context_builder_params=context_builder_params,
         concurrent_coroutines=32,
         response_type="multiple paragraphs",
+        callbacks=[StreamingCallback()],
+        report_prefilter=report_prefilter,
     )
 
 
-def main():
+def main(input_dir):
     """
     Main function to initialize and configure the global search engine.
 
+    Args:
+        input_dir (str): The artifacts directory of the index run to serve.
+
     Returns:
         GlobalSearch: An instance of GlobalSearch configured with the specified parameters.
     """
     api_key, llm_model = load_environment_variables()
     llm = initialize_llm(api_key, llm_model)
-    token_encoder = tiktoken.get_encoding("cl100k_base")
+    token_encoder = get_counting_encoder(input_dir)
 
-    input_dir = "/mnt/c/Users/rishu/OneDrive/Desktop/Rishub/AiHCCC/agents-grant/grant_agent_2/graphrag/ragtest/output/20240704-184122/artifacts"
     entity_table = "create_final_nodes"
     community_report_table = "create_final_community_reports"
     entity_embedding_table = "create_final_entities"
@@ -155,29 +180,108 @@ def main():
 
     context_builder = initialize_context_builder(
         reports, entities, token_encoder)
+    report_prefilter = None
+    if REPORT_PREFILTER_ENABLED:
+        if isinstance(context_builder, PrebatchedGlobalContext):
+            report_prefilter = ReportPrefilter(reports, get_query_embedder(), get_document_embedder())
+        else:
+            logger.warning("GRAPHRAG_REPORT_PREFILTER needs GRAPHRAG_GLOBAL_PREBATCH; not prefiltering")
     search_engine = initialize_search_engine(
-        llm, context_builder, token_encoder)
+        llm, context_builder, token_encoder, report_prefilter)
+
+    # One build up front computes the community weights, counts every report row and, when
+    # prebatching, fixes the report batches; the counts are then moved into the compact arrays
+    context_builder.build_context(**search_engine.context_builder_params)
+    token_encoder.counter.precompute(report_rows(reports, include_community_rank=True))
 
     return search_engine
 
 
-search_engine_global = main()
+registry.register("global", main)
+
+
+def _global_response(search_engine, result):
+    """Turn a GlobalSearchResult into the response dictionary of run_query_global."""
+    response = {
+        "response": result.response,
+        "llm_calls": result.llm_calls,
+        "prompt_tokens": result.prompt_tokens,
+        "map_calls_saved": getattr(result, "map_calls_saved", 0),
+        "map_prompt_tokens_saved": getattr(result, "map_prompt_tokens_saved", 0),
+        "context_data": result.context_data.get("reports", pd.DataFrame()),
+    }
+    if search_engine.report_prefilter is not None:
+        response["reports_selected"] = result.reports_selected
+        response["map_calls_skipped"] = result.map_calls_skipped
+    return response
+
+
+def run_query_global(search_engine, query):
+    """
+    Run a global search query against one search engine.
+
+    Args:
+        search_engine (GlobalSearch): The search engine.
+        query (str): The search query.
+
+    Returns:
+        dict: A dictionary containing the search response, LLM calls, prompt tokens, map calls
+            answered from the map cache, and context data; with a report prefilter, also the
+            number of reports selected and of map calls skipped.
+    """
+    return _global_response(search_engine, search_engine.search(query))
 
 
-def ask_query_global(query):
+async def arun_query_global(search_engine, query):
     """
-    Perform a global search query using the search engine.
+    Run a global search query on the running event loop.
 
     Args:
+        search_engine (GlobalSearch): The search engine.
         query (str): The search query.
 
+    Returns:
+        dict: The same dictionary as run_query_global.
+    """
+    return _global_response(search_engine, await search_engine.asearch(query))
+
+
+def ask_query_global(query, wait=True, use_cache=True, use_semantic_cache=True):
+    """
+    Perform a global search query using the search engine, answering repeats from the response caches.
+
+    Args:
+        query (str): The search query.
+        wait (bool): Block until the engine has loaded instead of raising EngineNotReadyError.
+        use_cache (bool): Look the query up in the exact-match response cache first.
+        use_semantic_cache (bool): Serve the answer to a near-identical earlier query when there is one.
+
     Returns:
         dict: A dictionary containing the search response, LLM calls, prompt tokens, and context data.
     """
-    result = search_engine_global.search(query)
-    return {
-        "response": result.response,
-        "llm_calls": result.llm_calls,
-        "prompt_tokens": result.prompt_tokens,
-        "context_data": result.context_data["reports"]
-    }
+    with registry.lease_version("global", wait=wait) as version:
+        return cached_search(
+            "global", version, query, run_query_global,
+            use_cache=use_cache, use_semantic_cache=use_semantic_cache)
+
+
+async def aask_query_global(query, use_cache=True, use_semantic_cache=True, limit=None):
+    """
+    Async ask_query_global for event loop callers; it never waits for the engine to load.
+
+    Args:
+        query (str): The search query.
+        use_cache (bool): Look the query up in the exact-match response cache first.
+        use_semantic_cache (bool): Serve the answer to a near-identical earlier query when there is one.
+        limit (asyncio.Semaphore, optional): Bounds the searches running at once; cache hits skip it.
+
+    Returns:
+        dict: A dictionary containing the search response, LLM calls, prompt tokens, and context data.
+
+    Raises:
+        EngineNotReadyError: If the engine has not finished loading.
+    """
+    with registry.lease_version("global", wait=False) as version:
+        return await acached_search(
+            "global", version, query, arun_query_global,
+            use_cache=use_cache, use_semantic_cache=use_semantic_cache, limit=limit)
@@ -1,8 +1,9 @@
+import functools
+import logging
 import time
 import os
 from typing import List, Optional
 import json
-import requests
 import gradio as gr
 from dotenv import load_dotenv
 from langchain.agents import AgentExecutor, create_tool_calling_agent
@@ -13,6 +14,14 @@ from langchain_core.prompts import (PromptTemplate, MessagesPlaceholder,
 from langchain_openai import ChatOpenAI
 from langchain_core.pydantic_v1 import BaseModel, Field
 from langchain.tools import tool
+import openai
+import requests
+from tenacity import Retrying, retry_if_exception_type, stop_after_attempt, wait_exponential_jitter
+
+from llm_clients import CONNECT_TIMEOUT_SECONDS, get_client_pool, http_timeout
+from rate_governor import INTERACTIVE, estimate_tokens, get_rate_governor
+
+logger = logging.getLogger(__name__)
 
 # Load environment variables
 load_dotenv()
@@ -25,6 +34,82 @@ load_dotenv()
 # Global variable to collect data
 collected_data = []
 
+# A global search can take minutes; the connection itself should not
+SEARCH_TIMEOUT_SECONDS = float(os.getenv("GRAPHRAG_SEARCH_TIMEOUT_SECONDS", "300"))
+# The chat model's calls are admitted by the API server's rate governor, so they share its
+# budgets and go before its map calls; empty to use a governor of this process only
+ADMISSION_URL = os.getenv("GRAPHRAG_LLM_ADMISSION_URL", "http://localhost:8000/llm/admission")
+# Attempts per chat call; each one is admitted again, so retries are charged to the budgets
+CHAT_ATTEMPTS = int(os.getenv("GRAPHRAG_CHAT_ATTEMPTS", "6"))
+RETRY_ERROR_TYPES = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+
+
+def admit(tokens):
+    """
+    Block until the API server's rate governor admits a chat call of `tokens`.
+
+    Falls back to this process's own governor when no admission URL is set or the server
+    cannot be reached, so the chat bot still runs without the search API.
+
+    Args:
+        tokens (int): The estimated tokens of the call.
+    """
+    if ADMISSION_URL:
+        try:
+            response = get_client_pool().session().post(
+                ADMISSION_URL, json={"tokens": tokens, "priority": INTERACTIVE},
+                timeout=(CONNECT_TIMEOUT_SECONDS, SEARCH_TIMEOUT_SECONDS))
+            response.raise_for_status()
+            return
+        except requests.RequestException:
+            logger.warning("LLM admission from %s failed; using this process's rate governor", ADMISSION_URL)
+    get_rate_governor().acquire(tokens, INTERACTIVE)
+
+
+class AdmittedChatOpenAI(ChatOpenAI):
+    """
+    ChatOpenAI whose every attempt, retries included, is first admitted by the rate governor.
+
+    The OpenAI SDK's own retries are off (max_retries=0), since they would resend without
+    asking the governor.
+    """
+
+    def _estimate_tokens(self, messages):
+        return estimate_tokens(
+            [message.content for message in messages if isinstance(message.content, str)], self.max_tokens)
+
+    def _retryer(self):
+        return Retrying(
+            stop=stop_after_attempt(CHAT_ATTEMPTS),
+            wait=wait_exponential_jitter(max=30),
+            reraise=True,
+            retry=retry_if_exception_type(RETRY_ERROR_TYPES),
+        )
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        tokens = self._estimate_tokens(messages)
+        for attempt in self._retryer():
+            with attempt:
+                admit(tokens)
+                return super()._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+
+@functools.lru_cache(maxsize=None)
+def chat_model(model, temperature):
+    """
+    Return the chat model of a (model, temperature) profile, created once and shared.
+
+    Args:
+        model (str): The OpenAI model name.
+        temperature (float): The sampling temperature.
+
+    Returns:
+        AdmittedChatOpenAI: The model, on the connection pool of the shared HTTP client.
+    """
+    return AdmittedChatOpenAI(
+        model=model, temperature=temperature, api_key=os.getenv('OPENAI_API_KEY'),
+        http_client=get_client_pool().http_client(), timeout=http_timeout(), max_retries=0)
+
 
 class GrantDetails(BaseModel):
     grant_amount: Optional[str] = Field(
@@ -93,7 +178,8 @@ def update_grant_acquisition_requirements(talent_acquisition_requirements: Grant
         data = {
             "query": query_search
         }
-        response = requests.post(url, headers=headers, data=json.dumps(data))
+        response = get_client_pool().session().post(
+            url, headers=headers, data=json.dumps(data), timeout=(CONNECT_TIMEOUT_SECONDS, SEARCH_TIMEOUT_SECONDS))
         search_results = response.json()
 
     else:
@@ -106,7 +192,8 @@ def update_grant_acquisition_requirements(talent_acquisition_requirements: Grant
         data = {
             "query": query_search
         }
-        response = requests.post(url, headers=headers, data=json.dumps(data))
+        response = get_client_pool().session().post(
+            url, headers=headers, data=json.dumps(data), timeout=(CONNECT_TIMEOUT_SECONDS, SEARCH_TIMEOUT_SECONDS))
         search_results = response.json()
     # convert the search results to a string
     print("Search Results: ", search_results)
@@ -118,8 +205,7 @@ def write_sample_grant_document(data: GrantWriteModel) -> str:
     """
     Generate a sample grant document based on the grant details provided.
     """
-    llm = ChatOpenAI(
-            model='gpt-4o', temperature=0.8, api_key=os.getenv('OPENAI_API_KEY'))
+    llm = chat_model('gpt-4o', 0.8)
     prompt = f"""
     ==========================Grant Details==========================
     Grant Name: {data.grant_name}
@@ -153,8 +239,7 @@ class GrantAcquisitionBot:
         self.openai_key = os.getenv('OPENAI_API_KEY')
         self.model_name = 'gpt-4o'
         self.temperature = 0.9
-        self.llm = ChatOpenAI(
-            model=self.model_name, temperature=self.temperature, api_key=self.openai_key)
+        self.llm = chat_model(self.model_name, self.temperature)
         self.system_prompt = self._get_system_prompt()
         self.chat_history.append(SystemMessage(content=self.system_prompt))
         self.tools = [update_grant_acquisition_requirements]
@@ -0,0 +1,400 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import cast
+
+import pandas as pd
+import yaml
+from datashaper import (
+    AsyncType,
+    NoopVerbCallbacks,
+    TableContainer,
+    VerbInput,
+    derive_from_rows,
+    progress_ticker,
+    verb,
+)
+
+import graphrag.config.defaults as defaults
+import graphrag.index.graph.extractors.community_reports.schemas as schemas
+from graphrag.config import create_graphrag_config
+from graphrag.index import create_pipeline_config
+from graphrag.index.config import PipelineWorkflowReference
+from graphrag.index.graph.extractors.community_reports import get_levels, prep_community_report_context
+from graphrag.index.input import load_input
+from graphrag.index.run import run_pipeline_with_config
+from graphrag.index.storage import FilePipelineStorage, MemoryPipelineStorage
+from graphrag.index.utils.ds_util import get_required_input_table
+from graphrag.index.verbs.graph.report.create_community_reports import load_strategy
+from graphrag.index.workflows.v1 import create_base_extracted_entities, create_final_community_reports
+
+from file_utils import atomic_write
+from index_runs import discover_latest_run
+
+logger = logging.getLogger(__name__)
+
+ROOT_DIR = os.getenv(
+    "GRAPHRAG_ROOT", os.path.join(os.path.dirname(os.path.abspath(__file__)), "ragtest"))
+
+TEXT_UNITS = "create_base_text_units"
+EXTRACTED_ENTITIES = "create_base_extracted_entities"
+COMMUNITY_REPORTS = "create_final_community_reports"
+# The entity graph extracted from each text unit, before the graphs are merged; kept with every
+# incremental run so the next one can drop the units that went away without extracting the rest again
+TEXT_UNIT_GRAPHS = "create_text_unit_graphs"
+MANIFEST = "incremental.json"
+_MISSING_DESCRIPTION = "No Description"
+
+
+def load_settings(root):
+    """
+    Read the indexing settings of a GraphRAG project, as `python -m graphrag.index` does.
+
+    Args:
+        root (str): The project directory holding settings.yaml.
+
+    Returns:
+        PipelineConfig: The pipeline configuration.
+    """
+    with open(os.path.join(root, "settings.yaml")) as f:
+        return create_pipeline_config(create_graphrag_config(yaml.safe_load(f), root))
+
+
+def _read_table(artifacts_dir, name):
+    path = os.path.join(artifacts_dir, f"{name}.parquet")
+    return pd.read_parquet(path) if os.path.isfile(path) else None
+
+
+def diff_documents(documents, previous_documents):
+    """
+    Compare the input documents with those of the previous run.
+
+    GraphRAG ids a document by the MD5 hash of its content, so a document whose file name is
+    known but whose id is not has changed.
+
+    Args:
+        documents (DataFrame): The input documents, with id and title.
+        previous_documents (DataFrame): The previous run's create_final_documents.
+
+    Returns:
+        dict: The titles of the added, changed, removed and unchanged documents.
+    """
+    previous = dict(zip(previous_documents["title"], previous_documents["id"]))
+    current = dict(zip(documents["title"], documents["id"]))
+    return {
+        "added": sorted(title for title in current if title not in previous),
+        "changed": sorted(title for title, id in current.items() if title in previous and previous[title] != id),
+        "removed": sorted(title for title in previous if title not in current),
+        "unchanged": sorted(title for title, id in current.items() if previous.get(title) == id),
+    }
+
+
+def community_fingerprints(nodes, edges):
+    """
+    Hash what a community report is written from, for every community.
+
+    A community's fingerprint covers the title, description and degree of its members and
+    every relationship touching one of them, which is all its report context is built from.
+    Two communities with the same fingerprint get the same report.
+
+    Args:
+        nodes (DataFrame): create_final_nodes, one row per entity and level.
+        edges (DataFrame): create_final_relationships.
+
+    Returns:
+        dict: The fingerprint of each (level, community).
+    """
+    nodes = nodes[nodes[schemas.NODE_COMMUNITY].notna()].fillna({schemas.NODE_DESCRIPTION: _MISSING_DESCRIPTION})
+    edges = edges.fillna({schemas.EDGE_DESCRIPTION: _MISSING_DESCRIPTION})
+    touching = {}
+    for row in edges[[schemas.EDGE_SOURCE, schemas.EDGE_TARGET, schemas.EDGE_DESCRIPTION,
+                      schemas.EDGE_DEGREE]].itertuples(index=False):
+        edge = tuple(str(value) for value in row)
+        touching.setdefault(edge[0], []).append(edge)
+        touching.setdefault(edge[1], []).append(edge)
+
+    fingerprints = {}
+    columns = [schemas.NODE_NAME, schemas.NODE_DESCRIPTION, schemas.NODE_DEGREE]
+    for (level, community), group in nodes.groupby([schemas.NODE_LEVEL, schemas.NODE_COMMUNITY]):
+        members = sorted(tuple(str(value) for value in row) for row in group[columns].itertuples(index=False))
+        relationships = sorted({edge for member in group[schemas.NODE_NAME] for edge in touching.get(member, [])})
+        digest = hashlib.sha256(json.dumps([members, relationships]).encode()).hexdigest()
+        fingerprints[(int(level), str(community))] = digest
+    return fingerprints
+
+
+class ReportReuse:
+    """The community reports of the previous run, by community fingerprint, and how often each way was taken."""
+
+    def __init__(self, reports, nodes, edges):
+        """
+        Args:
+            reports (DataFrame): The previous run's create_final_community_reports.
+            nodes (DataFrame): The previous run's create_final_nodes.
+            edges (DataFrame): The previous run's create_final_relationships.
+        """
+        fingerprints = community_fingerprints(nodes, edges)
+        self.reports = {}
+        for report in reports.drop(columns=["id"], errors="ignore").to_dict("records"):
+            fingerprint = fingerprints.get((int(report["level"]), str(report["community"])))
+            if fingerprint is not None:
+                report["findings"] = list(report["findings"])
+                self.reports[fingerprint] = report
+        self.reused = 0
+        self.generated = 0
+        self._lock = threading.Lock()
+
+    def take(self, fingerprint, community):
+        """
+        Return the previous report written from the same content, renumbered for the community.
+
+        Args:
+            fingerprint (str): The community fingerprint.
+            community (str): The community id in the new run.
+
+        Returns:
+            dict: The report, or None when the community is new or its content changed.
+        """
+        report = self.reports.get(fingerprint)
+        with self._lock:
+            if report is None:
+                self.generated += 1
+                return None
+            self.reused += 1
+        return {**report, "community": community}
+
+
+@verb(name="reuse_community_reports")
+async def reuse_community_reports(
+    input: VerbInput,
+    callbacks,
+    cache,
+    strategy: dict,
+    reuse: ReportReuse,
+    async_mode: AsyncType = AsyncType.AsyncIO,
+    num_threads: int = 4,
+    **_kwargs,
+) -> TableContainer:
+    """
+    graphrag's create_community_reports, copying the previous report of every community whose content is unchanged.
+
+    Only new communities, and those whose members or relationships changed, are sent to the LLM.
+    """
+    local_contexts = cast(pd.DataFrame, input.get_input())
+    nodes = cast(pd.DataFrame, get_required_input_table(input, "nodes").table)
+    edges = cast(pd.DataFrame, get_required_input_table(input, "edges").table)
+    community_hierarchy = cast(pd.DataFrame, get_required_input_table(input, "community_hierarchy").table)
+    fingerprints = community_fingerprints(nodes, edges)
+
+    levels = get_levels(nodes)
+    reports = []
+    tick = progress_ticker(callbacks.progress, len(local_contexts))
+    runner = load_strategy(strategy["type"])
+
+    for level in levels:
+        level_contexts = prep_community_report_context(
+            pd.DataFrame(reports),
+            local_context_df=local_contexts,
+            community_hierarchy_df=community_hierarchy,
+            level=level,
+            max_tokens=strategy.get("max_input_tokens", defaults.COMMUNITY_REPORT_MAX_INPUT_LENGTH),
+        )
+
+        async def run_generate(record):
+            community = record[schemas.NODE_COMMUNITY]
+            level = record[schemas.COMMUNITY_LEVEL]
+            report = reuse.take(fingerprints.get((int(level), str(community))), community)
+            if report is None:
+                report = await runner(
+                    community, record[schemas.CONTEXT_STRING], level, callbacks, cache, strategy)
+            tick()
+            return report
+
+        local_reports = await derive_from_rows(
+            level_contexts,
+            run_generate,
+            callbacks=NoopVerbCallbacks(),
+            num_threads=num_threads,
+            scheduling_type=async_mode,
+        )
+        reports.extend([report for report in local_reports if report is not None])
+
+    return TableContainer(table=pd.DataFrame(reports))
+
+
+def text_unit_graph_steps(config):
+    """The extraction step of create_base_extracted_entities alone: one entity graph per text unit, unmerged."""
+    extraction = config.get("entity_extract", {})
+    return [
+        {
+            "verb": "entity_extract",
+            "args": {
+                **extraction,
+                "column": extraction.get("text_column", "chunk"),
+                "id_column": extraction.get("id_column", "chunk_id"),
+                "async_mode": extraction.get("async_mode", AsyncType.AsyncIO),
+                "to": "entities",
+                "graph_to": "entity_graph",
+            },
+            "input": {"source": f"workflow:{TEXT_UNITS}"},
+        },
+        {"verb": "select", "args": {"columns": ["id", "entity_graph"]}},
+    ]
+
+
+def merged_extraction_steps(config):
+    """create_base_extracted_entities, merging the stored per text unit graphs instead of extracting them."""
+    steps = [
+        step for step in create_base_extracted_entities.build_steps(config)
+        if step["verb"] in ("merge_graphs", "snapshot_rows")
+    ]
+    steps[0]["input"] = {"source": f"workflow:{TEXT_UNIT_GRAPHS}"}
+    return steps
+
+
+def report_steps(reuse):
+    """Return the create_final_community_reports steps, with report generation replaced by reuse_community_reports."""
+    def build_steps(config):
+        steps = create_final_community_reports.build_steps(config)
+        for step in steps:
+            if step["verb"] == "create_community_reports":
+                step["verb"] = "reuse_community_reports"
+                step["args"] = {**step["args"], "reuse": reuse}
+                step["input"] = {**step["input"], "edges": "edges"}
+        return steps
+    return build_steps
+
+
+async def _run_workflows(pipeline, run_id, dataset, storage, workflows, additional_workflows=None):
+    """Run workflows, skipping those whose table is already in the storage; returns the tables made."""
+    tables = {}
+    async for output in run_pipeline_with_config(
+        pipeline,
+        workflows=workflows,
+        dataset=dataset,
+        storage=storage,
+        additional_workflows=additional_workflows,
+        run_id=run_id,
+        is_resume_run=True,
+    ):
+        if output.errors:
+            raise RuntimeError(f"Workflow {output.workflow} failed") from output.errors[0]
+        tables[output.workflow] = output.result
+    return tables
+
+
+def _workflow(pipeline, name):
+    return next(workflow for workflow in pipeline.workflows if workflow.name == name)
+
+
+async def run_incremental(root=ROOT_DIR, run_id=None, dry_run=False):
+    """
+    Index the documents added or changed since the latest run, into a new run reusing the rest of it.
+
+    The documents are chunked as usual; only text units the previous run did not have go
+    through entity extraction. Their graphs are merged with the stored graphs of the
+    unchanged units, and the units of changed or removed documents are dropped. graphrag
+    then rebuilds everything downstream of the merged graph: description summaries and
+    embeddings come from its LLM cache unless they changed, and a community report is only
+    written again if the community is new or its content changed.
+
+    The first incremental run after a full run has no stored per-unit graphs yet; it
+    replays the extraction of the unchanged units from graphrag's cache, without LLM calls
+    as long as the cache and extraction settings are those of the full run.
+
+    Args:
+        root (str): The GraphRAG project directory.
+        run_id (str, optional): The new run's folder name; the current time by default.
+        dry_run (bool): Only report which documents changed.
+
+    Returns:
+        dict: What was reused and what was redone, also written to the run as incremental.json;
+            None when no document changed or on a dry run.
+    """
+    started = time.perf_counter()
+    pipeline = load_settings(root)
+    previous = discover_latest_run(os.path.join(root, "output"))
+    if previous is None:
+        raise RuntimeError(f"No complete index run in {root}/output; run the full pipeline first")
+    documents = await load_input(pipeline.input, None, root)
+    documents_diff = diff_documents(documents, _read_table(previous.input_dir, "create_final_documents"))
+    print(json.dumps({"previous_run": previous.run_id, **{
+        name: titles for name, titles in documents_diff.items() if name != "unchanged"}}), flush=True)
+    if dry_run or not (documents_diff["added"] or documents_diff["changed"] or documents_diff["removed"]):
+        return None
+
+    run_id = run_id or time.strftime("%Y%m%d-%H%M%S")
+    artifacts_dir = os.path.join(root, pipeline.storage.base_dir.replace("${timestamp}", run_id))
+    storage = FilePipelineStorage(artifacts_dir)
+
+    # Chunking is cheap and content-addressed: a unit of an unchanged document keeps its id
+    await _run_workflows(pipeline, run_id, documents, storage, [_workflow(pipeline, TEXT_UNITS)])
+    text_units = pd.read_parquet(os.path.join(artifacts_dir, f"{TEXT_UNITS}.parquet"))
+    previous_units = set(_read_table(previous.input_dir, TEXT_UNITS)["id"])
+    stored = _read_table(previous.input_dir, TEXT_UNIT_GRAPHS)
+    graphs = dict(zip(stored["id"], stored["entity_graph"])) if stored is not None else {}
+    missing = text_units[~text_units["id"].isin(graphs.keys())]
+
+    extraction_config = _workflow(pipeline, EXTRACTED_ENTITIES).config
+    additional_workflows = {TEXT_UNIT_GRAPHS: text_unit_graph_steps}
+    if len(missing):
+        delta_storage = MemoryPipelineStorage()
+        await delta_storage.set(f"{TEXT_UNITS}.parquet", missing.to_parquet())
+        tables = await _run_workflows(
+            pipeline, run_id, documents, delta_storage,
+            [PipelineWorkflowReference(name=TEXT_UNIT_GRAPHS, config=extraction_config)], additional_workflows)
+        graphs.update(zip(tables[TEXT_UNIT_GRAPHS]["id"], tables[TEXT_UNIT_GRAPHS]["entity_graph"]))
+    # In chunk order, so the merged graph is the one a full run would build
+    unit_graphs = pd.DataFrame({"id": text_units["id"], "entity_graph": text_units["id"].map(graphs)})
+    await storage.set(f"{TEXT_UNIT_GRAPHS}.parquet", unit_graphs.to_parquet())
+
+    reuse = ReportReuse(
+        _read_table(previous.input_dir, COMMUNITY_REPORTS),
+        _read_table(previous.input_dir, "create_final_nodes"),
+        _read_table(previous.input_dir, "create_final_relationships"),
+    )
+    await _run_workflows(pipeline, run_id, documents, storage, pipeline.workflows, {
+        **additional_workflows,
+        EXTRACTED_ENTITIES: merged_extraction_steps,
+        COMMUNITY_REPORTS: report_steps(reuse),
+    })
+
+    new_units = ~missing["id"].isin(previous_units)
+    manifest = {
+        "run_id": run_id,
+        "previous_run": previous.run_id,
+        "documents": documents_diff,
+        "text_units": len(text_units),
+        "text_units_extracted": int(new_units.sum()),
+        "text_units_replayed": int((~new_units).sum()),
+        "text_units_dropped": len(previous_units - set(text_units["id"])),
+        "reports_reused": reuse.reused,
+        "reports_generated": reuse.generated,
+        "total_runtime": time.perf_counter() - started,
+    }
+    atomic_write(os.path.join(artifacts_dir, MANIFEST), json.dumps(manifest, indent=4))
+    return manifest
+
+
+def main():
+    """Index the added or changed input documents into a new run, reusing the latest one."""
+    parser = argparse.ArgumentParser(
+        description="Incrementally index a GraphRAG project: extract entities only from new or changed text "
+                    "units, and rewrite only the community reports whose communities changed.")
+    parser.add_argument("--root", default=ROOT_DIR, help="The GraphRAG project directory.")
+    parser.add_argument("--run-id", help="The new run's folder name; the current time by default.")
+    parser.add_argument("--dry-run", action="store_true", help="Only report which documents changed.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s: %(message)s")
+    manifest = asyncio.run(run_incremental(args.root, args.run_id, args.dry_run))
+    if manifest is not None:
+        print(json.dumps(manifest), flush=True)
+
+
+if __name__ == "__main__":
+    main()
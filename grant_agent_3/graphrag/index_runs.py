@@ -0,0 +1,138 @@
+import logging
+import os
+import threading
+from dataclasses import dataclass
+
+logger = logging.getLogger(__name__)
+
+OUTPUT_DIR = os.getenv(
+    "GRAPHRAG_OUTPUT_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "ragtest", "output"))
+POLL_SECONDS = float(os.getenv("GRAPHRAG_INDEX_POLL_SECONDS", "30"))
+
+# A run only counts as complete once the pipeline has written its stats and every table the
+# search engines read
+COMPLETION_MARKER = "stats.json"
+REQUIRED_TABLES = [
+    "create_final_nodes",
+    "create_final_entities",
+    "create_final_relationships",
+    "create_final_community_reports",
+    "create_final_text_units",
+]
+
+
+@dataclass(frozen=True)
+class IndexRun:
+    """A completed GraphRAG indexing run."""
+
+    run_id: str
+    input_dir: str
+
+
+def is_complete_run(artifacts_dir):
+    """
+    Check whether an artifacts directory holds a finished indexing run.
+
+    Args:
+        artifacts_dir (str): The `<run>/artifacts` directory.
+
+    Returns:
+        bool: True if the completion marker and all required tables exist.
+    """
+    if not os.path.isfile(os.path.join(artifacts_dir, COMPLETION_MARKER)):
+        return False
+    return all(
+        os.path.isfile(os.path.join(artifacts_dir, f"{table}.parquet"))
+        for table in REQUIRED_TABLES
+    )
+
+
+def discover_latest_run(output_dir=OUTPUT_DIR):
+    """
+    Find the newest completed indexing run.
+
+    Run folders are named by their start timestamp (e.g. 20240704-184122), so the
+    lexically greatest complete one is the newest.
+
+    Args:
+        output_dir (str): The GraphRAG output directory holding one folder per run.
+
+    Returns:
+        IndexRun: The newest completed run, or None if there is none.
+    """
+    if not os.path.isdir(output_dir):
+        return None
+    for run_id in sorted(os.listdir(output_dir), reverse=True):
+        artifacts_dir = os.path.join(output_dir, run_id, "artifacts")
+        if is_complete_run(artifacts_dir):
+            return IndexRun(run_id=run_id, input_dir=artifacts_dir)
+    return None
+
+
+class IndexWatcher:
+    """Poll the output directory and report every newly completed indexing run."""
+
+    def __init__(self, on_new_run, output_dir=OUTPUT_DIR, poll_seconds=POLL_SECONDS):
+        """
+        Args:
+            on_new_run (callable): Called with the IndexRun whenever a newer run completes.
+            output_dir (str): The GraphRAG output directory.
+            poll_seconds (float): Seconds between scans.
+        """
+        self.on_new_run = on_new_run
+        self.output_dir = output_dir
+        self.poll_seconds = poll_seconds
+        self._seen = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, current_run=None):
+        """
+        Start watching in a daemon thread.
+
+        Args:
+            current_run (IndexRun, optional): The run already being served, so it is not reported again.
+        """
+        if self._thread is not None:
+            return
+        self.mark_served(current_run)
+        self._thread = threading.Thread(target=self._run, name="index-watcher", daemon=True)
+        self._thread.start()
+
+    def mark_served(self, run):
+        """
+        Record the run being served, so `poll` only reports newer ones.
+
+        Args:
+            run (IndexRun): The run being served, or None.
+        """
+        self._seen = run.run_id if run else None
+
+    def stop(self):
+        """Stop the watcher thread."""
+        self._stop.set()
+
+    def poll(self):
+        """
+        Scan once and report the latest run if it is new.
+
+        Returns:
+            IndexRun: The newly reported run, or None.
+        """
+        run = discover_latest_run(self.output_dir)
+        if run is None or run.run_id == self._seen:
+            return None
+        if self._seen is not None and run.run_id < self._seen:
+            return None
+        self._seen = run.run_id
+        logger.info("Discovered index run %s", run.run_id)
+        self.on_new_run(run)
+        return run
+
+    def _run(self):
+        while not self._stop.wait(self.poll_seconds):
+            try:
+                self.poll()
+            except Exception:
+                logger.exception("Failed to scan %s for new index runs", self.output_dir)
@@ -0,0 +1,376 @@
+import os
+import re
+import unicodedata
+
+import numpy as np
+from graphrag.vector_stores.base import (
+    BaseVectorStore,
+    VectorStoreDocument,
+    VectorStoreSearchResult,
+)
+
+from adjacency import CSRIndex
+from metrics import stage
+
+# Share of the keyword ranking in the fused ranking; the vector ranking has weight 1
+KEYWORD_WEIGHT = float(os.getenv("GRAPHRAG_HYBRID_KEYWORD_WEIGHT", "1.0"))
+# Answer queries naming an entity by its exact title from the keyword index alone, without embedding them
+FAST_PATH = os.getenv("GRAPHRAG_KEYWORD_FAST_PATH", "1") == "1"
+# A title counts as named only if its rarest word is in at most this share of the text units
+FAST_PATH_MAX_DF = float(os.getenv("GRAPHRAG_KEYWORD_FAST_PATH_MAX_DF", "0.05"))
+# Title matches count this many times a text unit match of the same score
+TITLE_WEIGHT = 2.0
+# Reciprocal rank fusion constant: a result at rank r scores weight / (RRF_K + r)
+RRF_K = 60
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from has have how i in is it me my of on or our "
+    "that the their there these this to was we were what when where which who why will with you your".split())
+
+
+def tokenize(text):
+    """
+    Split text into the lowercase words the keyword index matches on.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        list: The words, in order, without stopwords.
+    """
+    words = _TOKEN.findall(unicodedata.normalize("NFKC", text or "").lower())
+    return [word for word in words if word not in STOPWORDS]
+
+
+class BM25Index:
+    """
+    Okapi BM25 over a fixed set of documents, with the postings in CSR arrays.
+
+    Term `t` is posted in the documents `postings.row(t)`, in document order, and
+    `weights[postings.indptr[t]:postings.indptr[t + 1]]` holds its precomputed BM25 term
+    weights there, so scoring a query is one scatter-add per query word.
+    """
+
+    def __init__(self, documents, k1=BM25_K1, b=BM25_B):
+        """
+        Args:
+            documents (iterable): The tokenized documents, one list of words each.
+            k1 (float): The BM25 term frequency saturation.
+            b (float): The BM25 document length normalization.
+        """
+        self.vocabulary = {}
+        terms, frequencies, lengths, unique_counts = [], [], [], []
+        for words in documents:
+            ids = np.fromiter(
+                (self.vocabulary.setdefault(word, len(self.vocabulary)) for word in words), dtype=np.int64,
+                count=len(words))
+            unique, counts = np.unique(ids, return_counts=True)
+            terms.append(unique)
+            frequencies.append(counts)
+            lengths.append(len(words))
+            unique_counts.append(len(unique))
+        self.n_documents = len(lengths)
+        terms = np.concatenate(terms) if terms else np.empty(0, dtype=np.int64)
+        frequencies = np.concatenate(frequencies).astype(np.float32) if frequencies else np.empty(0, np.float32)
+        documents = np.repeat(np.arange(self.n_documents), unique_counts)
+        order = np.argsort(terms, kind="stable")
+        indptr = np.zeros(len(self.vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(terms, minlength=len(self.vocabulary)), out=indptr[1:])
+        self.postings = CSRIndex(indptr, documents[order].astype(np.int32))
+
+        lengths = np.asarray(lengths, dtype=np.float32)
+        average = lengths.mean() if len(lengths) and lengths.mean() > 0 else 1.0
+        self.document_frequencies = np.diff(self.postings.indptr)
+        idf = np.log1p((self.n_documents - self.document_frequencies + 0.5) / (self.document_frequencies + 0.5))
+        tf = frequencies[order]
+        norm = k1 * (1 - b + b * lengths[self.postings.indices] / average)
+        self.weights = (idf[terms[order]] * tf * (k1 + 1) / (tf + norm)).astype(np.float32)
+
+    def scores(self, words):
+        """
+        Score every document against a query.
+
+        Args:
+            words (list): The query words; repeats count once.
+
+        Returns:
+            ndarray: The float32 BM25 score of each document; 0 where no query word occurs.
+        """
+        scores = np.zeros(self.n_documents, dtype=np.float32)
+        for word in set(words):
+            term = self.vocabulary.get(word)
+            if term is None:
+                continue
+            start, end = self.postings.indptr[term], self.postings.indptr[term + 1]
+            # a term is posted once per document, so the fancy-indexed add has no repeats
+            scores[self.postings.indices[start:end]] += self.weights[start:end]
+        return scores
+
+    def document_frequency(self, word):
+        """Return the number of documents containing a word."""
+        term = self.vocabulary.get(word)
+        return 0 if term is None else int(self.document_frequencies[term])
+
+    @property
+    def nbytes(self):
+        return self.postings.nbytes + self.weights.nbytes + self.document_frequencies.nbytes
+
+
+class EntityKeywordIndex:
+    """
+    Scores entities against a query by keyword, over their titles and the text units they appear in.
+
+    An entity's score is TITLE_WEIGHT times the BM25 score of its title plus the best BM25
+    score among its text units, so an exact program name found only in the source text
+    still reaches the entities extracted from that text.
+    """
+
+    def __init__(self, entities, text_units, title_weight=TITLE_WEIGHT, max_df=FAST_PATH_MAX_DF):
+        """
+        Args:
+            entities (list): The Entity instances local search maps queries to.
+            text_units (list): The TextUnit instances of the index run.
+            title_weight (float): The weight of title matches against text unit matches.
+            max_df (float): The largest text unit share of a named title's rarest word.
+        """
+        self.entities = list(entities)
+        self.title_weight = title_weight
+        self.max_df = max_df
+        self.rows = {entity.id: row for row, entity in enumerate(self.entities)}
+        title_words = [tokenize(entity.title) for entity in self.entities]
+        self.titles = BM25Index(title_words)
+        self.units = BM25Index(tokenize(unit.text) for unit in text_units)
+
+        unit_rows = {unit.id: row for row, unit in enumerate(text_units)}
+        pairs = [
+            (unit_rows[unit_id], row)
+            for row, entity in enumerate(self.entities)
+            for unit_id in entity.text_unit_ids or []
+            if unit_id in unit_rows
+        ]
+        units, rows = zip(*pairs) if pairs else ((), ())
+        self.unit_entities = CSRIndex.from_pairs(units, rows, len(text_units))
+
+        self.title_lookup = {}
+        for row, words in enumerate(title_words):
+            if words:
+                self.title_lookup.setdefault(tuple(words), []).append(row)
+        self.longest_title = max((len(words) for words in self.title_lookup), default=0)
+
+    def _distinctive(self, words):
+        """Whether a title's rarest word is rare enough in the text units for the title to name an entity."""
+        rarest = min(self.units.document_frequency(word) for word in words)
+        return rarest <= self.max_df * max(self.units.n_documents, 1)
+
+    def named_entities(self, query):
+        """
+        Find the entities a query names by their exact title.
+
+        Longer titles win over the titles inside them ("FedDev Ontario" over "Ontario"), and
+        titles made only of common words do not count.
+
+        Args:
+            query (str): The query.
+
+        Returns:
+            list: The rows of the named entities, in query order.
+        """
+        words = tokenize(query)
+        taken = [False] * len(words)
+        named = []
+        for length in range(min(self.longest_title, len(words)), 0, -1):
+            for start in range(len(words) - length + 1):
+                if any(taken[start:start + length]):
+                    continue
+                title = tuple(words[start:start + length])
+                rows = self.title_lookup.get(title)
+                if rows and self._distinctive(title):
+                    named.append((start, rows))
+                    taken[start:start + length] = [True] * length
+        return [row for _, rows in sorted(named) for row in rows]
+
+    def scores(self, query):
+        """
+        Score every entity against a query.
+
+        Args:
+            query (str): The query.
+
+        Returns:
+            ndarray: The float32 keyword score of each entity; 0 where nothing matched.
+        """
+        words = tokenize(query)
+        scores = self.titles.scores(words) * self.title_weight
+        unit_scores = self.units.scores(words)
+        hits = np.flatnonzero(unit_scores)
+        if hits.size:
+            indptr, indices = self.unit_entities.indptr, self.unit_entities.indices
+            counts = indptr[hits + 1] - indptr[hits]
+            # the positions of every hit unit's entities in `indices`, concatenated
+            positions = np.repeat(indptr[hits] - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+            best = np.zeros(len(self.entities), dtype=np.float32)
+            np.maximum.at(best, indices[positions], np.repeat(unit_scores[hits], counts))
+            scores += best
+        return scores
+
+    @property
+    def nbytes(self):
+        return self.titles.nbytes + self.units.nbytes + self.unit_entities.nbytes
+
+
+def _top_k(scores, k):
+    """Return the rows of the k highest positive scores, best first."""
+    candidates = np.flatnonzero(scores > 0)
+    if len(candidates) > k:
+        candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+class HybridEntityStore(BaseVectorStore):
+    """
+    Entity description store that fuses the vector ranking with a keyword ranking.
+
+    Wraps the vector store local search maps queries through. A text search ranks the
+    entities with the EntityKeywordIndex and with the vector store, and merges the rankings
+    by reciprocal rank fusion; entities the query names by exact title come first. With the
+    fast path on, a query naming an entity is answered from the keyword index alone, and
+    in "keyword" mode every query is, so the query is never embedded. Searches by vector
+    and everything else go to the wrapped store.
+    """
+
+    def __init__(self, vector_store, keyword_index, mode="hybrid", keyword_weight=KEYWORD_WEIGHT,
+                 fast_path=FAST_PATH):
+        """
+        Args:
+            vector_store (BaseVectorStore): The entity description embedding store.
+            keyword_index (EntityKeywordIndex): The keyword index over the same entities.
+            mode (str): "hybrid" to fuse both rankings, or "keyword" for the keyword ranking alone.
+            keyword_weight (float): The weight of the keyword ranking in the fusion.
+            fast_path (bool): Skip the vector search for queries naming an entity.
+        """
+        if mode not in ("hybrid", "keyword"):
+            raise ValueError(f"Unknown retrieval mode: {mode}")
+        super().__init__(collection_name=vector_store.collection_name)
+        self.vector_store = vector_store
+        self.keyword_index = keyword_index
+        self.mode = mode
+        self.keyword_weight = keyword_weight
+        self.fast_path = fast_path
+        self._allowed = None
+
+    def __repr__(self):
+        # Part of the response cache fingerprint, so it must only show the knobs
+        return (f"HybridEntityStore(mode={self.mode}, keyword_weight={self.keyword_weight}, "
+                f"fast_path={self.fast_path}, title_weight={self.keyword_index.title_weight}, "
+                f"max_df={self.keyword_index.max_df})")
+
+    def connect(self, **kwargs):
+        self.vector_store.connect(**kwargs)
+
+    def load_documents(self, documents, overwrite=True):
+        self.vector_store.load_documents(documents, overwrite)
+
+    def filter_by_id(self, include_ids):
+        """
+        Restrict later searches to the given entity ids, in both rankings.
+
+        Args:
+            include_ids (list): The ids to keep. An empty list removes the filter.
+
+        Returns:
+            The filter of the wrapped store.
+        """
+        self.query_filter = self.vector_store.filter_by_id(include_ids)
+        if len(include_ids) == 0:
+            self._allowed = None
+        else:
+            self._allowed = np.zeros(len(self.keyword_index.entities), dtype=bool)
+            self._allowed[[self.keyword_index.rows[i] for i in include_ids if i in self.keyword_index.rows]] = True
+        return self.query_filter
+
+    def similarity_search_by_vector(self, query_embedding, k=10, **kwargs):
+        return self.vector_store.similarity_search_by_vector(query_embedding, k, **kwargs)
+
+    def keyword_only(self, text):
+        """
+        Whether a text search for this query skips the vector store, and so never embeds it.
+
+        Args:
+            text (str): The query.
+
+        Returns:
+            bool: True in "keyword" mode, or when the fast path is on and the query names an entity.
+        """
+        return self.mode == "keyword" or (self.fast_path and bool(self._named(text)))
+
+    def _named(self, text):
+        named = self.keyword_index.named_entities(text)
+        if self._allowed is not None:
+            named = [row for row in named if self._allowed[row]]
+        return named
+
+    def _result(self, row, score):
+        entity = self.keyword_index.entities[row]
+        return VectorStoreSearchResult(
+            document=VectorStoreDocument(
+                id=entity.id,
+                text=entity.description,
+                vector=None,
+                attributes={"title": entity.title},
+            ),
+            score=float(score),
+        )
+
+    def similarity_search_by_text(self, text, text_embedder, k=10, **kwargs):
+        """
+        Return the k entities best matching a query, by keyword and, unless skipped, by vector.
+
+        Args:
+            text (str): The query text.
+            text_embedder (callable): Turns the text into a vector; not called on the keyword-only path.
+            k (int): The number of results.
+
+        Returns:
+            list: VectorStoreSearchResult instances, best match first.
+        """
+        with stage("keyword_lookup"):
+            named = self._named(text)
+            scores = self.keyword_index.scores(text)
+            if self._allowed is not None:
+                scores[~self._allowed] = 0
+            scores[named] = 0
+            keyword_rows = _top_k(scores, k).tolist()
+
+        fused = {}
+        for rank, row in enumerate(named):
+            fused[row] = 2.0 + 1 / (1 + rank)
+        if self.mode == "keyword" or (self.fast_path and named):
+            for rank, row in enumerate(keyword_rows):
+                fused[row] = 1 / (RRF_K + rank + 1)
+        else:
+            for rank, row in enumerate(keyword_rows):
+                fused[row] = self.keyword_weight / (RRF_K + rank + 1)
+            vector_results = self.vector_store.similarity_search_by_text(text, text_embedder, k)
+            for rank, result in enumerate(vector_results):
+                row = self.keyword_index.rows.get(result.document.id)
+                if row is not None and row not in named:
+                    fused[row] = fused.get(row, 0.0) + 1 / (RRF_K + rank + 1)
+        ranked = sorted(fused.items(), key=lambda item: -item[1])[:k]
+        return [self._result(row, score) for row, score in ranked]
+
+
+def needs_query_embedding(store, query):
+    """
+    Whether local search will embed a query when mapping it to entities through this store.
+
+    Args:
+        store (BaseVectorStore): The context builder's entity text embedding store.
+        query (str): The query.
+
+    Returns:
+        bool: False only for a HybridEntityStore answering the query from keywords alone.
+    """
+    return not (isinstance(store, HybridEntityStore) and store.keyword_only(query))
@@ -0,0 +1,276 @@
+import asyncio
+import os
+import threading
+import weakref
+
+import httpx
+import requests
+from graphrag.query.llm.oai.chat_openai import ChatOpenAI
+from graphrag.query.llm.oai.embedding import OpenAIEmbedding
+from graphrag.query.llm.oai.typing import OpenaiApiType
+from openai import AsyncOpenAI, OpenAI
+from requests.adapters import HTTPAdapter
+from tenacity import Retrying, retry_if_exception_type, stop_after_attempt, wait_exponential_jitter
+
+from caching import CacheStats
+
+# Connections kept per pool; idle ones are closed after KEEPALIVE_SECONDS
+MAX_CONNECTIONS = int(os.getenv("GRAPHRAG_HTTP_MAX_CONNECTIONS", "100"))
+KEEPALIVE_CONNECTIONS = int(os.getenv("GRAPHRAG_HTTP_KEEPALIVE_CONNECTIONS", "20"))
+KEEPALIVE_SECONDS = float(os.getenv("GRAPHRAG_HTTP_KEEPALIVE_SECONDS", "60"))
+# A dead endpoint fails fast; a slow completion still has the full read timeout
+CONNECT_TIMEOUT_SECONDS = float(os.getenv("GRAPHRAG_HTTP_CONNECT_TIMEOUT_SECONDS", "10"))
+REQUEST_TIMEOUT_SECONDS = float(os.getenv("GRAPHRAG_LLM_TIMEOUT_SECONDS", "180"))
+
+
+def http_timeout(read_seconds=REQUEST_TIMEOUT_SECONDS):
+    """
+    Build the timeout of a pooled client.
+
+    Args:
+        read_seconds (float): The time allowed for the response.
+
+    Returns:
+        httpx.Timeout: The read timeout, with CONNECT_TIMEOUT_SECONDS to connect.
+    """
+    return httpx.Timeout(read_seconds, connect=min(CONNECT_TIMEOUT_SECONDS, read_seconds))
+
+
+def _limits():
+    return httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=KEEPALIVE_SECONDS,
+    )
+
+
+class ClientPool:
+    """
+    Shared OpenAI and HTTP clients, each holding a keep-alive connection pool.
+
+    There is one OpenAI client per connection profile (API key, base URL, organization,
+    timeout and SDK retries); the model and sampling parameters are sent per request, so every
+    chat and embedding model of a profile reuses the same connections. Async clients are
+    kept per event loop, because httpx connections belong to the loop that opened them;
+    those of a closed loop are dropped with it.
+    """
+
+    def __init__(self):
+        self._sync = {}
+        self._async = weakref.WeakKeyDictionary()
+        self._http_client = None
+        self._session = None
+        self._lock = threading.Lock()
+        self.stats = CacheStats("created", "reused")
+
+    def _get(self, clients, profile, create):
+        with self._lock:
+            client = clients.get(profile)
+            if client is None:
+                client = clients[profile] = create()
+                self.stats.incr("created")
+            else:
+                self.stats.incr("reused")
+            return client
+
+    def openai(self, api_key, base_url=None, organization=None, timeout=REQUEST_TIMEOUT_SECONDS, max_retries=0):
+        """
+        Return the sync OpenAI client of a profile.
+
+        Args:
+            api_key (str): The API key.
+            base_url (str, optional): The API base URL; None for OpenAI.
+            organization (str, optional): The OpenAI organization.
+            timeout (float): The read timeout in seconds.
+            max_retries (int): The retries of the OpenAI SDK. Left at 0, retries are made by
+                graphrag's own retry loop, which the rate governor sees.
+
+        Returns:
+            OpenAI: The shared client.
+        """
+        profile = (api_key, base_url, organization, timeout, max_retries)
+        return self._get(self._sync, profile, lambda: OpenAI(
+            api_key=api_key, base_url=base_url, organization=organization,
+            timeout=http_timeout(timeout), max_retries=max_retries,
+            http_client=httpx.Client(limits=_limits(), timeout=http_timeout(timeout)),
+        ))
+
+    def async_openai(self, api_key, base_url=None, organization=None, timeout=REQUEST_TIMEOUT_SECONDS,
+                     max_retries=0):
+        """
+        Return the async OpenAI client of a profile for the running event loop.
+
+        Takes the same arguments as `openai`.
+
+        Returns:
+            AsyncOpenAI: The client shared by the calls of this loop.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            clients = self._async.setdefault(loop, {})
+        profile = (api_key, base_url, organization, timeout, max_retries)
+        return self._get(clients, profile, lambda: AsyncOpenAI(
+            api_key=api_key, base_url=base_url, organization=organization,
+            timeout=http_timeout(timeout), max_retries=max_retries,
+            http_client=httpx.AsyncClient(limits=_limits(), timeout=http_timeout(timeout)),
+        ))
+
+    def http_client(self):
+        """
+        Return the shared sync httpx client, for SDKs that accept one.
+
+        Returns:
+            httpx.Client: The client.
+        """
+        with self._lock:
+            if self._http_client is None:
+                self._http_client = httpx.Client(limits=_limits(), timeout=http_timeout())
+            return self._http_client
+
+    def session(self):
+        """
+        Return the shared requests session, for plain HTTP calls.
+
+        Requests does not apply a default timeout; pass `timeout=` on every call.
+
+        Returns:
+            requests.Session: The session.
+        """
+        with self._lock:
+            if self._session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=KEEPALIVE_CONNECTIONS, pool_maxsize=MAX_CONNECTIONS)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._session = session
+            return self._session
+
+    def snapshot(self):
+        """
+        Report how many clients were created and how often one was reused.
+
+        Returns:
+            dict: The pool statistics.
+        """
+        with self._lock:
+            return {
+                **self.stats.snapshot(),
+                "sync_clients": len(self._sync),
+                "event_loops": len(self._async),
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_client_pool():
+    """
+    Return the process-wide client pool, creating it on first use.
+
+    Returns:
+        ClientPool: The shared pool.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ClientPool()
+        return _pool
+
+
+def reset_client_pool():
+    """
+    Start a new, empty process-wide client pool.
+
+    A forked worker calls this first: the connections of the parent's clients must not be
+    used from two processes. Pooled models look their clients up on each call, so they
+    move to the new pool.
+    """
+    global _pool, _pool_lock
+    _pool_lock = threading.Lock()
+    _pool = None
+
+
+class PooledClientsMixin:
+    """
+    Makes a graphrag OpenAI LLM or embedding use the shared clients of the pool.
+
+    Clients are looked up in the pool on every call rather than kept, so a model built
+    before a fork uses the clients of the process it runs in. Only the OpenAI API type is
+    pooled; Azure keeps graphrag's own clients.
+
+    Pooled clients make no SDK-level retries: the model's `max_retries` is left to graphrag's
+    own retry loop, so every attempt goes back through the model (and the rate governor).
+    """
+
+    def _profile(self):
+        return {
+            "api_key": self.api_key,
+            "base_url": self.api_base,
+            "organization": self.organization,
+            "timeout": self.request_timeout,
+            "max_retries": 0,
+        }
+
+    def _pooled(self):
+        return self.api_type == OpenaiApiType.OpenAI
+
+    def _create_openai_client(self):
+        if not self._pooled():
+            return super()._create_openai_client()
+        self.set_clients(sync_client=None, async_client=None)
+
+    @property
+    def sync_client(self):
+        if not self._pooled():
+            return self._sync_client
+        return get_client_pool().openai(**self._profile())
+
+    @property
+    def async_client(self):
+        if not self._pooled():
+            return self._async_client
+        return get_client_pool().async_openai(**self._profile())
+
+
+class PooledChatOpenAI(PooledClientsMixin, ChatOpenAI):
+    """graphrag ChatOpenAI on the shared clients of the pool."""
+
+
+class PooledOpenAIEmbedding(PooledClientsMixin, OpenAIEmbedding):
+    """graphrag OpenAIEmbedding on the shared clients of the pool."""
+
+    def embed_batch(self, texts, **kwargs):
+        """
+        Embed several texts in one API request.
+
+        Texts over `max_tokens` are embedded one by one with `embed`, which splits them into
+        chunks and averages the chunk embeddings.
+
+        Args:
+            texts (list): The texts to embed.
+
+        Returns:
+            list: One embedding vector per text.
+        """
+        embeddings = [None] * len(texts)
+        short = []
+        for index, text in enumerate(texts):
+            if len(self.token_encoder.encode(text)) > self.max_tokens:
+                embeddings[index] = self.embed(text, **kwargs)
+            else:
+                short.append(index)
+        if short:
+            retryer = Retrying(
+                stop=stop_after_attempt(self.max_retries),
+                wait=wait_exponential_jitter(max=10),
+                reraise=True,
+                retry=retry_if_exception_type(self.retry_error_types),
+            )
+            for attempt in retryer:
+                with attempt:
+                    response = self.sync_client.embeddings.create(
+                        input=[texts[index] for index in short], model=self.model, **kwargs)
+            for item in response.data:
+                embeddings[short[item.index]] = item.embedding
+        return embeddings
@@ -0,0 +1,114 @@
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from collections import Counter
+
+import httpx
+
+URL = "http://127.0.0.1:8000"
+CONCURRENCY_LEVELS = [1, 8, 32]
+REQUESTS = 200
+TIMEOUT_SECONDS = 300.0
+
+
+def make_queries(tag, requests, distinct=0):
+    """
+    Build the queries of a load run.
+
+    Args:
+        tag (str): Part of every query, so runs against different endpoints or levels differ.
+        requests (int): The number of queries.
+        distinct (int): Cycle through this many queries, so the caches see repeats; 0 makes
+            every query unique, so none is cached.
+
+    Returns:
+        list: The queries.
+    """
+    count = distinct or requests
+    return [f"Which grants support project number {i % count} ({tag})?" for i in range(requests)]
+
+
+def percentile(sorted_values, share):
+    """Return the nearest-rank percentile of sorted values."""
+    return sorted_values[min(len(sorted_values) - 1, int(share * len(sorted_values)))]
+
+
+async def load(client, path, concurrency, queries, body=None):
+    """
+    Post `queries` to `path`, `concurrency` at a time.
+
+    Args:
+        client (httpx.AsyncClient): The client.
+        path (str): The endpoint.
+        concurrency (int): The number of requests in flight.
+        queries (list): The queries, sent in order.
+        body (dict, optional): Other fields of every request body.
+
+    Returns:
+        dict: Throughput, latency percentiles in milliseconds, and the error count and statuses.
+    """
+    queue = asyncio.Queue()
+    for query in queries:
+        queue.put_nowait(query)
+    latencies, statuses = [], Counter()
+
+    async def worker():
+        while not queue.empty():
+            query = queue.get_nowait()
+            started = time.perf_counter()
+            try:
+                response = await client.post(path, json={**(body or {}), "query": query})
+                status = response.status_code
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - started)
+            statuses[status] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests_per_second": len(queries) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "errors": sum(count for status, count in statuses.items() if status != 200),
+        "statuses": {str(status): count for status, count in statuses.items()},
+    }
+
+
+async def run(url, engines, levels, requests, distinct, semantic_cache):
+    limits = httpx.Limits(max_connections=max(levels), max_keepalive_connections=max(levels))
+    async with httpx.AsyncClient(base_url=url, timeout=TIMEOUT_SECONDS, limits=limits) as client:
+        results = []
+        for engine in engines:
+            for level in levels:
+                path = f"/{engine}_search"
+                queries = make_queries(f"{engine}, {level} concurrent, {time.time():.0f}", requests, distinct)
+                stats = await load(client, path, level, queries, body={"semantic_cache": semantic_cache})
+                results.append({"engine": engine, "concurrency": level, "requests": requests, **stats})
+                print(json.dumps(results[-1]), flush=True)
+        return results
+
+
+def main():
+    """Load-test a running search API at fixed concurrency levels."""
+    parser = argparse.ArgumentParser(
+        description="Drive /local_search and /global_search of a running API at fixed concurrency levels. "
+                    "Start stub_openai.py and point the API at it to test without API quota.")
+    parser.add_argument("--url", default=URL)
+    parser.add_argument("--engines", nargs="+", choices=["local", "global"], default=["local", "global"])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=CONCURRENCY_LEVELS)
+    parser.add_argument("--requests", type=int, default=REQUESTS, help="Requests per engine and level.")
+    parser.add_argument("--distinct", type=int, default=0,
+                        help="Cycle through this many queries to exercise the caches; 0 makes every query unique.")
+    parser.add_argument("--semantic-cache", action="store_true", help="Let the API reuse answers of similar queries.")
+    args = parser.parse_args()
+    asyncio.run(run(args.url, args.engines, args.concurrency, args.requests, args.distinct, args.semantic_cache))
+
+
+if __name__ == "__main__":
+    main()
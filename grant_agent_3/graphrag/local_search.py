@@ -1,7 +1,8 @@
+import hashlib
+import itertools
+import json
 import os
 
-import pandas as pd
-import tiktoken
 from dotenv import load_dotenv
 
 from graphrag.query.context_builder.entity_extraction import EntityVectorStoreKey
@@ -12,18 +13,34 @@ from graphrag.query.indexer_adapters import (
     read_indexer_text_units,
 )
 from graphrag.query.input.loaders.dfs import store_entity_semantic_embeddings
-from graphrag.query.llm.oai.chat_openai import ChatOpenAI
-from graphrag.query.llm.oai.embedding import OpenAIEmbedding
 from graphrag.query.llm.oai.typing import OpenaiApiType
-from graphrag.query.structured_search.local_search.mixed_context import LocalSearchMixedContext
 from graphrag.query.structured_search.local_search.search import LocalSearch
 from graphrag.vector_stores.lancedb import LanceDBVectorStore
 
+from artifact_store import get_store
+from context_builders import IndexedLocalContext, OffLoopSearchMixin
+from embedding_cache import CachedTextEmbedding
+from engine_registry import registry
+from file_utils import atomic_write, file_lock
+from keyword_index import EntityKeywordIndex, HybridEntityStore, needs_query_embedding
+from llm_clients import PooledOpenAIEmbedding
+from metrics import stage
+from numpy_vector_store import NumpyVectorStore
+from rate_governor import GovernedChatOpenAI
+from response_cache import acached_search, cached_search
+from streaming import StreamingCallback
+from token_counts import (
+    entity_rows,
+    get_counting_encoder,
+    relationship_rows,
+    report_rows,
+    text_unit_rows,
+)
+
 # Load environment variables
 load_dotenv()
 
 # Constants and configurations
-INPUT_DIR = "/mnt/c/Users/rishu/OneDrive/Desktop/Rishub/AiHCCC/agents-grant/grant_agent_2/graphrag/ragtest/output/20240704-184122/artifacts"
 LANCEDB_URI = "/mnt/c/Users/rishu/OneDrive/Desktop/Rishub/AiHCCC/agents-grant/grant_agent_2/graphrag/lancedb"
 COMMUNITY_REPORT_TABLE = "create_final_community_reports"
 ENTITY_TABLE = "create_final_nodes"
@@ -31,6 +48,24 @@ ENTITY_EMBEDDING_TABLE = "create_final_entities"
 RELATIONSHIP_TABLE = "create_final_relationships"
 TEXT_UNIT_TABLE = "create_final_text_units"
 COMMUNITY_LEVEL = 2
+# Entity description vector index backend: "lancedb" or "numpy" (in-process matrix)
+VECTOR_STORE = os.getenv("GRAPHRAG_VECTOR_STORE", "lancedb")
+# How queries are mapped to entities: "vector" (description embeddings only), "hybrid" (fused with
+# BM25 over titles and text units) or "keyword" (BM25 only, never embedding the query)
+RETRIEVAL = os.getenv("GRAPHRAG_LOCAL_RETRIEVAL", "vector")
+
+# Only the columns read_indexer_* actually consumes are decoded from each table
+ENTITY_COLUMNS = ["level", "title", "degree", "community"]
+ENTITY_EMBEDDING_COLUMNS = [
+    "id", "name", "type", "description", "human_readable_id", "text_unit_ids",
+    "description_embedding",
+]
+RELATIONSHIP_COLUMNS = [
+    "id", "human_readable_id", "source", "target", "description", "weight",
+    "text_unit_ids", "rank",
+]
+COMMUNITY_REPORT_COLUMNS = ["community", "level", "title", "summary", "full_content", "rank"]
+TEXT_UNIT_COLUMNS = ["id", "text", "n_tokens", "document_ids", "entity_ids", "relationship_ids"]
 
 API_KEY = os.environ["GRAPHRAG_API_KEY"]
 LLM_MODEL = os.environ["GRAPHRAG_LLM_MODEL"]
@@ -57,72 +92,197 @@ LLM_PARAMS = {
 }
 
 
-def setup_entities():
+class TimedLanceDBVectorStore(LanceDBVectorStore):
+    """LanceDBVectorStore whose searches are timed as the vector_lookup stage."""
+
+    def similarity_search_by_vector(self, query_embedding, k=10, **kwargs):
+        with stage("vector_lookup"):
+            return super().similarity_search_by_vector(query_embedding, k, **kwargs)
+
+
+class OffLoopLocalSearch(OffLoopSearchMixin, LocalSearch):
+    """LocalSearch that builds the query context in a worker thread instead of on the event loop."""
+
+    def _context_kwargs(self, query, conversation_history, kwargs):
+        return {
+            "query": query,
+            "conversation_history": conversation_history,
+            **kwargs,
+            **self.context_builder_params,
+        }
+
+
+def setup_entities(input_dir):
     """
-    Load and read entity data and their embeddings from parquet files.
+    Load and read entity data and their embeddings from the shared artifact store.
+
+    Args:
+        input_dir (str): The directory containing the input parquet files.
 
     Returns:
         DataFrame: A DataFrame containing the entities and their embeddings.
     """
-    entity_df = pd.read_parquet(f"{INPUT_DIR}/{ENTITY_TABLE}.parquet")
-    entity_embedding_df = pd.read_parquet(
-        f"{INPUT_DIR}/{ENTITY_EMBEDDING_TABLE}.parquet")
+    store = get_store(input_dir)
+    entity_df = store.frame(ENTITY_TABLE, ENTITY_COLUMNS)
+    entity_embedding_df = store.frame(ENTITY_EMBEDDING_TABLE, ENTITY_EMBEDDING_COLUMNS)
     return read_indexer_entities(entity_df, entity_embedding_df, COMMUNITY_LEVEL), entity_df
 
 
-def setup_description_embedding_store(entities):
+def entity_embedding_version(input_dir):
+    """
+    Identify the entity embeddings of an index run.
+
+    The version changes whenever the node or entity tables change, or the community
+    level used to select entities does.
+
+    Args:
+        input_dir (str): The directory containing the input parquet files.
+
+    Returns:
+        str: A short hex digest identifying the embedding content.
+    """
+    store = get_store(input_dir)
+    digest = hashlib.sha256()
+    digest.update(store.fingerprint(ENTITY_TABLE).encode())
+    digest.update(store.fingerprint(ENTITY_EMBEDDING_TABLE).encode())
+    digest.update(str(COMMUNITY_LEVEL).encode())
+    return digest.hexdigest()[:16]
+
+
+def setup_description_embedding_store(entities, input_dir):
+    """
+    Set up the description embedding store with the backend selected by VECTOR_STORE.
+
+    Args:
+        entities (DataFrame): A DataFrame containing the entities and their embeddings.
+        input_dir (str): The directory containing the input parquet files.
+
+    Returns:
+        BaseVectorStore: The vector store holding the entity description embeddings.
+    """
+    if VECTOR_STORE == "numpy":
+        return setup_numpy_embedding_store(entities)
+    if VECTOR_STORE != "lancedb":
+        raise ValueError(f"Unknown GRAPHRAG_VECTOR_STORE: {VECTOR_STORE}")
+    return setup_lancedb_embedding_store(entities, input_dir)
+
+
+def setup_numpy_embedding_store(entities):
+    """
+    Build an in-process NumPy index over the entity description embeddings.
+
+    Args:
+        entities (DataFrame): A DataFrame containing the entities and their embeddings.
+
+    Returns:
+        NumpyVectorStore: The index, holding one pre-normalized float32 matrix.
+    """
+    entities = [entity for entity in entities if entity.description_embedding]
+    description_embedding_store = NumpyVectorStore(collection_name="entity_description_embeddings")
+    description_embedding_store.load_vectors(
+        ids=[entity.id for entity in entities],
+        vectors=[entity.description_embedding for entity in entities],
+        texts=[entity.description for entity in entities],
+        attributes=[{"title": entity.title, **(entity.attributes or {})} for entity in entities],
+    )
+    return description_embedding_store
+
+
+def setup_lancedb_embedding_store(entities, input_dir):
     """
-    Set up the description embedding store and store entity semantic embeddings.
+    Set up the LanceDB description embedding store, ingesting entity semantic embeddings only when they changed.
+
+    The LanceDB table is named after the embedding version and a marker file is written once
+    ingestion completes. A later boot with the same artifacts opens the existing table instead
+    of rewriting it, and a file lock stops concurrent workers from ingesting it twice.
 
     Args:
         entities (DataFrame): A DataFrame containing the entities and their embeddings.
+        input_dir (str): The directory containing the input parquet files.
 
     Returns:
-        LanceDBVectorStore: An instance of LanceDBVectorStore connected to the description embeddings.
+        TimedLanceDBVectorStore: An instance of LanceDBVectorStore connected to the description embeddings.
     """
-    description_embedding_store = LanceDBVectorStore(
-        collection_name="entity_description_embeddings")
+    version = entity_embedding_version(input_dir)
+    collection_name = f"entity_description_embeddings_{version}"
+    marker_path = os.path.join(LANCEDB_URI, f"{collection_name}.version.json")
+    description_embedding_store = TimedLanceDBVectorStore(collection_name=collection_name)
     description_embedding_store.connect(db_uri=LANCEDB_URI)
-    store_entity_semantic_embeddings(
-        entities=entities, vectorstore=description_embedding_store)
+    with file_lock(os.path.join(LANCEDB_URI, f".{collection_name}.lock")):
+        if os.path.exists(marker_path) and collection_name in description_embedding_store.db_connection.table_names():
+            description_embedding_store.document_collection = \
+                description_embedding_store.db_connection.open_table(collection_name)
+        else:
+            store_entity_semantic_embeddings(
+                entities=entities, vectorstore=description_embedding_store)
+            atomic_write(marker_path, json.dumps({
+                "version": version,
+                "input_dir": input_dir,
+                "entities": len(entities),
+            }))
     return description_embedding_store
 
 
-def setup_relationships():
+def setup_entity_retrieval(description_embedding_store, entities, text_units):
     """
-    Load and read relationship data from parquet files.
+    Put the keyword index in front of the description embedding store when RETRIEVAL asks for it.
+
+    Args:
+        description_embedding_store (BaseVectorStore): The entity description embedding store.
+        entities (list): The entities local search maps queries to.
+        text_units (list): The text units of the index run.
+
+    Returns:
+        BaseVectorStore: The store itself for "vector" retrieval, otherwise a HybridEntityStore wrapping it.
+    """
+    if RETRIEVAL == "vector":
+        return description_embedding_store
+    if RETRIEVAL not in ("hybrid", "keyword"):
+        raise ValueError(f"Unknown GRAPHRAG_LOCAL_RETRIEVAL: {RETRIEVAL}")
+    return HybridEntityStore(
+        description_embedding_store, EntityKeywordIndex(entities, text_units), mode=RETRIEVAL)
+
+
+def setup_relationships(input_dir):
+    """
+    Load and read relationship data from the shared artifact store.
+
+    Args:
+        input_dir (str): The directory containing the input parquet files.
 
     Returns:
         DataFrame: A DataFrame containing the relationships.
     """
-    relationship_df = pd.read_parquet(
-        f"{INPUT_DIR}/{RELATIONSHIP_TABLE}.parquet")
+    relationship_df = get_store(input_dir).frame(RELATIONSHIP_TABLE, RELATIONSHIP_COLUMNS)
     return read_indexer_relationships(relationship_df)
 
 
-def setup_reports(entity_df):
+def setup_reports(entity_df, input_dir):
     """
-    Load and read report data from parquet files.
+    Load and read report data from the shared artifact store.
 
     Args:
         entity_df (DataFrame): A DataFrame containing the entities.
+        input_dir (str): The directory containing the input parquet files.
 
     Returns:
         DataFrame: A DataFrame containing the reports.
     """
-    report_df = pd.read_parquet(
-        f"{INPUT_DIR}/{COMMUNITY_REPORT_TABLE}.parquet")
+    report_df = get_store(input_dir).frame(COMMUNITY_REPORT_TABLE, COMMUNITY_REPORT_COLUMNS)
     return read_indexer_reports(report_df, entity_df, COMMUNITY_LEVEL)
 
 
-def setup_text_units():
+def setup_text_units(input_dir):
     """
-    Load and read text unit data from parquet files.
+    Load and read text unit data from the shared artifact store.
+
+    Args:
+        input_dir (str): The directory containing the input parquet files.
 
     Returns:
         DataFrame: A DataFrame containing the text units.
     """
-    text_unit_df = pd.read_parquet(f"{INPUT_DIR}/{TEXT_UNIT_TABLE}.parquet")
+    text_unit_df = get_store(input_dir).frame(TEXT_UNIT_TABLE, TEXT_UNIT_COLUMNS)
     return read_indexer_text_units(text_unit_df)
 
 
@@ -131,9 +291,10 @@ def setup_llm():
     Set up the language model (LLM) using the OpenAI API.
 
     Returns:
-        ChatOpenAI: An instance of ChatOpenAI configured with the specified parameters.
+        GovernedChatOpenAI: A ChatOpenAI configured with the specified parameters, whose calls go
+            through the process-wide rate governor.
     """
-    return ChatOpenAI(
+    return GovernedChatOpenAI(
         api_key=API_KEY,
         model=LLM_MODEL,
         api_type=OpenaiApiType.OpenAI,
@@ -143,75 +304,163 @@ def setup_llm():
 
 def setup_text_embedder():
     """
-    Set up the text embedder using the OpenAI API.
+    Set up the text embedder using the OpenAI API, behind the process-wide query embedding cache.
 
     Returns:
-        OpenAIEmbedding: An instance of OpenAIEmbedding configured with the specified parameters.
+        CachedTextEmbedding: An OpenAIEmbedding on the pooled clients, configured with the specified
+            parameters, wrapped in the cache.
     """
-    return OpenAIEmbedding(
-        api_key=API_KEY,
-        api_base=None,
-        api_type=OpenaiApiType.OpenAI,
+    return CachedTextEmbedding(
+        PooledOpenAIEmbedding(
+            api_key=API_KEY,
+            api_base=None,
+            api_type=OpenaiApiType.OpenAI,
+            model=EMBEDDING_MODEL,
+            deployment_name=EMBEDDING_MODEL,
+            max_retries=20,
+        ),
         model=EMBEDDING_MODEL,
-        deployment_name=EMBEDDING_MODEL,
-        max_retries=20,
     )
 
 
-def setup_search_engine():
+def setup_search_engine(input_dir):
     """
     Set up the search engine by initializing all necessary components.
 
+    Args:
+        input_dir (str): The artifacts directory of the index run to serve.
+
     Returns:
-        LocalSearch: An instance of LocalSearch configured with the specified parameters.
+        OffLoopLocalSearch: A LocalSearch configured with the specified parameters.
     """
-    entities, entity_df = setup_entities()
-    description_embedding_store = setup_description_embedding_store(entities)
-    relationships = setup_relationships()
-    reports = setup_reports(entity_df)
-    text_units = setup_text_units()
+    entities, entity_df = setup_entities(input_dir)
+    description_embedding_store = setup_description_embedding_store(entities, input_dir)
+    relationships = setup_relationships(input_dir)
+    reports = setup_reports(entity_df, input_dir)
+    text_units = setup_text_units(input_dir)
+    entity_retrieval = setup_entity_retrieval(description_embedding_store, entities, text_units)
     llm = setup_llm()
-    token_encoder = tiktoken.get_encoding("cl100k_base")
     text_embedder = setup_text_embedder()
 
-    context_builder_local = LocalSearchMixedContext(
+    # Count the tokens of every row once, so packing the context is arithmetic
+    token_encoder = get_counting_encoder(input_dir)
+    token_encoder.counter.precompute(itertools.chain(
+        entity_rows(entities),
+        relationship_rows(relationships),
+        text_unit_rows(text_units),
+        report_rows(reports),
+    ))
+
+    context_builder_local = IndexedLocalContext(
         community_reports=reports,
         text_units=text_units,
         entities=entities,
         relationships=relationships,
-        entity_text_embeddings=description_embedding_store,
+        entity_text_embeddings=entity_retrieval,
         embedding_vectorstore_key=EntityVectorStoreKey.ID,
         text_embedder=text_embedder,
         token_encoder=token_encoder,
     )
 
-    return LocalSearch(
+    search_engine = OffLoopLocalSearch(
         llm=llm,
         context_builder=context_builder_local,
         token_encoder=token_encoder,
         llm_params=LLM_PARAMS,
         context_builder_params=LOCAL_CONTEXT_PARAMS,
         response_type="multiple paragraphs",
+        callbacks=[StreamingCallback()],
     )
+    if entity_retrieval is not description_embedding_store:
+        # Read by the response cache fingerprint, so answers mapped to entities another way are not reused
+        search_engine.entity_retrieval = entity_retrieval
+    return search_engine
+
 
+registry.register("local", setup_search_engine)
 
-search_engine = setup_search_engine()
+
+def _local_response(result):
+    """Turn a SearchResult into the response dictionary of run_query_local."""
+    return {
+        "response": result.response,
+        "llm_calls": result.llm_calls,
+        "prompt_tokens": result.prompt_tokens,
+        "context_data": result.context_data["reports"],
+    }
 
 
-def ask_query_local(query):
+def run_query_local(search_engine, query):
     """
-    Perform a local search query using the search engine.
+    Run a local search query against one search engine.
 
     Args:
+        search_engine (LocalSearch): The search engine.
         query (str): The search query.
 
     Returns:
         dict: A dictionary containing the search response, LLM calls, prompt tokens, and context data.
     """
-    result = search_engine.search(query)
-    return {
-        "response": result.response,
-        "llm_calls": result.llm_calls,
-        "prompt_tokens": result.prompt_tokens,
-        "context_data": result.context_data["reports"],
-    }
+    return _local_response(search_engine.search(query))
+
+
+async def arun_query_local(search_engine, query):
+    """
+    Run a local search query on the running event loop.
+
+    graphrag embeds the query synchronously while building the context, so it is embedded
+    asynchronously first; the context builder then finds it in the embedding cache. Queries
+    the keyword index maps to entities on its own are not embedded at all.
+
+    Args:
+        search_engine (LocalSearch): The search engine.
+        query (str): The search query.
+
+    Returns:
+        dict: The same dictionary as run_query_local.
+    """
+    context_builder = search_engine.context_builder
+    if query and needs_query_embedding(context_builder.entity_text_embeddings, query):
+        await context_builder.text_embedder.aembed(query)
+    return _local_response(await search_engine.asearch(query))
+
+
+def ask_query_local(query, wait=True, use_cache=True, use_semantic_cache=True):
+    """
+    Perform a local search query using the search engine, answering repeats from the response caches.
+
+    Args:
+        query (str): The search query.
+        wait (bool): Block until the engine has loaded instead of raising EngineNotReadyError.
+        use_cache (bool): Look the query up in the exact-match response cache first.
+        use_semantic_cache (bool): Serve the answer to a near-identical earlier query when there is one.
+
+    Returns:
+        dict: A dictionary containing the search response, LLM calls, prompt tokens, and context data.
+    """
+    with registry.lease_version("local", wait=wait) as version:
+        return cached_search(
+            "local", version, query, run_query_local,
+            use_cache=use_cache, use_semantic_cache=use_semantic_cache)
+
+
+async def aask_query_local(query, use_cache=True, use_semantic_cache=True, limit=None):
+    """
+    Async ask_query_local for event loop callers; it never waits for the engine to load.
+
+    Args:
+        query (str): The search query.
+        use_cache (bool): Look the query up in the exact-match response cache first.
+        use_semantic_cache (bool): Serve the answer to a near-identical earlier query when there is one.
+        limit (asyncio.Semaphore, optional): Bounds the searches running at once; cache hits skip it.
+
+    Returns:
+        dict: A dictionary containing the search response, LLM calls, prompt tokens, and context data.
+
+    Raises:
+        EngineNotReadyError: If the engine has not finished loading.
+    """
+    with registry.lease_version("local", wait=False) as version:
+        return await acached_search(
+            "local", version, query, arun_query_local,
+            use_cache=use_cache, use_semantic_cache=use_semantic_cache, limit=limit)
@@ -0,0 +1,196 @@
+import contextvars
+import hashlib
+import json
+import os
+import threading
+import time
+
+from graphrag.query.structured_search.base import SearchResult
+from graphrag.query.structured_search.global_search.search import GlobalSearch
+
+from caching import CACHE_DIR, CacheStats, DiskCache, LRUCache
+from context_builders import OffLoopSearchMixin, batch_id
+from embedding_cache import normalize_text
+from metrics import stage
+from rate_governor import BATCH, llm_priority
+from streaming import map_batch_done
+
+ENABLED = os.getenv("GRAPHRAG_MAP_CACHE", "1") == "1"
+MEMORY_ENTRIES = int(os.getenv("GRAPHRAG_MAP_CACHE_MEMORY_ENTRIES", "20000"))
+# Keys hash the batch content, so entries stay valid across restarts and index runs; 0 keeps them in memory only
+DISK_ENTRIES = int(os.getenv("GRAPHRAG_MAP_CACHE_DISK_ENTRIES", "100000"))
+DISK_PATH = os.getenv(
+    "GRAPHRAG_MAP_CACHE_PATH", os.path.join(CACHE_DIR, "map_responses.sqlite"))
+
+# The map phase counters of the query running in the current task
+_query_stats = contextvars.ContextVar("map_cache_query_stats", default=None)
+
+
+class MapCache:
+    """
+    Cache of global search map-phase outputs: the key points the LLM extracted from one batch.
+
+    Keys hash the batch text, the normalized query, the map prompt, the map LLM parameters
+    and the model, so an entry can only be served for the exact same map call. Entries live
+    in a memory LRU, optionally backed by a SQLite file.
+    """
+
+    def __init__(self, memory_entries=MEMORY_ENTRIES, disk_path=DISK_PATH, disk_entries=DISK_ENTRIES):
+        self.memory = LRUCache(memory_entries)
+        self.disk = DiskCache(disk_path, disk_entries) if disk_path and disk_entries > 0 else None
+        self.stats = CacheStats("hits", "misses")
+
+    @staticmethod
+    def key(batch, query, map_prompt, llm_params, model):
+        """
+        Build the cache key of one map call.
+
+        Args:
+            batch (str): The id of the report batch.
+            query (str): The search query.
+            map_prompt (str): The map system prompt template.
+            llm_params (dict): The map LLM parameters.
+            model (str): The LLM model name.
+
+        Returns:
+            str: The cache key.
+        """
+        params = json.dumps(llm_params, sort_keys=True, default=str)
+        prompt = hashlib.sha256(map_prompt.encode()).hexdigest()
+        return hashlib.sha256(
+            f"{model}\0{params}\0{prompt}\0{batch}\0{normalize_text(query)}".encode()).hexdigest()
+
+    def get(self, key):
+        """
+        Look up a map output.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            dict: The key points ("response") and prompt size ("prompt_tokens"), or None on a miss.
+        """
+        blob = self.memory.get(key)
+        if blob is None and self.disk is not None:
+            blob = self.disk.get(key)
+            if blob is not None:
+                self.memory.put(key, blob)
+        if blob is None:
+            self.stats.incr("misses")
+            return None
+        self.stats.incr("hits")
+        return json.loads(blob)
+
+    def put(self, key, response, prompt_tokens):
+        """
+        Store a map output in memory and, when enabled, on disk.
+
+        Args:
+            key (str): The cache key.
+            response (list): The key points parsed from the map response.
+            prompt_tokens (int): The size of the map prompt.
+        """
+        blob = json.dumps({"response": response, "prompt_tokens": prompt_tokens}).encode()
+        self.memory.put(key, blob)
+        if self.disk is not None:
+            self.disk.put(key, blob)
+
+    def snapshot(self):
+        """
+        Report the hit rate and the memory tier size.
+
+        Returns:
+            dict: The cache statistics.
+        """
+        counts = self.stats.snapshot()
+        lookups = counts["hits"] + counts["misses"]
+        return {
+            **counts,
+            "hit_rate": counts["hits"] / lookups if lookups else 0.0,
+            "memory_entries": len(self.memory),
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_map_cache():
+    """
+    Return the process-wide map cache, creating it on first use.
+
+    Returns:
+        MapCache: The shared cache.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = MapCache()
+        return _cache
+
+
+class CachingGlobalSearch(OffLoopSearchMixin, GlobalSearch):
+    """
+    GlobalSearch that answers map calls from the map cache, building its context off the event loop.
+
+    A repeated query, or one whose batches were partly seen with the same query before,
+    only pays for the map calls that missed and for the reduce call. The result carries
+    `map_calls_saved`, the number of batches answered from the cache, and
+    `map_prompt_tokens_saved`, the prompt tokens those calls would have sent.
+    """
+
+    async def asearch(self, query, conversation_history=None, **kwargs):
+        """Run the search, counting the map calls served from the cache."""
+        stats = {"map_calls_saved": 0, "map_prompt_tokens_saved": 0}
+        token = _query_stats.set(stats)
+        try:
+            result = await super().asearch(query, conversation_history, **kwargs)
+        finally:
+            _query_stats.reset(token)
+        result.map_calls_saved = stats["map_calls_saved"]
+        result.map_prompt_tokens_saved = stats["map_prompt_tokens_saved"]
+        return result
+
+    def _context_kwargs(self, query, conversation_history, kwargs):
+        return {"conversation_history": conversation_history, **self.context_builder_params}
+
+    async def _map_response_single_batch(self, context_data, query, **llm_kwargs):
+        """Serve a map call from the cache, or make it and cache its key points, at batch LLM priority."""
+        with llm_priority(BATCH), stage("map"):
+            result = await self._cached_map_response(context_data, query, **llm_kwargs)
+        map_batch_done()
+        return result
+
+    async def _reduce_response(self, map_responses, query, **llm_kwargs):
+        """Combine the map answers as GlobalSearch does, timed as the reduce stage."""
+        with stage("reduce"):
+            return await super()._reduce_response(map_responses, query, **llm_kwargs)
+
+    async def _cached_map_response(self, context_data, query, **llm_kwargs):
+        if not ENABLED:
+            return await super()._map_response_single_batch(context_data=context_data, query=query, **llm_kwargs)
+
+        cache = get_map_cache()
+        key = cache.key(
+            batch_id(context_data), query, self.map_system_prompt, llm_kwargs, getattr(self.llm, "model", None))
+        start_time = time.time()
+        cached = cache.get(key)
+        if cached is not None:
+            stats = _query_stats.get()
+            if stats is not None:
+                stats["map_calls_saved"] += 1
+                stats["map_prompt_tokens_saved"] += cached["prompt_tokens"]
+            return SearchResult(
+                response=cached["response"],
+                context_data=context_data,
+                context_text=context_data,
+                completion_time=time.time() - start_time,
+                llm_calls=0,
+                prompt_tokens=0,
+            )
+
+        result = await super()._map_response_single_batch(context_data=context_data, query=query, **llm_kwargs)
+        # graphrag returns an empty answer when the call fails and no points when the JSON is unusable
+        if result.response and result.response != [{"answer": "", "score": 0}]:
+            cache.put(key, result.response, result.prompt_tokens)
+        return result
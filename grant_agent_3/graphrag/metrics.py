@@ -0,0 +1,234 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds of the latency buckets, in seconds
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+TOKEN_BUCKETS = (500, 1_000, 2_000, 4_000, 8_000, 16_000, 32_000, 64_000, 128_000, 256_000)
+
+# The trace of the search request handled by the current task or thread
+_current_trace = contextvars.ContextVar("request_trace", default=None)
+
+
+def _labels(names, values):
+    return ",".join(f'{name}="{value}"' for name, value in zip(names, values))
+
+
+def _number(value):
+    return repr(float(value)) if value != float("inf") else "+Inf"
+
+
+class Histogram:
+    """A Prometheus histogram with labels; thread-safe."""
+
+    def __init__(self, name, help_text, label_names, buckets=SECONDS_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        """
+        Record one observation.
+
+        Args:
+            value (float): The observed value.
+            *label_values (str): One value per label name.
+        """
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        """Return the histogram in the Prometheus text format."""
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {labels: (list(counts), total) for labels, (counts, total) in self._series.items()}
+        for label_values, (counts, total) in sorted(series.items()):
+            labels = _labels(self.label_names, label_values)
+            prefix = f"{labels}," if labels else ""
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{_number(bound)}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{labels}}} {total}")
+            lines.append(f"{self.name}_count{{{labels}}} {cumulative}")
+        return "\n".join(lines)
+
+
+class Counter:
+    """A Prometheus counter with labels; thread-safe."""
+
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def incr(self, amount=1, *label_values):
+        """
+        Add to the counter.
+
+        Args:
+            amount (float): The increment.
+            *label_values (str): One value per label name.
+        """
+        with self._lock:
+            self._series[label_values] = self._series.get(label_values, 0) + amount
+
+    def render(self):
+        """Return the counter in the Prometheus text format."""
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            series = dict(self._series)
+        for label_values, value in sorted(series.items()):
+            lines.append(f"{self.name}{{{_labels(self.label_names, label_values)}}} {value}")
+        return "\n".join(lines)
+
+
+stage_seconds = Histogram(
+    "graphrag_stage_seconds", "Time spent in one stage of a search request; map is observed per batch.",
+    ["engine", "stage"])
+request_seconds = Histogram(
+    "graphrag_request_seconds", "Time to answer a search request, by how it was answered.", ["engine", "outcome"])
+request_prompt_tokens = Histogram(
+    "graphrag_request_prompt_tokens", "Prompt tokens sent to the LLM per searched request.", ["engine"],
+    buckets=TOKEN_BUCKETS)
+requests_total = Counter("graphrag_requests_total", "Search requests, by how they were answered.",
+                         ["engine", "outcome"])
+prompt_tokens_total = Counter("graphrag_prompt_tokens_total", "Prompt tokens sent to the LLM.", ["engine"])
+llm_calls_total = Counter("graphrag_llm_calls_total", "LLM calls made by searches.", ["engine"])
+
+METRICS = [stage_seconds, request_seconds, request_prompt_tokens, requests_total, prompt_tokens_total, llm_calls_total]
+
+
+class RequestTrace:
+    """
+    The stage timings of one search request.
+
+    Stages may repeat (map runs once per batch) and overlap (the vector lookup is part of the
+    context build); each keeps the summed seconds, the number of calls and the wall time from
+    its first start to its last end.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.started = time.perf_counter()
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, started, ended):
+        """
+        Record one run of a stage, and observe it in the stage histogram.
+
+        Args:
+            name (str): The stage name.
+            started (float): The perf_counter value at the start.
+            ended (float): The perf_counter value at the end.
+        """
+        stage_seconds.observe(ended - started, self.engine, name)
+        with self._lock:
+            stage = self._stages.get(name)
+            if stage is None:
+                self._stages[name] = [ended - started, 1, started, ended]
+            else:
+                stage[0] += ended - started
+                stage[1] += 1
+                stage[2] = min(stage[2], started)
+                stage[3] = max(stage[3], ended)
+
+    def timings(self):
+        """
+        Return the timings block of the response.
+
+        Returns:
+            dict: Per stage, the seconds, calls and wall seconds; and the total seconds so far.
+        """
+        with self._lock:
+            stages = {
+                name: {"seconds": seconds, "calls": calls, "wall_seconds": last - first}
+                for name, (seconds, calls, first, last) in self._stages.items()
+            }
+        return {"stages": stages, "total_seconds": time.perf_counter() - self.started}
+
+
+@contextmanager
+def trace_request(engine):
+    """
+    Trace the stages of the search request run inside the block.
+
+    Args:
+        engine (str): "local" or "global".
+
+    Yields:
+        RequestTrace: The trace; tasks started inside the block record into it too.
+    """
+    trace = RequestTrace(engine)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+@contextmanager
+def stage(name):
+    """
+    Time the block as a stage of the current request; does nothing outside a traced request.
+
+    Args:
+        name (str): The stage name.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.record(name, started, time.perf_counter())
+
+
+def observe_request(trace, response, outcome=None):
+    """
+    Record a finished search request: its latency, how it was answered, and its LLM usage.
+
+    Args:
+        trace (RequestTrace): The trace of the request.
+        response (dict): The search response, or None when it failed.
+        outcome (str, optional): Overrides the outcome read from the response.
+
+    Returns:
+        str: The outcome: "search", "exact" or "semantic" (cache hits), "coalesced" or "error".
+    """
+    if outcome is None:
+        outcome = response.get("cached") or ("coalesced" if response.get("coalesced") else "search")
+    elapsed = time.perf_counter() - trace.started
+    request_seconds.observe(elapsed, trace.engine, outcome)
+    requests_total.incr(1, trace.engine, outcome)
+    if outcome == "search":
+        # cached and coalesced answers repeat the usage of the search that produced them
+        prompt_tokens_total.incr(response.get("prompt_tokens", 0), trace.engine)
+        llm_calls_total.incr(response.get("llm_calls", 0), trace.engine)
+        request_prompt_tokens.observe(response.get("prompt_tokens", 0), trace.engine)
+    return outcome
+
+
+def render():
+    """
+    Return every metric in the Prometheus text exposition format.
+
+    Returns:
+        str: The exposition.
+    """
+    return "\n".join(metric.render() for metric in METRICS) + "\n"
@@ -0,0 +1,174 @@
+import numpy as np
+from graphrag.vector_stores.base import (
+    BaseVectorStore,
+    VectorStoreDocument,
+    VectorStoreSearchResult,
+)
+
+from metrics import stage
+
+
+class NumpyVectorStore(BaseVectorStore):
+    """
+    In-process exact vector index over one contiguous, pre-normalized float32 matrix.
+
+    A top-k query is a single matrix-vector product followed by argpartition, which for
+    corpora of up to a few hundred thousand entities is cheaper than a LanceDB round trip.
+    Scores are cosine similarities.
+    """
+
+    def __init__(self, collection_name, **kwargs):
+        super().__init__(collection_name=collection_name, **kwargs)
+        self.ids = []
+        self.texts = []
+        self.attributes = []
+        self.matrix = np.zeros((0, 0), dtype=np.float32)
+        self._rows = None
+
+    def connect(self, **kwargs):
+        """Nothing to connect to; the index lives in process memory."""
+
+    def load_documents(self, documents, overwrite=True):
+        """
+        Load documents into the index.
+
+        Args:
+            documents (list): VectorStoreDocument instances; those without a vector are skipped.
+            overwrite (bool): Replace the current contents instead of appending to them.
+        """
+        documents = [document for document in documents if document.vector is not None]
+        self.load_vectors(
+            ids=[document.id for document in documents],
+            vectors=[document.vector for document in documents],
+            texts=[document.text for document in documents],
+            attributes=[document.attributes for document in documents],
+            overwrite=overwrite,
+        )
+
+    def load_vectors(self, ids, vectors, texts=None, attributes=None, overwrite=True):
+        """
+        Load raw vectors into the index, normalizing them to unit length.
+
+        Args:
+            ids (list): The document ids, one per vector.
+            vectors (array-like): The vectors, shape (n, dim).
+            texts (list, optional): The document texts.
+            attributes (list, optional): The document attribute dicts.
+            overwrite (bool): Replace the current contents instead of appending to them.
+        """
+        matrix = np.array(vectors, dtype=np.float32, order="C")
+        if matrix.size == 0:
+            matrix = matrix.reshape(0, self.matrix.shape[1] if self.matrix.size else 0)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        matrix /= norms
+        texts = list(texts) if texts is not None else [None] * len(ids)
+        attributes = list(attributes) if attributes is not None else [{}] * len(ids)
+        if overwrite or self.matrix.size == 0:
+            self.ids, self.texts, self.attributes = list(ids), texts, attributes
+            self.matrix = matrix
+        else:
+            self.ids += list(ids)
+            self.texts += texts
+            self.attributes += attributes
+            self.matrix = np.ascontiguousarray(np.vstack([self.matrix, matrix]))
+        self._rows = None
+        self.query_filter = None
+
+    def filter_by_id(self, include_ids):
+        """
+        Restrict later searches to the given document ids.
+
+        Args:
+            include_ids (list): The ids to keep. An empty list removes the filter.
+
+        Returns:
+            list: The active id filter, or None.
+        """
+        if len(include_ids) == 0:
+            self.query_filter = None
+            self._rows = None
+        else:
+            wanted = set(include_ids)
+            self.query_filter = list(include_ids)
+            self._rows = np.array(
+                [row for row, doc_id in enumerate(self.ids) if doc_id in wanted], dtype=np.int64)
+        return self.query_filter
+
+    def _top_k(self, scores, k):
+        """Return the row indices of the k highest scores, best first."""
+        k = min(k, scores.shape[-1])
+        if k <= 0:
+            return np.empty(0, dtype=np.int64)
+        top = np.argpartition(-scores, k - 1)[:k]
+        return top[np.argsort(-scores[top], kind="stable")]
+
+    def _result(self, row, score):
+        return VectorStoreSearchResult(
+            document=VectorStoreDocument(
+                id=self.ids[row],
+                text=self.texts[row],
+                vector=None,
+                attributes=self.attributes[row],
+            ),
+            score=float(score),
+        )
+
+    def similarity_search_by_vectors(self, query_embeddings, k=10, **kwargs):
+        """
+        Run several top-k searches with one matrix-matrix product.
+
+        Args:
+            query_embeddings (array-like): The query vectors, shape (q, dim).
+            k (int): The number of results per query.
+
+        Returns:
+            list: One list of VectorStoreSearchResult per query, best match first.
+        """
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        if queries.ndim == 1:
+            queries = queries[None, :]
+        if len(self.ids) == 0 or queries.shape[0] == 0:
+            return [[] for _ in range(queries.shape[0])]
+        with stage("vector_lookup"):
+            norms = np.linalg.norm(queries, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            queries = queries / norms
+            matrix = self.matrix if self._rows is None else self.matrix[self._rows]
+            scores = queries @ matrix.T
+            results = []
+            for query_scores in scores:
+                top = self._top_k(query_scores, k)
+                rows = top if self._rows is None else self._rows[top]
+                results.append([self._result(row, score) for row, score in zip(rows, query_scores[top])])
+        return results
+
+    def similarity_search_by_vector(self, query_embedding, k=10, **kwargs):
+        """
+        Return the k documents most similar to a query vector.
+
+        Args:
+            query_embedding (list): The query vector.
+            k (int): The number of results.
+
+        Returns:
+            list: VectorStoreSearchResult instances, best match first.
+        """
+        return self.similarity_search_by_vectors([query_embedding], k)[0]
+
+    def similarity_search_by_text(self, text, text_embedder, k=10, **kwargs):
+        """
+        Embed a text and return the k most similar documents.
+
+        Args:
+            text (str): The query text.
+            text_embedder (callable): Turns the text into a vector.
+            k (int): The number of results.
+
+        Returns:
+            list: VectorStoreSearchResult instances, best match first.
+        """
+        query_embedding = text_embedder(text)
+        if query_embedding:
+            return self.similarity_search_by_vector(query_embedding, k)
+        return []
@@ -0,0 +1,330 @@
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+
+from llm_clients import PooledChatOpenAI
+from metrics import stage
+
+# Set these to this process's share of the account limits; 0 leaves that budget unlimited
+REQUESTS_PER_MINUTE = float(os.getenv("GRAPHRAG_LLM_REQUESTS_PER_MINUTE", "0"))
+TOKENS_PER_MINUTE = float(os.getenv("GRAPHRAG_LLM_TOKENS_PER_MINUTE", "0"))
+# While both classes are waiting, a batch call is let through after this many interactive ones
+INTERACTIVE_SHARE = int(os.getenv("GRAPHRAG_LLM_INTERACTIVE_SHARE", "4"))
+# Completion budget assumed for calls that do not set max_tokens
+DEFAULT_COMPLETION_TOKENS = 1000
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+
+# The priority of the LLM calls made by the current task or thread
+_priority = contextvars.ContextVar("llm_priority", default=INTERACTIVE)
+
+
+@contextmanager
+def llm_priority(priority):
+    """
+    Run the LLM calls made inside the block at `priority`.
+
+    Args:
+        priority (str): INTERACTIVE or BATCH.
+    """
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def estimate_tokens(texts, max_tokens=None):
+    """
+    Estimate the tokens a chat call is charged, the way OpenAI's rate limiter does.
+
+    Args:
+        texts (iterable): The message contents.
+        max_tokens (int, optional): The completion budget of the call.
+
+    Returns:
+        int: About four characters per prompt token, plus the completion budget.
+    """
+    prompt_tokens = sum(len(text) for text in texts if text) // 4
+    return prompt_tokens + (max_tokens or DEFAULT_COMPLETION_TOKENS)
+
+
+class _TokenBucket:
+    """A bucket holding up to one minute of budget, refilled continuously. Not thread-safe."""
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.level = per_minute
+        self.rate = per_minute / 60
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_for(self, amount):
+        """Return the seconds until `amount` is available; amounts above capacity wait for a full bucket."""
+        missing = min(amount, self.capacity) - self.level
+        return max(missing, 0) / self.rate
+
+    def take(self, amount):
+        # may go below zero for an oversized call, which delays the calls after it
+        self.level -= amount
+
+
+class _Waiter:
+    """A call waiting for its turn, woken from any thread."""
+
+    def __init__(self, tokens, priority, loop=None):
+        self.tokens = tokens
+        self.priority = priority
+        self.loop = loop
+        self.event = asyncio.Event() if loop is not None else threading.Event()
+
+    def wake(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.event.set)
+        else:
+            self.event.set()
+
+
+class RateGovernor:
+    """
+    Admits LLM calls within requests-per-minute and tokens-per-minute budgets.
+
+    Calls queue in two FIFO classes: INTERACTIVE (chat and search answers) and BATCH (global
+    search map calls). The head of the queue is the oldest interactive call, except that
+    after INTERACTIVE_SHARE interactive calls in a row a waiting batch call goes first, so a
+    map fan-out slows down under interactive load but never starves. Only the head may
+    take budget, so a large call is not overtaken by a stream of small ones. Sync callers
+    (threads) and async callers (any event loop) share the same queue.
+    """
+
+    def __init__(self, requests_per_minute=REQUESTS_PER_MINUTE, tokens_per_minute=TOKENS_PER_MINUTE,
+                 interactive_share=INTERACTIVE_SHARE):
+        self.requests = _TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self.tokens = _TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+        self.interactive_share = interactive_share
+        self._queues = {INTERACTIVE: deque(), BATCH: deque()}
+        self._interactive_streak = 0
+        self._lock = threading.Lock()
+        self._stats = {
+            priority: {"granted": 0, "tokens": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0}
+            for priority in self._queues
+        }
+
+    def _head(self):
+        interactive, batch = self._queues[INTERACTIVE], self._queues[BATCH]
+        if interactive and (not batch or self._interactive_streak < self.interactive_share):
+            return interactive[0]
+        return batch[0] if batch else None
+
+    def _delay(self, waiter):
+        """Return how long the head must still wait, or 0 after taking its budget. Requires the lock."""
+        now = time.monotonic()
+        delay = 0.0
+        for bucket, amount in ((self.requests, 1), (self.tokens, waiter.tokens)):
+            if bucket is not None:
+                bucket.refill(now)
+                delay = max(delay, bucket.wait_for(amount))
+        if delay > 0:
+            return delay
+        for bucket, amount in ((self.requests, 1), (self.tokens, waiter.tokens)):
+            if bucket is not None:
+                bucket.take(amount)
+        self._queues[waiter.priority].popleft()
+        if waiter.priority == INTERACTIVE:
+            self._interactive_streak += 1
+        else:
+            self._interactive_streak = 0
+        head = self._head()
+        if head is not None:
+            head.wake()
+        return 0.0
+
+    def _enqueue(self, waiter):
+        with self._lock:
+            self._queues[waiter.priority].append(waiter)
+            if self._head() is waiter:
+                waiter.event.set()
+
+    def _withdraw(self, waiter):
+        """Remove a waiter that gave up, handing the turn on if it was the head."""
+        with self._lock:
+            was_head = self._head() is waiter
+            self._queues[waiter.priority].remove(waiter)
+            head = self._head()
+            if was_head and head is not None:
+                head.wake()
+
+    def _granted(self, priority, tokens, waited):
+        with self._lock:
+            stats = self._stats[priority]
+            stats["granted"] += 1
+            stats["tokens"] += tokens
+            stats["wait_seconds"] += waited
+            stats["max_wait_seconds"] = max(stats["max_wait_seconds"], waited)
+
+    def _try_turn(self, waiter):
+        """Return the seconds to wait before trying again (None: until woken), or 0 once granted."""
+        with self._lock:
+            if self._head() is not waiter:
+                return None
+            return self._delay(waiter)
+
+    def acquire(self, tokens, priority=None):
+        """
+        Block the calling thread until a call of `tokens` may be sent.
+
+        Args:
+            tokens (int): The estimated tokens of the call.
+            priority (str, optional): INTERACTIVE or BATCH; defaults to the priority of the context.
+        """
+        priority = priority or _priority.get()
+        if self.requests is None and self.tokens is None:
+            self._granted(priority, tokens, 0.0)
+            return
+        waiter = _Waiter(tokens, priority)
+        started = time.monotonic()
+        self._enqueue(waiter)
+        try:
+            while True:
+                waiter.event.wait()
+                waiter.event.clear()
+                delay = self._try_turn(waiter)
+                if delay == 0:
+                    break
+                if delay is not None:
+                    waiter.event.wait(delay)
+                    waiter.event.set()
+        except BaseException:
+            self._withdraw(waiter)
+            raise
+        self._granted(priority, tokens, time.monotonic() - started)
+
+    async def aacquire(self, tokens, priority=None):
+        """
+        Wait, without blocking the event loop, until a call of `tokens` may be sent.
+
+        Args:
+            tokens (int): The estimated tokens of the call.
+            priority (str, optional): INTERACTIVE or BATCH; defaults to the priority of the context.
+        """
+        priority = priority or _priority.get()
+        if self.requests is None and self.tokens is None:
+            self._granted(priority, tokens, 0.0)
+            return
+        waiter = _Waiter(tokens, priority, loop=asyncio.get_running_loop())
+        started = time.monotonic()
+        self._enqueue(waiter)
+        try:
+            while True:
+                await waiter.event.wait()
+                waiter.event.clear()
+                delay = self._try_turn(waiter)
+                if delay == 0:
+                    break
+                if delay is not None:
+                    try:
+                        await asyncio.wait_for(waiter.event.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+                    waiter.event.set()
+        except BaseException:
+            self._withdraw(waiter)
+            raise
+        self._granted(priority, tokens, time.monotonic() - started)
+
+    def snapshot(self):
+        """
+        Report queue depths, grants and wait times per priority, and the remaining budgets.
+
+        Returns:
+            dict: The governor statistics.
+        """
+        with self._lock:
+            now = time.monotonic()
+            report = {}
+            for priority, queue in self._queues.items():
+                stats = dict(self._stats[priority])
+                stats["queue_depth"] = len(queue)
+                stats["mean_wait_seconds"] = (
+                    stats["wait_seconds"] / stats["granted"] if stats["granted"] else 0.0)
+                report[priority] = stats
+            for name, bucket in (("requests", self.requests), ("tokens", self.tokens)):
+                if bucket is not None:
+                    bucket.refill(now)
+                report[f"{name}_per_minute"] = bucket.capacity if bucket is not None else None
+                report[f"{name}_available"] = bucket.level if bucket is not None else None
+            return report
+
+
+def _message_texts(messages):
+    if isinstance(messages, str):
+        return [messages]
+    return [message.get("content") for message in messages if isinstance(message.get("content"), str)]
+
+
+class GovernedChatOpenAI(PooledChatOpenAI):
+    """
+    graphrag ChatOpenAI, on the pooled clients, whose every attempt, retries included, waits
+    for the rate governor.
+
+    Calls run at the priority of the context; see `llm_priority`. In a traced request the wait
+    is the llm_queue stage, and interactive calls (the answer, or the global reduce) are the
+    generation stage; batch calls are timed by their map stage.
+    """
+
+    def _generate(self, messages, streaming=True, callbacks=None, **kwargs):
+        with stage("llm_queue"):
+            get_rate_governor().acquire(estimate_tokens(_message_texts(messages), kwargs.get("max_tokens")))
+        with _generation_stage():
+            return super()._generate(messages, streaming=streaming, callbacks=callbacks, **kwargs)
+
+    async def _agenerate(self, messages, streaming=True, callbacks=None, **kwargs):
+        with stage("llm_queue"):
+            await get_rate_governor().aacquire(estimate_tokens(_message_texts(messages), kwargs.get("max_tokens")))
+        with _generation_stage():
+            return await super()._agenerate(messages, streaming=streaming, callbacks=callbacks, **kwargs)
+
+
+def _generation_stage():
+    return stage("generation") if _priority.get() == INTERACTIVE else nullcontext()
+
+
+_governor = None
+_governor_lock = threading.Lock()
+
+
+def get_rate_governor():
+    """
+    Return the process-wide rate governor, creating it on first use.
+
+    Returns:
+        RateGovernor: The governor every LLM client of this process goes through.
+    """
+    global _governor
+    with _governor_lock:
+        if _governor is None:
+            _governor = RateGovernor()
+        return _governor
+
+
+def reset_rate_governor(share=1.0):
+    """
+    Replace the process-wide governor with a new one holding `share` of the configured budgets.
+
+    Each of N forked workers calls this with a share of 1 / N, so together they stay within
+    the budgets configured for the server.
+
+    Args:
+        share (float): The part of REQUESTS_PER_MINUTE and TOKENS_PER_MINUTE this process may use.
+    """
+    global _governor, _governor_lock
+    _governor_lock = threading.Lock()
+    _governor = RateGovernor(REQUESTS_PER_MINUTE * share, TOKENS_PER_MINUTE * share)
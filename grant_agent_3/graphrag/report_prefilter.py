@@ -0,0 +1,160 @@
+import logging
+import os
+
+import numpy as np
+
+from caching import CacheStats
+from context_builders import restrict_reports
+from map_cache import CachingGlobalSearch
+from metrics import stage
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.getenv("GRAPHRAG_REPORT_PREFILTER", "0") == "1"
+# The recall knobs: keep at most TOP_N reports, and only those scoring at least MIN_SCORE
+TOP_N = int(os.getenv("GRAPHRAG_REPORT_PREFILTER_TOP_N", "100"))
+MIN_SCORE = float(os.getenv("GRAPHRAG_REPORT_PREFILTER_MIN_SCORE", "0.0"))
+# Share of the score given to the report rank, from 0 (similarity only) to 1 (rank only)
+RANK_WEIGHT = float(os.getenv("GRAPHRAG_REPORT_PREFILTER_RANK_WEIGHT", "0.1"))
+
+# Totals over every prefiltered global query
+stats = CacheStats("queries", "reports_kept", "reports_dropped", "map_calls", "map_calls_skipped")
+
+
+def report_text(report):
+    """
+    Return the text a community report is embedded by.
+
+    Args:
+        report (CommunityReport): The report.
+
+    Returns:
+        str: The title and summary, or the full content when there is no summary.
+    """
+    return f"{report.title}\n{report.summary or report.full_content}"
+
+
+class ReportPrefilter:
+    """
+    Selects the community reports relevant to a global query before they are batched.
+
+    Every report is embedded once, when the engine is built, in batches; the embeddings go
+    through the document embedding cache, so an unchanged report is not sent to the API again
+    on a later run, and reports never evict query embeddings from the query cache. A query is
+    scored against all reports in one matrix product:
+    `(1 - rank_weight) * cosine similarity + rank_weight * rank / max rank`.
+    """
+
+    def __init__(self, reports, embedder, report_embedder, top_n=TOP_N, min_score=MIN_SCORE,
+                 rank_weight=RANK_WEIGHT):
+        """
+        Args:
+            reports (list): The CommunityReport instances global search batches.
+            embedder (BaseTextEmbedding): Embeds the queries.
+            report_embedder (CachedTextEmbedding): Embeds the reports, with `embed_documents`.
+            top_n (int): The maximum number of reports kept; 0 for no limit.
+            min_score (float): The minimum score of a kept report.
+            rank_weight (float): The share of the score given to the report rank.
+        """
+        self.reports = list(reports)
+        self.embedder = embedder
+        self.top_n = top_n
+        self.min_score = min_score
+        self.rank_weight = rank_weight
+        vectors = np.asarray(
+            report_embedder.embed_documents([report_text(report) for report in self.reports]), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        self.vectors = vectors / norms
+        ranks = np.asarray([report.rank or 0.0 for report in self.reports], dtype=np.float32)
+        self.ranks = ranks / ranks.max() if len(ranks) and ranks.max() > 0 else ranks
+
+    def __repr__(self):
+        # Part of the response cache fingerprint, so it must only show the knobs
+        return (f"ReportPrefilter(top_n={self.top_n}, min_score={self.min_score}, "
+                f"rank_weight={self.rank_weight})")
+
+    def scores(self, query_embedding):
+        """
+        Score every report against a query.
+
+        Args:
+            query_embedding (list): The query embedding.
+
+        Returns:
+            ndarray: One score per report.
+        """
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        similarities = self.vectors @ (query / norm if norm else query)
+        return (1 - self.rank_weight) * similarities + self.rank_weight * self.ranks
+
+    async def select(self, query):
+        """
+        Return the reports to batch for a query.
+
+        Args:
+            query (str): The search query.
+
+        Returns:
+            list: The selected reports, in artifact order.
+        """
+        embedding = await self.embedder.aembed(query)
+        with stage("vector_lookup"):
+            scores = self.scores(embedding)
+            keep = np.flatnonzero(scores >= self.min_score)
+            if self.top_n and len(keep) > self.top_n:
+                keep = keep[np.argpartition(-scores[keep], self.top_n - 1)[:self.top_n]]
+        return [self.reports[index] for index in np.sort(keep).tolist()]
+
+
+class PrefilteredGlobalSearch(CachingGlobalSearch):
+    """
+    CachingGlobalSearch that batches only the reports a ReportPrefilter selects.
+
+    The context builder must be a PrebatchedGlobalContext, whose unfiltered batches give the
+    number of map calls the prefilter saved. The result carries `reports_selected` and
+    `map_calls_skipped`. Without a prefilter this is a plain CachingGlobalSearch.
+    """
+
+    def __init__(self, *args, report_prefilter=None, **kwargs):
+        """
+        Args:
+            report_prefilter (ReportPrefilter, optional): The prefilter.
+
+        All other arguments are passed to CachingGlobalSearch.
+        """
+        super().__init__(*args, **kwargs)
+        self.report_prefilter = report_prefilter
+
+    async def asearch(self, query, conversation_history=None, **kwargs):
+        """Run the search over the reports selected for the query."""
+        if self.report_prefilter is None:
+            return await super().asearch(query, conversation_history, **kwargs)
+
+        reports = await self.report_prefilter.select(query)
+        with restrict_reports(reports):
+            result = await super().asearch(query, conversation_history, **kwargs)
+        all_batches = len(self.context_builder.batches(**self.context_builder_params))
+        map_calls = len(result.map_responses)
+        result.reports_selected = len(reports)
+        result.map_calls_skipped = max(all_batches - map_calls, 0)
+
+        stats.incr("queries")
+        stats.incr("reports_kept", len(reports))
+        stats.incr("reports_dropped", len(self.report_prefilter.reports) - len(reports))
+        stats.incr("map_calls", map_calls)
+        stats.incr("map_calls_skipped", result.map_calls_skipped)
+        return result
+
+
+def snapshot():
+    """
+    Report the totals of the prefilter over every global query.
+
+    Returns:
+        dict: The counters and the share of map calls skipped.
+    """
+    counts = stats.snapshot()
+    total = counts["map_calls"] + counts["map_calls_skipped"]
+    return {**counts, "skipped_rate": counts["map_calls_skipped"] / total if total else 0.0}
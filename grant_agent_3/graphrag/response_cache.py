@@ -0,0 +1,431 @@
+import asyncio
+import copy
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import ExitStack
+
+import pandas as pd
+
+from caching import CACHE_DIR, CacheStats, DiskCache, LRUCache
+from embedding_cache import get_query_embedder, normalize_text
+from engine_registry import registry
+from metrics import stage
+from semantic_cache import ENABLED as SEMANTIC_CACHE_ENABLED, get_semantic_cache
+from streaming import is_streamed
+
+logger = logging.getLogger(__name__)
+
+TTL_SECONDS = float(os.getenv("GRAPHRAG_RESPONSE_CACHE_TTL_SECONDS", "3600"))
+MEMORY_ENTRIES = int(os.getenv("GRAPHRAG_RESPONSE_CACHE_MEMORY_ENTRIES", "2000"))
+MEMORY_BYTES = int(os.getenv("GRAPHRAG_RESPONSE_CACHE_MEMORY_BYTES", str(64 * 1024 * 1024)))
+# 0 keeps responses in memory only
+DISK_ENTRIES = int(os.getenv("GRAPHRAG_RESPONSE_CACHE_DISK_ENTRIES", "0"))
+DISK_PATH = os.getenv(
+    "GRAPHRAG_RESPONSE_CACHE_PATH", os.path.join(CACHE_DIR, "responses.sqlite"))
+
+# The searches in progress on this process's event loop, by cache key and cache options
+_flights = {}
+
+# Search engine attributes that change the answer to a given query
+FINGERPRINT_ATTRIBUTES = [
+    "context_builder_params",
+    "llm_params",
+    "map_llm_params",
+    "reduce_llm_params",
+    "response_type",
+    "max_data_tokens",
+    "allow_general_knowledge",
+    "json_mode",
+    "report_prefilter",
+    "entity_retrieval",
+]
+
+
+def engine_fingerprint(engine):
+    """
+    Hash the context and LLM parameters of a search engine.
+
+    Args:
+        engine (BaseSearch): The search engine.
+
+    Returns:
+        str: A short hex digest that changes whenever any parameter does.
+    """
+    params = {name: getattr(engine, name) for name in FINGERPRINT_ATTRIBUTES if hasattr(engine, name)}
+    params["engine"] = type(engine).__name__
+    params["model"] = getattr(engine.llm, "model", None)
+    encoded = json.dumps(params, sort_keys=True, default=str).encode()
+    return hashlib.sha256(encoded).hexdigest()[:16]
+
+
+def _json_default(value):
+    # numpy scalars, as found in context data
+    if hasattr(value, "item"):
+        return value.item()
+    raise TypeError(f"Cannot store {type(value).__name__} in the response cache")
+
+
+def encode_response(response):
+    """
+    Serialize a search response as JSON, its context_data DataFrame as columns and records.
+
+    Responses are stored as JSON rather than pickled, so a tampered cache file cannot run code.
+
+    Args:
+        response (dict): The search response.
+
+    Returns:
+        bytes: The UTF-8 encoded JSON.
+    """
+    data = dict(response)
+    context_data = data.get("context_data")
+    if isinstance(context_data, pd.DataFrame):
+        data["context_data"] = {
+            "columns": [str(column) for column in context_data.columns],
+            "records": context_data.to_dict(orient="records"),
+        }
+    return json.dumps(data, default=_json_default).encode()
+
+
+def decode_response(blob):
+    """
+    Rebuild a search response stored with `encode_response`.
+
+    Args:
+        blob (bytes): The stored JSON.
+
+    Returns:
+        dict: The response, with context_data back as a DataFrame.
+    """
+    response = json.loads(blob)
+    context_data = response.get("context_data")
+    if isinstance(context_data, dict):
+        response["context_data"] = pd.DataFrame.from_records(
+            context_data["records"], columns=context_data["columns"])
+    return response
+
+
+class ResponseCache:
+    """
+    Cache of complete search responses, per engine and index run.
+
+    Entries live in a memory LRU bounded by entry count and total size, optionally backed
+    by a SQLite file so they survive restarts, and expire after `ttl` seconds. Both tiers
+    hold the JSON of `encode_response`. Keys start
+    with "<engine>:<run_id>:" so all entries of a replaced run can be dropped at once.
+    """
+
+    def __init__(self, ttl=TTL_SECONDS, memory_entries=MEMORY_ENTRIES, memory_bytes=MEMORY_BYTES,
+                 disk_path=DISK_PATH, disk_entries=DISK_ENTRIES):
+        self.ttl = ttl
+        self.memory = LRUCache(memory_entries, max_bytes=memory_bytes, sizeof=lambda entry: len(entry[1]))
+        self.disk = DiskCache(disk_path, disk_entries) if disk_path and disk_entries > 0 else None
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+
+    @staticmethod
+    def key(engine_name, run_id, fingerprint, query):
+        """
+        Build the cache key for a query against one engine version.
+
+        Args:
+            engine_name (str): The engine name, e.g. "local".
+            run_id (str): The index run the engine serves.
+            fingerprint (str): The engine parameter fingerprint.
+            query (str): The search query.
+
+        Returns:
+            str: The cache key.
+        """
+        digest = hashlib.sha256(f"{fingerprint}\0{normalize_text(query)}".encode()).hexdigest()
+        return f"{engine_name}:{run_id}:{digest}"
+
+    def stats(self, engine_name):
+        """
+        Return the hit/miss counters of one engine, creating them on first use.
+
+        Args:
+            engine_name (str): The engine name.
+
+        Returns:
+            CacheStats: The counters.
+        """
+        with self._stats_lock:
+            if engine_name not in self._stats:
+                self._stats[engine_name] = CacheStats("hits", "misses")
+            return self._stats[engine_name]
+
+    def get(self, engine_name, key):
+        """
+        Look up a cached response.
+
+        Args:
+            engine_name (str): The engine name, used for the hit rate.
+            key (str): The cache key.
+
+        Returns:
+            dict: A fresh copy of the cached response, or None on a miss.
+        """
+        now = time.time()
+        entry = self.memory.get(key)
+        if entry is not None and entry[0] < now:
+            self.memory.pop(key)
+            entry = None
+        if entry is None and self.disk is not None:
+            stored = self.disk.get(key, with_expires=True)
+            if stored is not None:
+                # keep the deadline set when the response was first cached
+                blob, expires = stored
+                entry = (expires if expires is not None else now + self.ttl, blob)
+                self.memory.put(key, entry)
+        response = None
+        if entry is not None:
+            try:
+                response = decode_response(entry[1])
+            except ValueError:
+                # written in another format, e.g. by an older version
+                self.memory.pop(key)
+        if response is None:
+            self.stats(engine_name).incr("misses")
+            return None
+        self.stats(engine_name).incr("hits")
+        return response
+
+    def put(self, key, response):
+        """
+        Store a response in memory and, when enabled, on disk.
+
+        Args:
+            key (str): The cache key.
+            response (dict): The response to cache.
+        """
+        blob = encode_response(response)
+        self.memory.put(key, (time.time() + self.ttl, blob))
+        if self.disk is not None:
+            self.disk.put(key, blob, ttl=self.ttl)
+
+    def invalidate(self, engine_name, run_id):
+        """
+        Drop every cached response of one engine for one index run.
+
+        Args:
+            engine_name (str): The engine name.
+            run_id (str): The index run whose responses are stale.
+        """
+        prefix = f"{engine_name}:{run_id}:"
+        self.memory.discard_where(lambda key: key.startswith(prefix))
+        if self.disk is not None:
+            self.disk.delete_where_key_like(prefix + "%")
+
+    def snapshot(self):
+        """
+        Report per-engine hit rates and the memory tier size.
+
+        Returns:
+            dict: The cache statistics.
+        """
+        with self._stats_lock:
+            engines = dict(self._stats)
+        report = {}
+        for engine_name, stats in engines.items():
+            counts = stats.snapshot()
+            lookups = counts["hits"] + counts["misses"]
+            report[engine_name] = {**counts, "hit_rate": counts["hits"] / lookups if lookups else 0.0}
+        return {
+            "engines": report,
+            "memory_entries": len(self.memory),
+            "memory_bytes": self.memory.nbytes,
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """
+    Return the process-wide response cache, creating it on first use.
+
+    Returns:
+        ResponseCache: The shared cache.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache()
+        return _cache
+
+
+def _cache_keys(engine_name, version, query):
+    """Return the exact-match key and the semantic scope of a query against one engine version."""
+    fingerprint = engine_fingerprint(version.engine)
+    key = get_response_cache().key(engine_name, version.run.run_id, fingerprint, query)
+    return key, (engine_name, version.run.run_id, fingerprint)
+
+
+def _semantic_lookup(key, scope, embedding, use_cache):
+    """Return the answer to a similar earlier query, copied into the exact-match cache, or None."""
+    response, similarity = get_semantic_cache().get(scope, embedding)
+    if response is None:
+        return None
+    if use_cache:
+        get_response_cache().put(key, response)
+    response["cached"] = "semantic"
+    response["similarity"] = similarity
+    return response
+
+
+def _store(key, scope, embedding, response, use_cache):
+    """Cache a fresh response; empty responses, returned when the LLM call fails, are not cached."""
+    if response.get("response"):
+        if use_cache:
+            get_response_cache().put(key, response)
+        if embedding:
+            get_semantic_cache().put(scope, embedding, response)
+
+
+def cached_search(engine_name, version, query, search, use_cache=True, use_semantic_cache=True):
+    """
+    Answer a query from the response caches, running `search` only on a miss.
+
+    The exact-match cache is tried first, then the semantic cache, which serves the answer
+    to an earlier query whose embedding is similar enough. Empty responses, which graphrag
+    returns when the LLM call fails, are never cached.
+
+    Args:
+        engine_name (str): The engine name.
+        version (_EngineVersion): The leased engine version.
+        query (str): The search query.
+        search (callable): Called with the engine and query on a miss; returns the response dict.
+        use_cache (bool): Use the exact-match cache.
+        use_semantic_cache (bool): Use the semantic cache.
+
+    Returns:
+        dict: The response, with "cached" set to "exact" or "semantic" when it was served from a cache.
+    """
+    key, scope = _cache_keys(engine_name, version, query)
+    if use_cache:
+        response = get_response_cache().get(engine_name, key)
+        if response is not None:
+            response["cached"] = "exact"
+            return response
+
+    embedding = None
+    if use_semantic_cache and SEMANTIC_CACHE_ENABLED:
+        try:
+            embedding = get_query_embedder().embed(query)
+        except Exception:
+            logger.exception("Could not embed the query for the semantic cache")
+        if embedding:
+            response = _semantic_lookup(key, scope, embedding, use_cache)
+            if response is not None:
+                return response
+
+    response = search(version.engine, query)
+    _store(key, scope, embedding, response, use_cache)
+    return response
+
+
+async def _search_and_store(engine_name, version, query, search, key, scope, use_cache, use_semantic_cache,
+                            limit):
+    """The part of acached_search after an exact-match miss, run once per flight."""
+    embedding = None
+    if use_semantic_cache and SEMANTIC_CACHE_ENABLED:
+        try:
+            embedding = await get_query_embedder().aembed(query)
+        except Exception:
+            logger.exception("Could not embed the query for the semantic cache")
+        if embedding:
+            response = _semantic_lookup(key, scope, embedding, use_cache)
+            if response is not None:
+                return response
+
+    if limit is None:
+        response = await search(version.engine, query)
+    else:
+        async with limit:
+            response = await search(version.engine, query)
+    _store(key, scope, embedding, response, use_cache)
+    return response
+
+
+def _land(flight_key, flight, lease):
+    # the flight's own lease is released here rather than inside the task, whose body
+    # never runs if it is cancelled before its first step
+    lease.close()
+    _flights.pop(flight_key, None)
+    if not flight.cancelled():
+        # mark the error as seen, even if every waiter has gone
+        flight.exception()
+
+
+async def acached_search(engine_name, version, query, search, use_cache=True, use_semantic_cache=True,
+                         limit=None):
+    """
+    Async `cached_search`: the query is embedded and the search run without blocking the event loop.
+
+    Identical queries arriving while one is being answered are coalesced: the first starts
+    a search task (a "flight") and later ones await the same task, timed as their
+    coalesced_wait stage. Waiters are shielded from it, so a client that disconnects never
+    cancels the search the others wait for. The flight runs in the context of the request
+    that started it, so its stage timings and stream events go to that request only;
+    streamed searches are therefore never coalesced.
+
+    Args:
+        engine_name (str): The engine name.
+        version (_EngineVersion): The leased engine version.
+        query (str): The search query.
+        search (callable): Coroutine function called with the engine and query on a miss.
+        use_cache (bool): Use the exact-match cache.
+        use_semantic_cache (bool): Use the semantic cache.
+        limit (asyncio.Semaphore, optional): Held while `search` runs; cache hits never wait for it.
+
+    Returns:
+        dict: The response, with "cached" set to "exact" or "semantic" when it was served from a
+            cache and "coalesced" set when it was shared with an earlier identical request.
+    """
+    key, scope = _cache_keys(engine_name, version, query)
+    if use_cache:
+        response = get_response_cache().get(engine_name, key)
+        if response is not None:
+            response["cached"] = "exact"
+            return response
+
+    if is_streamed():
+        return await _search_and_store(
+            engine_name, version, query, search, key, scope, use_cache, use_semantic_cache, limit)
+
+    flight_key = (key, use_cache, use_semantic_cache)
+    flight = _flights.get(flight_key)
+    if flight is not None:
+        get_response_cache().stats(engine_name).incr("coalesced")
+        with stage("coalesced_wait"):
+            response = copy.deepcopy(await asyncio.shield(flight))
+        response["coalesced"] = True
+        return response
+
+    # take the flight's lease before this caller can be cancelled, so the engine outlives
+    # the caller's own lease for as long as the flight runs
+    lease = ExitStack()
+    lease.enter_context(registry.extend_lease(version))
+    try:
+        flight = asyncio.ensure_future(_search_and_store(
+            engine_name, version, query, search, key, scope, use_cache, use_semantic_cache, limit))
+    except BaseException:
+        lease.close()
+        raise
+    _flights[flight_key] = flight
+    flight.add_done_callback(lambda done: _land(flight_key, done, lease))
+    # the flight's result is shared, so every caller gets its own copy
+    return copy.deepcopy(await asyncio.shield(flight))
+
+
+def _invalidate_on_swap(name, old_run, new_run):
+    get_response_cache().invalidate(name, old_run.run_id)
+
+
+registry.on_swap(_invalidate_on_swap)
@@ -0,0 +1,267 @@
+import copy
+import os
+import threading
+
+import numpy as np
+
+from caching import CacheStats
+from engine_registry import registry
+
+ENABLED = os.getenv("GRAPHRAG_SEMANTIC_CACHE", "1") == "1"
+# Minimum cosine similarity between two query embeddings for one to reuse the other's answer
+THRESHOLD = float(os.getenv("GRAPHRAG_SEMANTIC_CACHE_THRESHOLD", "0.95"))
+MAX_ENTRIES = int(os.getenv("GRAPHRAG_SEMANTIC_CACHE_MAX_ENTRIES", "50000"))
+# Size of the random projection used to rank candidates before the exact comparison
+PROJECTION_DIMENSIONS = int(os.getenv("GRAPHRAG_SEMANTIC_CACHE_PROJECTION_DIMENSIONS", "128"))
+SHORTLIST = int(os.getenv("GRAPHRAG_SEMANTIC_CACHE_SHORTLIST", "8"))
+# Bucket entries a lookup gathers at most; past that it ranks the whole scope in one matrix product
+MAX_CANDIDATES = int(os.getenv("GRAPHRAG_SEMANTIC_CACHE_MAX_CANDIDATES", "4096"))
+# The whole-scope ranking reads only this many projection dimensions, and keeps COARSE_SHORTLIST
+# entries for the full projection to rank
+COARSE_DIMENSIONS = 32
+COARSE_SHORTLIST = 1024
+# Locality-sensitive hash tables over the signs of the projection. With 8 tables of 10 bits a
+# query at cosine 0.95 from a cached one shares a bucket with it about 97% of the time.
+HASH_TABLES = 8
+HASH_BITS = 10
+INITIAL_CAPACITY = 1024
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class _Scope:
+    """
+    The cached queries of one engine version, stored as a ring buffer of fixed capacity.
+
+    `projected` holds the unit-length random projections used to rank candidates, `coarse`
+    their first COARSE_DIMENSIONS, renormalized, and `vectors` the full unit-length
+    embeddings, in float16, used to confirm a match. Every entry is also filed in HASH_TABLES
+    buckets keyed by the signs of its projection, so a lookup only compares against entries
+    sharing at least one bucket with the query. A bucket is an insertion-ordered dict of
+    slots, so an overwritten slot leaves it in constant time.
+
+    Queries built from one template share most sign bits and crowd into a few buckets. When the
+    buckets a query falls in hold more than `max_candidates` entries between them, gathering
+    them in Python would cost more than ranking the whole scope, so the lookup ranks every
+    entry with one matrix product over `coarse` instead.
+    """
+
+    def __init__(self, dimensions, projection_dimensions, max_entries):
+        self.max_entries = max_entries
+        self.projected = np.zeros((0, projection_dimensions), dtype=np.float32)
+        self.coarse = np.zeros((0, COARSE_DIMENSIONS), dtype=np.float32)
+        self.vectors = np.zeros((0, dimensions), dtype=np.float16)
+        self.bucket_keys = np.zeros((0, HASH_TABLES), dtype=np.int64)
+        self.buckets = [{} for _ in range(HASH_TABLES)]
+        self.responses = []
+        self.count = 0
+        self.next_slot = 0
+
+    def _grow(self):
+        capacity = min(self.max_entries, max(INITIAL_CAPACITY, 2 * len(self.responses)))
+        extra = capacity - len(self.responses)
+        self.projected = np.vstack([
+            self.projected, np.zeros((extra, self.projected.shape[1]), dtype=np.float32)])
+        self.coarse = np.vstack([self.coarse, np.zeros((extra, COARSE_DIMENSIONS), dtype=np.float32)])
+        self.vectors = np.vstack([
+            self.vectors, np.zeros((extra, self.vectors.shape[1]), dtype=np.float16)])
+        self.bucket_keys = np.vstack([
+            self.bucket_keys, np.zeros((extra, HASH_TABLES), dtype=np.int64)])
+        self.responses.extend([None] * extra)
+
+    def add(self, projected, vector, keys, response):
+        if self.next_slot == len(self.responses) and len(self.responses) < self.max_entries:
+            self._grow()
+        slot = self.next_slot
+        if self.responses[slot] is not None:
+            for table, key in zip(self.buckets, self.bucket_keys[slot].tolist()):
+                del table[key][slot]
+                if not table[key]:
+                    del table[key]
+        for table, key in zip(self.buckets, keys.tolist()):
+            table.setdefault(key, {})[slot] = None
+        self.projected[slot] = projected
+        self.coarse[slot] = _normalize(projected[:COARSE_DIMENSIONS])
+        self.vectors[slot] = vector
+        self.bucket_keys[slot] = keys
+        self.responses[slot] = response
+        self.count = min(self.count + 1, self.max_entries)
+        self.next_slot = (slot + 1) % self.max_entries
+
+    def _candidates(self, keys, max_candidates):
+        """Return the slots sharing a bucket with `keys`, or None if the buckets hold too many."""
+        buckets = [table.get(key, ()) for table, key in zip(self.buckets, keys.tolist())]
+        if sum(len(bucket) for bucket in buckets) > max_candidates:
+            return None
+        slots = set()
+        for bucket in buckets:
+            slots.update(bucket)
+        return np.fromiter(slots, dtype=np.int64, count=len(slots))
+
+    def best_match(self, projected, vector, keys, shortlist, max_candidates):
+        candidates = self._candidates(keys, max_candidates)
+        if candidates is None:
+            scores = self.coarse[:self.count] @ _normalize(projected[:COARSE_DIMENSIONS])
+            candidates = np.argpartition(scores, max(self.count - COARSE_SHORTLIST, 0))[-COARSE_SHORTLIST:]
+        if len(candidates) > shortlist:
+            scores = self.projected[candidates] @ projected
+            candidates = candidates[np.argpartition(-scores, shortlist - 1)[:shortlist]]
+        if not len(candidates):
+            return None, 0.0
+        similarities = self.vectors[candidates].astype(np.float32) @ vector
+        best = int(np.argmax(similarities))
+        return self.responses[candidates[best]], float(similarities[best])
+
+
+class SemanticCache:
+    """
+    Cache of search responses looked up by query meaning rather than exact wording.
+
+    Each (engine, index run, parameter fingerprint) has its own scope. A lookup projects the
+    query embedding onto a fixed random basis of `projection_dimensions`, gathers the entries
+    sharing a hash bucket with it, keeps the `shortlist` closest in the projected space, and
+    confirms the best one with the exact cosine similarity of the full embeddings. The work
+    per lookup depends on the bucket sizes, up to `max_candidates`; a query whose buckets hold
+    more is ranked against the whole scope at once. Once a scope is full its oldest entries
+    are replaced.
+    """
+
+    def __init__(self, threshold=THRESHOLD, max_entries=MAX_ENTRIES,
+                 projection_dimensions=PROJECTION_DIMENSIONS, shortlist=SHORTLIST,
+                 max_candidates=MAX_CANDIDATES, seed=0):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.projection_dimensions = projection_dimensions
+        self.shortlist = shortlist
+        self.max_candidates = max_candidates
+        self.seed = seed
+        self.projection = None
+        self._scopes = {}
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def _project(self, embedding):
+        """Return the unit-length embedding, its unit-length projection and its bucket keys. Requires the lock."""
+        vector = _normalize(np.asarray(embedding, dtype=np.float32))
+        if self.projection is None or self.projection.shape[0] != vector.shape[0]:
+            rng = np.random.default_rng(self.seed)
+            self.projection = rng.standard_normal(
+                (vector.shape[0], max(self.projection_dimensions, HASH_TABLES * HASH_BITS))
+            ).astype(np.float32)
+            self._scopes.clear()
+        projected = vector @ self.projection
+        signs = (projected[:HASH_TABLES * HASH_BITS] > 0).reshape(HASH_TABLES, HASH_BITS)
+        keys = signs @ (1 << np.arange(HASH_BITS))
+        return vector, _normalize(projected), keys
+
+    def stats(self, engine_name):
+        """
+        Return the hit/miss counters of one engine, creating them on first use.
+
+        Args:
+            engine_name (str): The engine name.
+
+        Returns:
+            CacheStats: The counters.
+        """
+        with self._lock:
+            if engine_name not in self._stats:
+                self._stats[engine_name] = CacheStats("hits", "misses")
+            return self._stats[engine_name]
+
+    def get(self, scope, embedding):
+        """
+        Find the cached response of the most similar earlier query in a scope.
+
+        Args:
+            scope (tuple): (engine name, run id, parameter fingerprint).
+            embedding (list): The query embedding.
+
+        Returns:
+            tuple: A copy of the cached response and its similarity, or (None, similarity) on a miss.
+        """
+        with self._lock:
+            vector, projected, keys = self._project(embedding)
+            entries = self._scopes.get(scope)
+            response, similarity = (None, 0.0) if entries is None else entries.best_match(
+                projected, vector, keys, self.shortlist, self.max_candidates)
+        if response is None or similarity < self.threshold:
+            self.stats(scope[0]).incr("misses")
+            return None, similarity
+        self.stats(scope[0]).incr("hits")
+        return copy.deepcopy(response), similarity
+
+    def put(self, scope, embedding, response):
+        """
+        Remember the response to a query.
+
+        Args:
+            scope (tuple): (engine name, run id, parameter fingerprint).
+            embedding (list): The query embedding.
+            response (dict): The response to cache.
+        """
+        with self._lock:
+            vector, projected, keys = self._project(embedding)
+            entries = self._scopes.get(scope)
+            if entries is None:
+                entries = _Scope(vector.shape[0], projected.shape[0], self.max_entries)
+                self._scopes[scope] = entries
+            entries.add(projected, vector, keys, copy.deepcopy(response))
+
+    def invalidate(self, engine_name, run_id):
+        """
+        Drop every scope of one engine for one index run.
+
+        Args:
+            engine_name (str): The engine name.
+            run_id (str): The index run whose responses are stale.
+        """
+        with self._lock:
+            for scope in [scope for scope in self._scopes if scope[:2] == (engine_name, run_id)]:
+                del self._scopes[scope]
+
+    def snapshot(self):
+        """
+        Report per-engine hit rates and the number of cached queries.
+
+        Returns:
+            dict: The cache statistics.
+        """
+        with self._lock:
+            engines = dict(self._stats)
+            entries = sum(scope.count for scope in self._scopes.values())
+        report = {}
+        for engine_name, stats in engines.items():
+            counts = stats.snapshot()
+            lookups = counts["hits"] + counts["misses"]
+            report[engine_name] = {**counts, "hit_rate": counts["hits"] / lookups if lookups else 0.0}
+        return {"engines": report, "entries": entries, "threshold": self.threshold}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_semantic_cache():
+    """
+    Return the process-wide semantic cache, creating it on first use.
+
+    Returns:
+        SemanticCache: The shared cache.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = SemanticCache()
+        return _cache
+
+
+def _invalidate_on_swap(name, old_run, new_run):
+    get_semantic_cache().invalidate(name, old_run.run_id)
+
+
+registry.on_swap(_invalidate_on_swap)
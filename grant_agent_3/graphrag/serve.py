@@ -0,0 +1,307 @@
+import argparse
+import gc
+import json
+import logging
+import os
+import signal
+import socket
+import time
+
+# Before the engines are imported: a LanceDB connection, and the threads behind it, do not
+# survive os.fork, so the workers search the in-process NumPy index the parent built
+os.environ.setdefault("GRAPHRAG_VECTOR_STORE", "numpy")
+
+import uvicorn
+
+import api
+import local_search
+from engine_registry import registry
+from index_runs import POLL_SECONDS, IndexWatcher
+from llm_clients import reset_client_pool
+from rate_governor import reset_rate_governor
+
+logger = logging.getLogger(__name__)
+
+HOST = os.getenv("GRAPHRAG_HOST", "0.0.0.0")
+PORT = int(os.getenv("GRAPHRAG_PORT", "8000"))
+WORKERS = int(os.getenv("GRAPHRAG_WORKERS", str(os.cpu_count() or 1)))
+# Retired workers get this long to finish their requests before they are killed
+GRACEFUL_SECONDS = float(os.getenv("GRAPHRAG_GRACEFUL_SECONDS", "60"))
+MEMORY_REPORT_SECONDS = float(os.getenv("GRAPHRAG_MEMORY_REPORT_SECONDS", "300"))
+BACKLOG = 2048
+TICK_SECONDS = 0.5
+
+
+def memory_usage(pid):
+    """
+    Read how much of a process's memory is shared with others.
+
+    RSS counts every resident page, shared or not, so the RSS of forked workers adds up to
+    more than they use together. PSS splits each shared page between the processes mapping
+    it, so the PSS of all processes sums to their real footprint; private pages are the
+    ones only this process maps.
+
+    Args:
+        pid (int): The process id.
+
+    Returns:
+        dict: rss_mb, pss_mb, shared_mb and private_mb, or None where /proc/<pid>/smaps_rollup
+            cannot be read (not Linux, or the process has exited).
+    """
+    fields = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == "kB":
+                    fields[parts[0].rstrip(":")] = int(parts[1])
+    except OSError:
+        return None
+
+    def mb(*names):
+        return sum(fields.get(name, 0) for name in names) / 1024
+
+    return {
+        "rss_mb": mb("Rss"),
+        "pss_mb": mb("Pss"),
+        "shared_mb": mb("Shared_Clean", "Shared_Dirty"),
+        "private_mb": mb("Private_Clean", "Private_Dirty"),
+    }
+
+
+def bind(host, port):
+    """Open the listening socket every worker accepts on."""
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(BACKLOG)
+    return sock
+
+
+def run_worker(sock, share, log_level):
+    """
+    Serve the API on the inherited socket; runs in a forked worker until it is told to stop.
+
+    Args:
+        sock (socket.socket): The listening socket.
+        share (float): The part of the LLM rate limits this worker may use.
+        log_level (str): The uvicorn log level.
+    """
+    gc.enable()
+    # the parent's HTTP connections and rate budget are not this worker's to use
+    reset_client_pool()
+    reset_rate_governor(share)
+    api.WATCH_INDEX = False
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    # SIGUSR1 asks the supervisor for a memory report; a signal sent to the whole group must not stop workers
+    signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+    uvicorn.Server(uvicorn.Config(api.app, log_level=log_level)).run(sockets=[sock])
+
+
+class Supervisor:
+    """
+    Forks the API workers from a parent holding the loaded engines, and keeps them running.
+
+    The engines are built once, in the parent, and frozen out of the garbage collector's
+    reach (`gc.freeze`) before the workers are forked, so the collector never writes to their
+    pages and the workers share them copy-on-write: the artifact tables, embedding matrix,
+    token counts and adjacency indexes are in memory once, however many workers there are.
+    When a new index run completes, the parent builds its engines and forks a new set of
+    workers from them, then retires the old ones once their requests have finished. A
+    worker that dies is replaced.
+    """
+
+    def __init__(self, sock, workers, poll_seconds=POLL_SECONDS, report_seconds=MEMORY_REPORT_SECONDS,
+                 log_level="info"):
+        """
+        Args:
+            sock (socket.socket): The listening socket.
+            workers (int): The number of workers.
+            poll_seconds (float): Seconds between scans for new index runs; 0 turns scanning off.
+            report_seconds (float): Seconds between memory reports; 0 reports on SIGUSR1 only.
+            log_level (str): The uvicorn log level of the workers.
+        """
+        self.sock = sock
+        self.workers = workers
+        self.poll_seconds = poll_seconds
+        self.report_seconds = report_seconds
+        self.log_level = log_level
+        self.generation = 0
+        self._live = {}
+        self._retiring = {}
+        self._stopping = False
+        self._report_requested = False
+
+    def _spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(self.sock, 1 / self.workers, self.log_level)
+            except BaseException:
+                logger.exception("Worker %s failed", os.getpid())
+                code = 1
+            finally:
+                os._exit(code)
+        self._live[pid] = self.generation
+        logger.info("Started worker %s (generation %s)", pid, self.generation)
+
+    def _spawn_generation(self):
+        """Fork a full set of workers from the engines loaded now."""
+        gc.unfreeze()
+        gc.collect()
+        gc.freeze()
+        for _ in range(self.workers):
+            self._spawn()
+
+    def _retire(self, pid):
+        self._live.pop(pid, None)
+        self._retiring[pid] = time.monotonic() + GRACEFUL_SECONDS
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    def load(self, run):
+        """
+        Build the engines of a new index run, then replace the workers with ones forked from them.
+
+        The old workers keep serving until the new engines are ready; if any engine fails to
+        build, they keep serving the old run.
+
+        Args:
+            run (IndexRun): The new run.
+        """
+        registry.load(run)
+        registry.wait_for_loads()
+        if any(registry.current_run(name) != run for name in registry.status()):
+            logger.error("Index run %s did not load; workers keep serving the previous run", run.run_id)
+            return
+        old = list(self._live)
+        self.generation += 1
+        self._spawn_generation()
+        for pid in old:
+            self._retire(pid)
+
+    def _reap(self):
+        """Collect exited workers, replacing live ones that died, and kill retired ones past their grace period."""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            if self._retiring.pop(pid, None) is not None:
+                logger.info("Retired worker %s exited", pid)
+            elif self._live.pop(pid, None) is not None and not self._stopping:
+                logger.warning("Worker %s exited with status %s; starting a replacement", pid, status)
+                self._spawn()
+        now = time.monotonic()
+        for pid, deadline in list(self._retiring.items()):
+            if deadline < now:
+                logger.warning("Worker %s did not stop in %.0fs; killing it", pid, GRACEFUL_SECONDS)
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                self._retiring[pid] = float("inf")
+
+    def report(self):
+        """
+        Print the memory of the parent and each worker as one JSON line.
+
+        Returns:
+            dict: The report.
+        """
+        workers = [
+            {"pid": pid, "generation": generation, **(memory_usage(pid) or {})}
+            for pid, generation in sorted(self._live.items())
+        ]
+        processes = [memory_usage(os.getpid()) or {}] + workers
+        report = {
+            "parent": {"pid": os.getpid(), **processes[0]},
+            "workers": workers,
+            # what the processes use together, against what adding up RSS suggests
+            "total_pss_mb": sum(process.get("pss_mb", 0) for process in processes),
+            "total_rss_mb": sum(process.get("rss_mb", 0) for process in processes),
+        }
+        print(json.dumps(report), flush=True)
+        return report
+
+    def _request_stop(self, signum, frame):
+        self._stopping = True
+
+    def _request_report(self, signum, frame):
+        self._report_requested = True
+
+    def run(self):
+        """Fork the workers and supervise them until SIGTERM or SIGINT."""
+        signal.signal(signal.SIGTERM, self._request_stop)
+        signal.signal(signal.SIGINT, self._request_stop)
+        signal.signal(signal.SIGUSR1, self._request_report)
+        watcher = IndexWatcher(self.load, poll_seconds=self.poll_seconds)
+        served = [registry.current_run(name) for name in registry.status()]
+        watcher.mark_served(next((run for run in served if run is not None), None))
+        self._spawn_generation()
+
+        next_poll = time.monotonic() + self.poll_seconds
+        next_report = time.monotonic() + self.report_seconds
+        while not self._stopping:
+            time.sleep(TICK_SECONDS)
+            self._reap()
+            now = time.monotonic()
+            if self.poll_seconds > 0 and now >= next_poll:
+                try:
+                    watcher.poll()
+                except Exception:
+                    logger.exception("Failed to scan for new index runs")
+                next_poll = time.monotonic() + self.poll_seconds
+            if self._report_requested or (self.report_seconds > 0 and now >= next_report):
+                self._report_requested = False
+                self.report()
+                next_report = now + self.report_seconds
+        self.stop()
+
+    def stop(self):
+        """Stop every worker, letting each finish its requests for up to GRACEFUL_SECONDS."""
+        for pid in list(self._live):
+            self._retire(pid)
+        while self._retiring:
+            self._reap()
+            time.sleep(TICK_SECONDS)
+
+
+def main():
+    """Load the engines once, then serve the API from several forked workers sharing them."""
+    parser = argparse.ArgumentParser(
+        description="Serve the search API from forked workers that share one copy of the loaded engines.")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--poll-seconds", type=float, default=POLL_SECONDS,
+                        help="Seconds between scans for new index runs; 0 turns scanning off.")
+    parser.add_argument("--report-seconds", type=float, default=MEMORY_REPORT_SECONDS,
+                        help="Seconds between per-worker memory reports; 0 reports on SIGUSR1 only.")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if local_search.VECTOR_STORE != "numpy":
+        parser.error("serve.py needs GRAPHRAG_VECTOR_STORE=numpy: LanceDB cannot be used across os.fork")
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s %(process)d %(name)s: %(message)s")
+
+    sock = bind(args.host, args.port)
+    # nothing is collected while the engines load; the parent collects once before each fork
+    gc.disable()
+    started = time.perf_counter()
+    registry.start()
+    if not registry.wait_for_loads():
+        logger.error("Not every search engine loaded: %s", json.dumps(registry.status()))
+    logger.info("Engines loaded in %.1fs; forking %s workers", time.perf_counter() - started, args.workers)
+    Supervisor(sock, args.workers, args.poll_seconds, args.report_seconds, args.log_level).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+import asyncio
+import contextvars
+import json
+import logging
+
+from graphrag.query.structured_search.global_search.callbacks import GlobalSearchLLMCallback
+
+from engine_registry import EngineNotReadyError
+
+logger = logging.getLogger(__name__)
+
+# The stream of the search running in the current task, if it is being streamed
+_current_stream = contextvars.ContextVar("search_stream", default=None)
+_DONE = object()
+
+
+class SearchStream:
+    """The events of one streamed search, queued on the event loop running it."""
+
+    def __init__(self):
+        self.queue = asyncio.Queue()
+        self.map_done = 0
+        self.map_total = 0
+
+    def emit(self, event, data):
+        """
+        Queue an event for the client.
+
+        Args:
+            event (str): The SSE event name.
+            data (dict): The JSON payload.
+        """
+        self.queue.put_nowait((event, data))
+
+
+class StreamingCallback(GlobalSearchLLMCallback):
+    """
+    Engine callback that forwards LLM tokens and map progress to the streamed search, if any.
+
+    One instance serves every query of an engine, so it keeps no state of its own: events go
+    to the SearchStream of the task that produced them, and are dropped when the search is
+    not being streamed.
+    """
+
+    def on_llm_new_token(self, token):
+        stream = _current_stream.get()
+        if stream is not None:
+            stream.emit("token", {"token": token})
+
+    def on_map_response_start(self, map_response_contexts):
+        stream = _current_stream.get()
+        if stream is not None:
+            stream.map_total = len(map_response_contexts)
+            stream.emit("map_progress", {"done": stream.map_done, "total": stream.map_total})
+
+    def on_map_response_end(self, map_response_outputs):
+        pass
+
+
+def is_streamed():
+    """Return whether the search running in the current task is being streamed."""
+    return _current_stream.get() is not None
+
+
+def map_batch_done():
+    """Report one finished map batch to the streamed search, if any."""
+    stream = _current_stream.get()
+    if stream is not None:
+        stream.map_done += 1
+        stream.emit("map_progress", {"done": stream.map_done, "total": stream.map_total})
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def stream_search(search):
+    """
+    Run a search and yield its progress as server-sent events.
+
+    Events are `map_progress` ({"done", "total"}, global search only), `token` ({"token"})
+    while the answer is generated, then one `done` event with the response, `llm_calls`,
+    `prompt_tokens` and the other counters of the result, or an `error` event. An answer
+    served from a cache produces no tokens, only the `done` event.
+
+    Events reach the stream through the context of the task running the search. A search
+    shared by concurrent identical requests (see `response_cache.acached_search`) runs in
+    the context of the request that started it, so streamed searches are never shared:
+    each one runs its own search and gets all of its events.
+
+    Args:
+        search (callable): Coroutine function without arguments returning the response dict.
+
+    Yields:
+        str: Encoded SSE events.
+    """
+    stream = SearchStream()
+    token = _current_stream.set(stream)
+    try:
+        # the task copies the current context, and with it the stream
+        task = asyncio.create_task(search())
+    finally:
+        _current_stream.reset(token)
+    task.add_done_callback(lambda _: stream.queue.put_nowait(_DONE))
+
+    while True:
+        item = await stream.queue.get()
+        if item is _DONE:
+            break
+        yield _sse(*item)
+
+    try:
+        response = task.result()
+    except EngineNotReadyError as e:
+        yield _sse("error", {"status": 503, "detail": str(e)})
+        return
+    except Exception as e:
+        logger.exception("Streamed search failed")
+        yield _sse("error", {"status": 500, "detail": str(e)})
+        return
+    yield _sse("done", {key: value for key, value in response.items() if key != "context_data"})
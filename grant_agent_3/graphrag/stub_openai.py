@@ -0,0 +1,297 @@
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import threading
+import time
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from caching import LRUCache
+
+HOST = "127.0.0.1"
+PORT = 8100
+DIMENSIONS = 1536
+LATENCY_MS = 300.0
+LATENCY_SIGMA = 0.25
+TOKENS_PER_SECOND = 50.0
+COMPLETION_TOKENS = 150
+EMBEDDING_LATENCY_MS = 20.0
+# Request bodies whose attempts are remembered; a body evicted from here starts again at attempt 0
+ATTEMPT_ENTRIES = 100_000
+
+WORDS = (
+    "grant funding eligibility applicants research innovation program support project community "
+    "health education partners deadline budget criteria sponsor proposal impact outcomes canada "
+    "organizations small business nonprofit province federal matching contribution application"
+).split()
+
+
+def stand_in_embedding(text, dimensions=DIMENSIONS):
+    """
+    Return the deterministic embedding of a text: a unit vector seeded by its hash.
+
+    Args:
+        text (str): The text.
+        dimensions (int): The vector size.
+
+    Returns:
+        ndarray: The float32 unit vector.
+    """
+    seed = int(hashlib.sha256(text.encode()).hexdigest()[:8], 16)
+    vector = np.random.default_rng(seed).standard_normal(dimensions)
+    return (vector / np.linalg.norm(vector)).astype(np.float32)
+
+
+def _digest(*parts):
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).digest()
+
+
+class StubSettings:
+    """The latency, throughput and failure model of the stand-in server."""
+
+    def __init__(self, latency_ms=LATENCY_MS, latency_sigma=LATENCY_SIGMA, tokens_per_second=TOKENS_PER_SECOND,
+                 completion_tokens=COMPLETION_TOKENS, embedding_latency_ms=EMBEDDING_LATENCY_MS,
+                 error_rate=0.0, error_statuses=(429,), dimensions=DIMENSIONS, seed=0):
+        """
+        Args:
+            latency_ms (float): The median time to the first token.
+            latency_sigma (float): The sigma of the log-normal latency; 0 for a fixed latency.
+            tokens_per_second (float): The generation speed after the first token; 0 for instant.
+            completion_tokens (int): The answer length, capped by the request's max_tokens.
+            embedding_latency_ms (float): The median latency of an embedding request.
+            error_rate (float): The share of requests answered with an error.
+            error_statuses (tuple): The error statuses, picked per failed request.
+            dimensions (int): The embedding size.
+            seed (int): Seeds every random choice, so a run can be repeated exactly.
+        """
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.tokens_per_second = tokens_per_second
+        self.completion_tokens = completion_tokens
+        self.embedding_latency_ms = embedding_latency_ms
+        self.error_rate = error_rate
+        self.error_statuses = tuple(error_statuses)
+        self.dimensions = dimensions
+        self.seed = seed
+
+
+class StubState:
+    """
+    Draws the latency and failures of each request, and counts what was served.
+
+    Latency and error draws are seeded by the settings seed, the request body and how often
+    that body was seen, so a retried request can succeed and a replayed run fails the same
+    requests. Answers are seeded by the settings seed and the body alone, so a request gets
+    the same answer on every attempt. Attempts are remembered for the last ATTEMPT_ENTRIES
+    distinct bodies, so a long load test does not grow the server without bound.
+    """
+
+    def __init__(self, settings):
+        self.settings = settings
+        self._attempts = LRUCache(ATTEMPT_ENTRIES)
+        self._lock = threading.Lock()
+        self.counts = {"chat": 0, "embeddings": 0, "errors": 0, "completion_tokens": 0}
+
+    def rng(self, body):
+        key = _digest(body)
+        with self._lock:
+            attempt = self._attempts.get(key, 0)
+            self._attempts.put(key, attempt + 1)
+        return np.random.default_rng(int.from_bytes(_digest(self.settings.seed, key.hex(), attempt)[:8], "big"))
+
+    def answer_rng(self, body):
+        return np.random.default_rng(int.from_bytes(_digest(self.settings.seed, _digest(body).hex())[:8], "big"))
+
+    def latency(self, rng, median_ms):
+        sigma = self.settings.latency_sigma
+        factor = float(np.exp(rng.normal(0.0, sigma))) if sigma > 0 else 1.0
+        return median_ms * factor / 1000
+
+    def error(self, rng):
+        if rng.random() >= self.settings.error_rate:
+            return None
+        with self._lock:
+            self.counts["errors"] += 1
+        status = self.settings.error_statuses[int(rng.integers(len(self.settings.error_statuses)))]
+        return JSONResponse(
+            status_code=status,
+            content={"error": {"message": f"Injected stand-in error {status}", "type": "stub_error"}},
+            headers={"retry-after-ms": "100"},
+        )
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counts[name] += amount
+
+
+def _prompt_tokens(messages):
+    return sum(len(str(message.get("content") or "")) for message in messages) // 4
+
+
+def _answer(body, rng, settings):
+    """Return the deterministic answer of a chat request, as a list of tokens."""
+    limit = body.get("max_tokens") or body.get("max_completion_tokens") or settings.completion_tokens
+    length = max(1, min(settings.completion_tokens, limit))
+    if (body.get("response_format") or {}).get("type") == "json_object":
+        points = [
+            {"description": " ".join(rng.choice(WORDS, 12)) + ".", "score": int(rng.integers(1, 101))}
+            for _ in range(max(1, length // 40))
+        ]
+        text = json.dumps({"points": points})
+        # stream JSON in word-sized pieces, like a model would
+        return [piece + " " for piece in text.split(" ")[:-1]] + [text.split(" ")[-1]]
+    words = list(rng.choice(WORDS, length))
+    return [word + ("." if i % 12 == 11 else "") + " " for i, word in enumerate(words)]
+
+
+def _chunk(completion_id, model, created, delta, finish_reason=None):
+    return "data: " + json.dumps({
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": created,
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }) + "\n\n"
+
+
+def create_app(settings):
+    """
+    Build the stand-in for the OpenAI chat completions and embeddings endpoints.
+
+    Args:
+        settings (StubSettings): The latency, throughput and failure model.
+
+    Returns:
+        FastAPI: The app; its `state.stub` holds the StubState.
+    """
+    app = FastAPI()
+    state = app.state.stub = StubState(settings)
+
+    @app.get("/v1/stats")
+    def stats():
+        return state.counts
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        rng = state.rng(body)
+        failure = state.error(rng)
+        if failure is not None:
+            return failure
+        first_token = state.latency(rng, settings.latency_ms)
+        tokens = _answer(body, state.answer_rng(body), settings)
+        per_token = 1 / settings.tokens_per_second if settings.tokens_per_second > 0 else 0.0
+        state.count("chat")
+        state.count("completion_tokens", len(tokens))
+
+        model = body.get("model", "stand-in")
+        created = int(time.time())
+        completion_id = "chatcmpl-" + _digest(body).hex()[:24]
+        usage = {
+            "prompt_tokens": _prompt_tokens(body.get("messages", [])),
+            "completion_tokens": len(tokens),
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+
+        if not body.get("stream"):
+            await asyncio.sleep(first_token + per_token * (len(tokens) - 1))
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(tokens).strip()},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage,
+            }
+
+        async def events():
+            await asyncio.sleep(first_token)
+            yield _chunk(completion_id, model, created, {"role": "assistant", "content": ""})
+            for i, token in enumerate(tokens):
+                if i and per_token:
+                    await asyncio.sleep(per_token)
+                yield _chunk(completion_id, model, created, {"content": token})
+            yield _chunk(completion_id, model, created, {}, finish_reason="stop")
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        rng = state.rng(body)
+        failure = state.error(rng)
+        if failure is not None:
+            return failure
+        texts = body.get("input", [])
+        texts = [texts] if isinstance(texts, str) else texts
+        # token arrays are embedded by their string form; only the vector's determinism matters here
+        texts = [text if isinstance(text, str) else json.dumps(text) for text in texts]
+        dimensions = body.get("dimensions") or settings.dimensions
+        await asyncio.sleep(state.latency(rng, settings.embedding_latency_ms))
+        state.count("embeddings", len(texts))
+
+        data = []
+        for i, text in enumerate(texts):
+            vector = stand_in_embedding(text, dimensions)
+            if body.get("encoding_format") == "base64":
+                embedding = base64.b64encode(vector.astype("<f4").tobytes()).decode()
+            else:
+                embedding = vector.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+        prompt_tokens = sum(len(text) for text in texts) // 4
+        return {
+            "object": "list",
+            "data": data,
+            "model": body.get("model", "stand-in"),
+            "usage": {"prompt_tokens": prompt_tokens, "total_tokens": prompt_tokens},
+        }
+
+    return app
+
+
+def main():
+    """Serve an offline, OpenAI-compatible stand-in for chat completions and embeddings."""
+    parser = argparse.ArgumentParser(
+        description="Serve an OpenAI-compatible stand-in. Point clients at it with "
+                    "OPENAI_BASE_URL=http://HOST:PORT/v1.")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--latency-ms", type=float, default=LATENCY_MS, help="Median time to the first token.")
+    parser.add_argument("--latency-sigma", type=float, default=LATENCY_SIGMA,
+                        help="Sigma of the log-normal latency; 0 for a fixed latency.")
+    parser.add_argument("--tokens-per-second", type=float, default=TOKENS_PER_SECOND,
+                        help="Generation speed after the first token; 0 for instant.")
+    parser.add_argument("--completion-tokens", type=int, default=COMPLETION_TOKENS)
+    parser.add_argument("--embedding-latency-ms", type=float, default=EMBEDDING_LATENCY_MS)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with an error.")
+    parser.add_argument("--error-statuses", type=int, nargs="+", default=[429])
+    parser.add_argument("--dimensions", type=int, default=DIMENSIONS)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    settings = StubSettings(
+        latency_ms=args.latency_ms,
+        latency_sigma=args.latency_sigma,
+        tokens_per_second=args.tokens_per_second,
+        completion_tokens=args.completion_tokens,
+        embedding_latency_ms=args.embedding_latency_ms,
+        error_rate=args.error_rate,
+        error_statuses=args.error_statuses,
+        dimensions=args.dimensions,
+        seed=args.seed,
+    )
+    uvicorn.run(create_app(settings), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
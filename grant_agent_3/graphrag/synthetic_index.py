@@ -0,0 +1,233 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from stub_openai import WORDS
+
+RELATIONSHIPS_PER_ENTITY = 2.0
+ENTITIES_PER_TEXT_UNIT = 4
+# Level 0 communities hold about this many entities; each deeper level splits every community
+ENTITIES_PER_COMMUNITY = 1_000
+COMMUNITY_LEVELS = 3
+COMMUNITY_SPLIT = 4
+# Share of relationships whose endpoints sit in the same finest-level community
+LOCALITY = 0.7
+TEXT_UNIT_WORDS = 220
+DIMENSIONS = 128
+ENTITY_TYPES = ["ORGANIZATION", "GRANT", "PROGRAM", "GRANT_CATEGORY", "LOCATION", "PERSON"]
+SENTENCE_POOL = 512
+
+
+def _sentence_pool(rng):
+    return [" ".join(rng.choice(WORDS, 12)).capitalize() + "." for _ in range(SENTENCE_POOL)]
+
+
+def _text(pool, index, sentences):
+    return " ".join(pool[(index * 7 + j * 13) % len(pool)] for j in range(sentences))
+
+
+def _grouped(keys, values, n_groups):
+    """Group `values` by integer `keys` into a list array with one row per key."""
+    order = np.argsort(keys, kind="stable")
+    offsets = np.zeros(n_groups + 1, dtype=np.int64)
+    np.cumsum(np.bincount(keys, minlength=n_groups), out=offsets[1:])
+    return pa.LargeListArray.from_arrays(pa.array(offsets), pa.array(values[order]))
+
+
+def _ids(prefix, numbers):
+    return np.char.add(prefix, np.asarray(numbers).astype(str)).astype(object)
+
+
+def _hex_ids(rng, count):
+    """Return `count` random 32-digit hex ids, shaped like the UUIDs the indexer writes."""
+    raw = rng.bytes(16 * count)
+    return np.asarray([raw[i:i + 16].hex() for i in range(0, len(raw), 16)], dtype=object)
+
+
+def community_sizes(n_entities):
+    """
+    Return the number of communities at each level for a graph size.
+
+    Args:
+        n_entities (int): The number of entities.
+
+    Returns:
+        list: The community count of each level, coarsest first.
+    """
+    top = max(1, n_entities // ENTITIES_PER_COMMUNITY)
+    return [top * COMMUNITY_SPLIT ** level for level in range(COMMUNITY_LEVELS)]
+
+
+def generate(output_dir, n_entities, seed=0, dimensions=DIMENSIONS):
+    """
+    Write a synthetic index run: the `create_final_*` tables the search engines read, and stats.json.
+
+    Entities sit in nested communities (COMMUNITY_LEVELS levels, each splitting the one above
+    into COMMUNITY_SPLIT). Relationship sources are drawn from a heavy-tailed distribution,
+    so a few hub entities have most of the edges, and LOCALITY of the edges stay inside a
+    finest-level community. Text units, reports and description embeddings follow the
+    communities, so a query selects a coherent neighbourhood, as with a real extraction.
+    Text is sampled from a small vocabulary; only its volume is realistic.
+
+    Args:
+        output_dir (str): The artifacts directory to write.
+        n_entities (int): The number of entities.
+        seed (int): Seeds the generator; the same seed writes the same tables.
+        dimensions (int): The size of the description embeddings.
+
+    Returns:
+        dict: The row count of each table.
+    """
+    started = time.perf_counter()
+    rng = np.random.default_rng(seed)
+    pool = _sentence_pool(rng)
+    n = n_entities
+    n_relationships = int(n * RELATIONSHIPS_PER_ENTITY)
+    n_units = max(1, n // ENTITIES_PER_TEXT_UNIT)
+    levels = community_sizes(n)
+    offsets = np.cumsum([0] + levels[:-1])
+
+    # An entity's position in `order` decides its community at every level
+    order = rng.permutation(n)
+    position = np.empty(n, dtype=np.int64)
+    position[order] = np.arange(n)
+    finest = levels[-1]
+    community = position * finest // n
+
+    hubs = rng.permutation(n)
+    source = hubs[(n * rng.random(n_relationships) ** 3).astype(np.int64)]
+    local = rng.random(n_relationships) < LOCALITY
+    member_lo = -(-community[source] * n // finest)
+    member_hi = -(-(community[source] + 1) * n // finest)
+    target = np.where(
+        local,
+        order[np.minimum(member_lo + (rng.random(n_relationships) * (member_hi - member_lo)).astype(np.int64), n - 1)],
+        rng.integers(0, n, n_relationships))
+    loops = source == target
+    target[loops] = (target[loops] + 1) % n
+    degree = np.bincount(source, minlength=n) + np.bincount(target, minlength=n)
+    unit = np.minimum(position[source] * n_units // n + rng.integers(0, 2, n_relationships), n_units - 1)
+
+    titles = _ids("ENTITY ", np.arange(n))
+    entity_ids = _hex_ids(rng, n)
+    relationship_ids = _hex_ids(rng, n_relationships)
+    unit_ids = _hex_ids(rng, n_units)
+    document_ids = _hex_ids(rng, n_units // 10 + 1)
+    types = np.asarray(ENTITY_TYPES, dtype=object)[rng.integers(0, len(ENTITY_TYPES), n)]
+    descriptions = [
+        f"{titles[i]} is a {types[i].lower().replace('_', ' ')}. {pool[i % len(pool)]}" for i in range(n)]
+
+    # Every entity appears in the text unit of its own position, and in those of its relationships
+    pairs = np.unique(np.concatenate([
+        source * n_units + unit,
+        target * n_units + unit,
+        np.arange(n) * n_units + position * n_units // n,
+    ]))
+    pair_entity, pair_unit = pairs // n_units, pairs % n_units
+
+    centroids = rng.standard_normal((finest, dimensions), dtype=np.float32)
+    vectors = centroids[community] + 0.5 * rng.standard_normal((n, dimensions), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    embeddings = pa.FixedSizeListArray.from_arrays(pa.array(vectors.ravel()), dimensions).cast(
+        pa.large_list(pa.float32()))
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    def write(name, columns):
+        pq.write_table(pa.table(columns), os.path.join(output_dir, f"{name}.parquet"))
+
+    write("create_final_entities", {
+        "id": entity_ids,
+        "name": titles,
+        "type": types,
+        "description": descriptions,
+        "human_readable_id": np.arange(n),
+        "text_unit_ids": _grouped(pair_entity, unit_ids[pair_unit], n),
+        "description_embedding": embeddings,
+    })
+    write("create_final_nodes", {
+        "level": np.repeat(np.arange(COMMUNITY_LEVELS), n),
+        "title": np.tile(titles, COMMUNITY_LEVELS),
+        "type": np.tile(types, COMMUNITY_LEVELS),
+        "degree": np.tile(degree, COMMUNITY_LEVELS),
+        "human_readable_id": np.tile(np.arange(n), COMMUNITY_LEVELS),
+        "id": np.tile(entity_ids, COMMUNITY_LEVELS),
+        "community": np.concatenate([
+            (position * size // n + offset).astype(str).astype(object) for size, offset in zip(levels, offsets)]),
+    })
+    write("create_final_relationships", {
+        "source": titles[source],
+        "target": titles[target],
+        "weight": np.round(rng.uniform(1, 10, n_relationships)),
+        "description": [
+            f"{titles[s]} works with {titles[t]}. {pool[i % len(pool)]}"
+            for i, (s, t) in enumerate(zip(source.tolist(), target.tolist()))],
+        "text_unit_ids": pa.LargeListArray.from_arrays(
+            pa.array(np.arange(n_relationships + 1)), pa.array(unit_ids[unit])),
+        "id": relationship_ids,
+        "human_readable_id": np.arange(n_relationships).astype(str).astype(object),
+        "source_degree": degree[source],
+        "target_degree": degree[target],
+        "rank": degree[source] + degree[target],
+    })
+    sentences = TEXT_UNIT_WORDS // 12
+    write("create_final_text_units", {
+        "id": unit_ids,
+        "text": [_text(pool, i, sentences) for i in range(n_units)],
+        "n_tokens": np.full(n_units, TEXT_UNIT_WORDS * 4 // 3),
+        "document_ids": pa.LargeListArray.from_arrays(
+            pa.array(np.arange(n_units + 1)), pa.array(document_ids[np.arange(n_units) // 10])),
+        "entity_ids": _grouped(pair_unit, entity_ids[pair_entity], n_units),
+        "relationship_ids": _grouped(unit, relationship_ids, n_units),
+    })
+
+    report_level = np.concatenate([np.full(size, level) for level, size in enumerate(levels)])
+    n_reports = len(report_level)
+    report_titles = [f"Community {i} grants and partners" for i in range(n_reports)]
+    summaries = [_text(pool, i, 3) for i in range(n_reports)]
+    write("create_final_community_reports", {
+        "community": np.arange(n_reports).astype(str).astype(object),
+        "full_content": [
+            f"# {title}\n\n{summary}\n\n## Funding\n\n{_text(pool, i + 1, 8)}\n\n## Eligibility\n\n{_text(pool, i + 2, 8)}"
+            for i, (title, summary) in enumerate(zip(report_titles, summaries))],
+        "level": report_level,
+        "rank": np.round(rng.uniform(1, 10, n_reports), 1),
+        "title": report_titles,
+        "rank_explanation": [pool[i % len(pool)] for i in range(n_reports)],
+        "summary": summaries,
+        "id": _hex_ids(rng, n_reports),
+    })
+
+    counts = {
+        "entities": n,
+        "relationships": n_relationships,
+        "text_units": n_units,
+        "community_reports": n_reports,
+        "communities_per_level": levels,
+    }
+    with open(os.path.join(output_dir, "stats.json"), "w") as f:
+        json.dump({
+            "total_runtime": time.perf_counter() - started,
+            "synthetic": {**counts, "seed": seed, "dimensions": dimensions},
+        }, f, indent=4)
+    return counts
+
+
+def main():
+    """Write a synthetic index run."""
+    parser = argparse.ArgumentParser(description="Generate synthetic create_final_* artifacts.")
+    parser.add_argument("output_dir", help="The artifacts directory to write.")
+    parser.add_argument("--entities", type=int, default=10_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--dimensions", type=int, default=DIMENSIONS)
+    args = parser.parse_args()
+    print(json.dumps(generate(args.output_dir, args.entities, args.seed, args.dimensions)))
+
+
+if __name__ == "__main__":
+    main()
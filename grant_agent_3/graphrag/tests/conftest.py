@@ -0,0 +1,35 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+from graphrag.query.indexer_adapters import (
+    read_indexer_entities,
+    read_indexer_relationships,
+    read_indexer_reports,
+    read_indexer_text_units,
+)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The index run checked into the repo; the checks compare against graphrag 0.1.1 on it
+ARTIFACTS = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "ragtest", "output", "20240704-184122", "artifacts")
+COMMUNITY_LEVEL = 2
+
+
+def _table(name):
+    return pd.read_parquet(os.path.join(ARTIFACTS, f"{name}.parquet"))
+
+
+@pytest.fixture(scope="session")
+def index():
+    """The entities, relationships, text units and reports of the index run, as local search reads them."""
+    nodes = _table("create_final_nodes")
+    return {
+        "entities": read_indexer_entities(nodes, _table("create_final_entities"), COMMUNITY_LEVEL),
+        "relationships": read_indexer_relationships(_table("create_final_relationships")),
+        "text_units": read_indexer_text_units(_table("create_final_text_units")),
+        "reports": read_indexer_reports(_table("create_final_community_reports"), nodes, COMMUNITY_LEVEL),
+    }
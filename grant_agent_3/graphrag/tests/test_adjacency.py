@@ -0,0 +1,50 @@
+import random
+
+import pytest
+from graphrag.query.context_builder.local_context import _filter_relationships
+from graphrag.query.context_builder.source_context import count_relationships
+
+from adjacency import LocalAdjacency
+from context_builders import select_relationships
+
+SEEDS = range(20)
+
+
+@pytest.fixture(scope="module")
+def adjacency(index):
+    return LocalAdjacency(index["entities"], index["relationships"], index["text_units"])
+
+
+def selection(entities, seed):
+    """The entities mapped for one query: the top-ranked few for seed 0, a random few otherwise."""
+    if seed == 0:
+        return sorted(entities, key=lambda entity: -entity.rank)[:10]
+    rng = random.Random(seed)
+    return rng.sample(entities, rng.randint(1, 15))
+
+
+def chosen(relationships):
+    # Both selections write "links" into the relationships they return; read it back right away
+    return [(rel.id, (rel.attributes or {}).get("links")) for rel in relationships]
+
+
+@pytest.mark.parametrize("top_k", [1, 10])
+@pytest.mark.parametrize("seed", SEEDS)
+def test_selection_matches_filter_relationships(index, adjacency, seed, top_k):
+    selected = selection(index["entities"], seed)
+    expected = chosen(_filter_relationships(
+        selected, list(index["relationships"]), top_k_relationships=top_k))
+    actual = chosen(select_relationships(
+        selected, adjacency.relationships_of(selected), top_k_relationships=top_k))
+    assert actual == expected
+
+
+def test_text_unit_counts_match_count_relationships(index, adjacency):
+    units_by_id = {unit.id: unit for unit in index["text_units"]}
+    relationships_by_id = {rel.id: rel for rel in index["relationships"]}
+    for entity in index["entities"]:
+        positions, counts = adjacency.text_units_of(entity)
+        units = [units_by_id[unit_id] for unit_id in dict.fromkeys(entity.text_unit_ids or [])
+                 if unit_id in units_by_id]
+        assert [adjacency.text_units[position].id for position in positions] == [unit.id for unit in units]
+        assert counts.tolist() == [count_relationships(unit, entity, relationships_by_id) for unit in units]
@@ -0,0 +1,78 @@
+import itertools
+import random
+
+import pytest
+from graphrag.query.context_builder.community_context import build_community_context
+from graphrag.query.context_builder.local_context import build_entity_context, build_relationship_context
+from graphrag.query.context_builder.source_context import build_text_unit_context
+
+from token_counts import (
+    CountingTokenEncoder,
+    TokenCounter,
+    entity_rows,
+    get_token_encoder,
+    relationship_rows,
+    report_rows,
+    text_unit_rows,
+)
+
+
+@pytest.fixture(scope="module")
+def counting_encoder(index):
+    # Precomputed the way the local and global engines do at load time
+    counter = TokenCounter(get_token_encoder())
+    counter.precompute(itertools.chain(
+        entity_rows(index["entities"]),
+        relationship_rows(index["relationships"]),
+        text_unit_rows(index["text_units"]),
+        report_rows(index["reports"]),
+        report_rows(index["reports"], include_community_rank=True),
+    ))
+    return CountingTokenEncoder(get_token_encoder(), counter)
+
+
+def tiktoken_count(text):
+    return len(get_token_encoder().encode(text))
+
+
+def contexts(index, token_encoder, seed):
+    """Render every upstream context table for one random selection, measured by `token_encoder`."""
+    rng = random.Random(seed)
+    entities = rng.sample(index["entities"], 10)
+    names = {entity.title for entity in entities}
+    relationships = [rel for rel in index["relationships"] if rel.source in names or rel.target in names]
+    yield build_entity_context(entities, token_encoder, max_tokens=2_000)[0]
+    yield build_relationship_context(entities, relationships, token_encoder, max_tokens=2_000)[0]
+    yield build_text_unit_context(
+        rng.sample(index["text_units"], 10), token_encoder, max_tokens=6_000)[0]
+    for include_community_rank in (False, True):
+        yield build_community_context(
+            index["reports"], index["entities"], token_encoder, use_community_summary=False,
+            include_community_rank=include_community_rank, max_tokens=12_000, single_batch=False)[0]
+
+
+def test_precomputed_rows_match_tiktoken(index, counting_encoder):
+    rows = itertools.chain(
+        entity_rows(index["entities"]),
+        relationship_rows(index["relationships"]),
+        text_unit_rows(index["text_units"]),
+        report_rows(index["reports"], include_community_rank=True),
+    )
+    for row in rows:
+        assert counting_encoder.counter.count(row) == tiktoken_count(row)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_upstream_contexts_match_tiktoken(index, counting_encoder, seed):
+    counted = list(contexts(index, counting_encoder, seed))
+    # The token budgets cut the tables at the same rows as with tiktoken itself
+    assert counted == list(contexts(index, get_token_encoder(), seed))
+    for text in counted:
+        for table in text if isinstance(text, list) else [text]:
+            assert len(counting_encoder.encode(table)) == tiktoken_count(table)
+
+
+def test_unseen_text_matches_tiktoken(counting_encoder):
+    text = "-----Conversation-----\nturn|role|content\n1|user|Which grants fund rural clinics?\n"
+    assert len(counting_encoder.encode(text)) == tiktoken_count(text)
+    assert len(counting_encoder.encode(text)) == tiktoken_count(text)
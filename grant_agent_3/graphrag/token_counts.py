@@ -0,0 +1,312 @@
+import os
+import re
+import threading
+from collections.abc import Sequence
+
+import numpy as np
+import tiktoken
+
+from caching import LRUCache
+
+TOKEN_ENCODING = os.getenv("GRAPHRAG_TOKEN_ENCODING", "cl100k_base")
+# Bound on the rows counted at query time, e.g. relationships carrying a per-query "links" column
+DYNAMIC_ENTRIES = int(os.getenv("GRAPHRAG_TOKEN_COUNT_DYNAMIC_ENTRIES", "100000"))
+
+# tiktoken's pre-tokenizer always ends a pre-token at a newline followed by a non-space
+# character, and BPE never merges across pre-tokens. The token count of a context table is
+# therefore exactly the sum of the counts of its rows split at those points.
+_ROW_BOUNDARY = re.compile(r"(?<=\n)(?=\S)")
+
+_encoder = None
+_encoder_lock = threading.Lock()
+
+
+def get_token_encoder():
+    """
+    Return the process-wide tiktoken encoder shared by every search engine.
+
+    Returns:
+        tiktoken.Encoding: The GRAPHRAG_TOKEN_ENCODING encoder (cl100k_base by default).
+    """
+    global _encoder
+    with _encoder_lock:
+        if _encoder is None:
+            _encoder = tiktoken.get_encoding(TOKEN_ENCODING)
+        return _encoder
+
+
+def split_rows(text):
+    """
+    Split text at the points where a tokenizer pre-token always ends.
+
+    Args:
+        text (str): The text, typically a pipe-delimited context table.
+
+    Returns:
+        list: The pieces; their token counts add up to the token count of `text`.
+    """
+    return [piece for piece in _ROW_BOUNDARY.split(text) if piece]
+
+
+class TokenCounter:
+    """
+    Token counts of context rows, computed once per index run.
+
+    Rows rendered at load time are kept as two compact arrays: sorted row hashes (int64) and
+    their token counts (int32). Rows that only appear at query time are counted once and kept
+    in a bounded LRU. Counting a whole context is then a hash lookup per row.
+    """
+
+    def __init__(self, token_encoder, dynamic_entries=DYNAMIC_ENTRIES):
+        self.token_encoder = token_encoder
+        # (hashes, counts), replaced as a whole so lock-free readers never see one without the other
+        self._table = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int32))
+        self.dynamic = LRUCache(dynamic_entries)
+        self._lock = threading.Lock()
+
+    def _encode_counts(self, pieces):
+        if hasattr(self.token_encoder, "encode_batch"):
+            return [len(tokens) for tokens in self.token_encoder.encode_batch(pieces)]
+        return [len(self.token_encoder.encode(piece)) for piece in pieces]
+
+    def precompute(self, texts):
+        """
+        Count the rows of `texts` and add them to the compact arrays.
+
+        Args:
+            texts (iterable): Rendered rows or whole context tables.
+        """
+        pieces = {}
+        for text in texts:
+            for piece in split_rows(text):
+                pieces.setdefault(hash(piece), piece)
+        with self._lock:
+            known = set(self._table[0].tolist())
+        missing = [(key, piece) for key, piece in pieces.items() if key not in known]
+        if not missing:
+            return
+        # Rows already counted at query time are moved over instead of being encoded again
+        counts = [self.dynamic.pop(piece) for _, piece in missing]
+        unknown = [index for index, count in enumerate(counts) if count is None]
+        for index, count in zip(unknown, self._encode_counts([missing[i][1] for i in unknown])):
+            counts[index] = count
+        hashes = np.fromiter((key for key, _ in missing), dtype=np.int64, count=len(missing))
+        counts = np.asarray(counts, dtype=np.int32)
+        with self._lock:
+            known_hashes, known_counts = self._table
+            hashes = np.concatenate([known_hashes, hashes])
+            counts = np.concatenate([known_counts, counts])
+            order = np.argsort(hashes, kind="stable")
+            self._table = (hashes[order], counts[order])
+
+    def count(self, text):
+        """
+        Count the tokens of `text`, tokenizing only rows that were never seen before.
+
+        Args:
+            text (str): The text.
+
+        Returns:
+            int: The number of tokens.
+        """
+        pieces = split_rows(text)
+        if not pieces:
+            return 0
+        total = 0
+        missing = range(len(pieces))
+        hashes, counts = self._table
+        if len(hashes):
+            keys = np.fromiter(map(hash, pieces), dtype=np.int64, count=len(pieces))
+            positions = np.minimum(np.searchsorted(hashes, keys), len(hashes) - 1)
+            found = hashes[positions] == keys
+            total = int(counts[positions[found]].sum())
+            missing = np.flatnonzero(~found)
+        for index in missing:
+            piece = pieces[index]
+            count = self.dynamic.get(piece)
+            if count is None:
+                count = len(self.token_encoder.encode(piece))
+                self.dynamic.put(piece, count)
+            total += count
+        return total
+
+
+class _TokenList(Sequence):
+    """The tokens of a text, known by count up front and only encoded if indexed or iterated."""
+
+    def __init__(self, token_encoder, text, count):
+        self._token_encoder = token_encoder
+        self._text = text
+        self._count = count
+        self._tokens = None
+
+    def _materialize(self):
+        if self._tokens is None:
+            self._tokens = self._token_encoder.encode(self._text)
+        return self._tokens
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        return self._materialize()[index]
+
+    def __iter__(self):
+        return iter(self._materialize())
+
+
+class CountingTokenEncoder:
+    """
+    Drop-in token encoder whose `encode` answers `len()` from a TokenCounter.
+
+    graphrag measures context with `len(token_encoder.encode(text))`; this encoder makes that
+    an arithmetic sum over precomputed row counts. The actual tokens are still produced, by
+    the wrapped encoder, if a caller indexes or iterates the result.
+    """
+
+    def __init__(self, token_encoder, counter):
+        """
+        Args:
+            token_encoder (tiktoken.Encoding): The real encoder.
+            counter (TokenCounter): The token counts of the index run.
+        """
+        self.token_encoder = token_encoder
+        self.counter = counter
+
+    def encode(self, text, **kwargs):
+        """
+        Encode text lazily.
+
+        Args:
+            text (str): The text.
+
+        Returns:
+            Sequence: The tokens; `len()` is served from the counter.
+        """
+        if kwargs:
+            return self.token_encoder.encode(text, **kwargs)
+        return _TokenList(self.token_encoder, text, self.counter.count(text))
+
+    def __getattr__(self, name):
+        return getattr(self.token_encoder, name)
+
+
+_counters = {}
+_counters_lock = threading.Lock()
+
+
+def get_counting_encoder(input_dir):
+    """
+    Return the counting encoder of an index run, shared by every engine built from it.
+
+    Args:
+        input_dir (str): The artifacts directory of the index run.
+
+    Returns:
+        CountingTokenEncoder: The encoder.
+    """
+    key = os.path.abspath(input_dir)
+    with _counters_lock:
+        if key not in _counters:
+            _counters[key] = CountingTokenEncoder(
+                get_token_encoder(), TokenCounter(get_token_encoder()))
+        return _counters[key]
+
+
+def release_counting_encoder(input_dir):
+    """
+    Forget the token counts of an index run.
+
+    Args:
+        input_dir (str): The artifacts directory of the index run.
+    """
+    with _counters_lock:
+        _counters.pop(os.path.abspath(input_dir), None)
+
+
+def _cells(values):
+    return [str(value) if value else "" for value in values]
+
+
+def entity_rows(entities, column_delimiter="|"):
+    """
+    Render entities the way the local search entity table does, with the entity rank.
+
+    Args:
+        entities (list): Entity instances.
+        column_delimiter (str): The column delimiter.
+
+    Returns:
+        list: One row per entity.
+    """
+    return [
+        column_delimiter.join([
+            entity.short_id or "", entity.title, entity.description or "", str(entity.rank),
+            *_cells((entity.attributes or {}).values()),
+        ]) + "\n"
+        for entity in entities
+    ]
+
+
+def relationship_rows(relationships, column_delimiter="|"):
+    """
+    Render relationships the way the local search relationship table does, with the weight.
+
+    Args:
+        relationships (list): Relationship instances.
+        column_delimiter (str): The column delimiter.
+
+    Returns:
+        list: One row per relationship.
+    """
+    return [
+        column_delimiter.join([
+            relationship.short_id or "", relationship.source, relationship.target,
+            relationship.description or "", str(relationship.weight or ""),
+            *_cells((relationship.attributes or {}).values()),
+        ]) + "\n"
+        for relationship in relationships
+    ]
+
+
+def text_unit_rows(text_units, column_delimiter="|"):
+    """
+    Render text units the way the local search sources table does.
+
+    Args:
+        text_units (list): TextUnit instances.
+        column_delimiter (str): The column delimiter.
+
+    Returns:
+        list: One row per text unit.
+    """
+    return [
+        column_delimiter.join([
+            str(unit.short_id), unit.text,
+            *[str(value) for value in (unit.attributes or {}).values()],
+        ]) + "\n"
+        for unit in text_units
+    ]
+
+
+def report_rows(reports, include_community_rank=False, column_delimiter="|"):
+    """
+    Render community reports the way the report tables do, with full content.
+
+    Args:
+        reports (list): CommunityReport instances.
+        include_community_rank (bool): Append the report rank, as global search does.
+        column_delimiter (str): The column delimiter.
+
+    Returns:
+        list: One row per report.
+    """
+    return [
+        column_delimiter.join([
+            str(report.short_id), report.title,
+            *[str(value) for value in (report.attributes or {}).values()],
+            report.full_content,
+            *([str(report.rank)] if include_community_rank else []),
+        ]) + "\n"
+        for report in reports
+    ]